@@ -11,6 +11,11 @@
 #-h)--host -> host to connect to the database 
 #-U)--user -> User name to log in into the database
 
+# Optionally
+#-m)--migrate -> Don't create the database, apply 00_PostgresMigration.sql (indexes,
+#                comments partitioned by date and aggregate by video and language) to
+#                the existing one. No value is expected
+
 # Note: Password will be required and database creation confirmation
 
 set -e
@@ -31,6 +36,8 @@ ShowArguments() {
 
 declare -A ARGUMENTS
 
+MIGRATE="No"
+
 while [ $# -gt 0 ]; do
 
 	ARGUMENTS[$1]=$2
@@ -44,6 +51,11 @@ while [ $# -gt 0 ]; do
 			USER_POSTGRES=$2
 			shift 2
 			;;
+		-m|--migrate)
+			ARGUMENTS[$1]="Yes"
+			MIGRATE="Yes"
+			shift 1
+			;;
 		*)
 			echo "Invalid argument: $1"
 			exit 1
@@ -53,6 +65,12 @@ done
 
 ShowArguments ARGUMENTS
 
+if [ "$MIGRATE" == "Yes" ]; then
+	psql -U $USER_POSTGRES -h $HOST_POSTGRES -d youtube -v ON_ERROR_STOP=1 \
+		-f "$(dirname "$0")/00_PostgresMigration.sql"
+	exit 0
+fi
+
 printf "WARNING: ANY EXISTING DATABASE WILL BE DROPPED. CONTINUE? [Yes][No]: "
 read INPUT
 
@@ -0,0 +1,134 @@
+-----------------------------------
+----- Migration of the schema -----
+-----------------------------------
+
+-- This script is run by 00_PostgresDataBaseCreate.sh --migrate (or utils/youtube_schema.py)
+-- over the database created by the same script. It can be run several times
+
+-- 1. comments partitioned by year of published_date (postgres >= 11)
+--
+-- Postgres only allows unique constraints that include the partition key and
+-- published_date can be NULL, so id_comment keeps its sequence and an index instead of
+-- the primary key. Comments without date or out of the partitions go to comments_default
+-- (create_comments_partitions, below, moves them when the partition of their year is created)
+
+DO $$
+DECLARE
+	first_year INTEGER;
+	last_year INTEGER;
+	partition_year INTEGER;
+BEGIN
+
+	IF EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid
+			   WHERE c.relname = 'comments') THEN
+		RAISE NOTICE 'comments is already partitioned';
+		RETURN;
+	END IF;
+
+	CREATE TABLE comments_partitioned (
+		id_comment INTEGER NOT NULL DEFAULT nextval('comments_id_comment_seq'),
+		comment text NOT NULL,
+		published_date DATE,
+		likes INTEGER,
+		id_user INTEGER NOT NULL REFERENCES users (id_user),
+		id_video VARCHAR(12) NOT NULL REFERENCES titles (id_video),
+		id_language SMALLINT NOT NULL REFERENCES languages (id_language)
+	) PARTITION BY RANGE (published_date);
+
+	-- One partition by year, from the oldest comment until next year
+	SELECT COALESCE(EXTRACT(YEAR FROM MIN(published_date)), EXTRACT(YEAR FROM CURRENT_DATE))
+	INTO first_year FROM comments;
+	last_year := EXTRACT(YEAR FROM CURRENT_DATE) + 1;
+
+	FOR partition_year IN first_year..last_year LOOP
+		EXECUTE format('CREATE TABLE comments_y%s PARTITION OF comments_partitioned
+						FOR VALUES FROM (%L) TO (%L)',
+					   partition_year, make_date(partition_year, 1, 1), make_date(partition_year + 1, 1, 1));
+	END LOOP;
+
+	CREATE TABLE comments_default PARTITION OF comments_partitioned DEFAULT;
+
+	INSERT INTO comments_partitioned SELECT * FROM comments;
+
+	ALTER TABLE comments RENAME TO comments_unpartitioned;
+	ALTER TABLE comments_partitioned RENAME TO comments;
+	ALTER SEQUENCE comments_id_comment_seq OWNED BY comments.id_comment;
+	DROP TABLE comments_unpartitioned;
+
+END $$;
+
+-- Partitions of the years after the migration. The rows of those years already in
+-- comments_default are moved to the new partition before attaching it (postgres doesn't
+-- attach a partition while the default one holds rows of its range). It's called by
+-- RefreshAggregates (utils/youtube_load.py) after each load, or by hand once a year:
+--     SELECT create_comments_partitions();
+
+CREATE OR REPLACE FUNCTION create_comments_partitions(
+	last_year INTEGER DEFAULT EXTRACT(YEAR FROM CURRENT_DATE)::INTEGER + 1
+) RETURNS INTEGER AS $$
+DECLARE
+	first_year INTEGER;
+	partition_year INTEGER;
+	partition_name TEXT;
+	created INTEGER := 0;
+BEGIN
+
+	IF to_regclass('comments_default') IS NULL THEN
+		RETURN 0;
+	END IF;
+
+	SELECT LEAST(COALESCE(EXTRACT(YEAR FROM MIN(published_date))::INTEGER, last_year), last_year)
+	INTO first_year FROM comments_default;
+
+	FOR partition_year IN first_year..last_year LOOP
+
+		partition_name := format('comments_y%s', partition_year);
+		CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+
+		EXECUTE format('CREATE TABLE %I (LIKE comments INCLUDING DEFAULTS)', partition_name);
+		EXECUTE format('WITH moved AS (DELETE FROM comments_default
+										WHERE published_date >= %L AND published_date < %L RETURNING *)
+						INSERT INTO %I SELECT * FROM moved',
+					   make_date(partition_year, 1, 1), make_date(partition_year + 1, 1, 1), partition_name);
+		EXECUTE format('ALTER TABLE comments ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+					   partition_name, make_date(partition_year, 1, 1), make_date(partition_year + 1, 1, 1));
+
+		created := created + 1;
+	END LOOP;
+
+	RETURN created;
+
+END $$ LANGUAGE plpgsql;
+
+SELECT create_comments_partitions();
+
+-- 2. Indexes of the foreign keys and the dates (created in each partition)
+
+CREATE INDEX IF NOT EXISTS idx_comments_id_comment ON comments (id_comment);
+CREATE INDEX IF NOT EXISTS idx_comments_id_user ON comments (id_user);
+CREATE INDEX IF NOT EXISTS idx_comments_id_video_date ON comments (id_video, published_date);
+CREATE INDEX IF NOT EXISTS idx_comments_id_language ON comments (id_language);
+CREATE INDEX IF NOT EXISTS idx_comments_published_date ON comments (published_date);
+CREATE INDEX IF NOT EXISTS idx_users_name ON users (name);
+
+-- 3. Aggregate by video and language, updated after each load (LoadComments and
+--    IncrementalExtract call RefreshAggregates) with
+--    REFRESH MATERIALIZED VIEW CONCURRENTLY comments_by_video_language;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS comments_by_video_language AS
+	SELECT id_video,
+		   id_language,
+		   COUNT(*) AS n_comments,
+		   COUNT(DISTINCT id_user) AS n_users,
+		   SUM(likes) AS likes,
+		   AVG(LENGTH(comment)) AS mean_length,
+		   MIN(published_date) AS first_date,
+		   MAX(published_date) AS last_date
+	FROM comments
+	GROUP BY id_video, id_language;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_comments_by_video_language
+	ON comments_by_video_language (id_video, id_language);
+
+ANALYZE comments;
+ANALYZE users;
@@ -1,21 +1,153 @@
+import os
+import gc
+import json
+import hashlib
+import threading
 import joblib
-from utils.process_text import CleanText, LemmatizeWithPos
+from time import perf_counter
+from utils.process_text import CleanText, GetPosTagger, LemmatizeTagged, LemmaCacheInfo, word_tokenize
+from utils.prediction_cache import PredictionCache
+from utils.micro_batching import MicroBatcher
+from utils.metrics import Histogram, RenderValues, SamplingProfiler
+from utils.inference import CompactForest
 
 import numpy as np
 
-from flask import Flask, request, render_template, jsonify
+from flask import Flask, Response, g, request, render_template, jsonify
 
 app = Flask(__name__)
 
-# Loading preprocessing techniques and machine learning model
-with open("models/01_tfidf_vectorizer_fitted.joblib", "rb") as vFile:
-    vectorizer = joblib.load(vFile)
+# Folder with the models. MODEL_MMAP_MODE="r" loads the numpy arrays of the models as
+# read-only memory maps (only for uncompressed artifacts) so all the workers share them
+MODELS_PATH = os.environ.get("MODELS_PATH", "models")
+MODEL_MMAP_MODE = os.environ.get("MODEL_MMAP_MODE") or None
 
-with open("models/02_chi2_250_feature_selector_fitted.joblib", "rb") as fsFile:
-    feature_selector = joblib.load(fsFile)
+# The compiled pipeline created by export_model.py (vectorizer and feature selector fused)
+# is used if it exists
+COMPILED_PIPELINE_NAME = "04_compiled_pipeline_fitted.joblib"
 
-with open("models/03_random_forest_model_fitted.joblib", "rb") as rfFile:
-    random_forest_clf = joblib.load(rfFile)
+# FOREST_ENGINE="compact" evaluates the forest with CompactForest (flattened trees, lower
+# latency for a few rows) when a batch has up to COMPACT_FOREST_MAX_ROWS texts. Larger
+# batches are faster with sklearn
+FOREST_ENGINE = os.environ.get("FOREST_ENGINE", "sklearn")
+COMPACT_FOREST_MAX_ROWS = int(os.environ.get("COMPACT_FOREST_MAX_ROWS", "32"))
+
+# Artifacts of each feature pipeline. FEATURE_PIPELINE="hashing" uses the models trained
+# by train_hashing.py (HashingTfidfVectorizer, no vocabulary in memory) instead of the
+# TF-IDF of the notebook. The compiled pipeline is only used with "tfidf"
+FEATURE_PIPELINES = {
+    "tfidf": ("01_tfidf_vectorizer_fitted.joblib",
+              "02_chi2_250_feature_selector_fitted.joblib",
+              "03_random_forest_model_fitted.joblib"),
+    "hashing": ("01_hashing_vectorizer_fitted.joblib",
+                "02_chi2_250_hashed_feature_selector_fitted.joblib",
+                "03_random_forest_hashed_model_fitted.joblib")
+}
+FEATURE_PIPELINE = os.environ.get("FEATURE_PIPELINE", "tfidf")
+
+vectorizer = None
+feature_selector = None
+random_forest_clf = None
+compact_forest = None
+model_fingerprint = ""
+
+def LoadModel(name:str, models_path:str = MODELS_PATH, mmap_mode:str = MODEL_MMAP_MODE):
+
+    # This function loads a model by its file name (needed by joblib to use mmap_mode)
+
+    return joblib.load(os.path.join(models_path, name), mmap_mode = mmap_mode)
+
+def ModelFingerprint(paths:list) -> str:
+
+    # This function identifies the artifacts loaded by their paths, sizes and modification
+    # times (they change when retrain.py or export_model.py rewrite them)
+
+    stats = [(os.path.abspath(path), os.path.getsize(path), os.path.getmtime(path)) for path in paths]
+
+    return hashlib.sha1(repr(stats).encode("utf-8")).hexdigest()[:16]
+
+def LoadModels(models_path:str = MODELS_PATH, mmap_mode:str = MODEL_MMAP_MODE,
+               feature_pipeline:str = FEATURE_PIPELINE) -> None:
+
+    # Loading preprocessing techniques and machine learning model
+
+    global vectorizer, feature_selector, random_forest_clf, compact_forest, model_fingerprint
+
+    if feature_pipeline not in FEATURE_PIPELINES:
+        raise ValueError(f"Unknown feature pipeline '{feature_pipeline}', expected one of {list(FEATURE_PIPELINES)}")
+
+    if feature_pipeline == "tfidf" and os.path.exists(os.path.join(models_path, COMPILED_PIPELINE_NAME)):
+
+        pipeline = LoadModel(COMPILED_PIPELINE_NAME, models_path, mmap_mode)
+
+        vectorizer = pipeline.vectorizer
+        feature_selector = None
+        random_forest_clf = pipeline.model
+        names = [COMPILED_PIPELINE_NAME]
+
+    else:
+
+        vectorizer_name, feature_selector_name, model_name = FEATURE_PIPELINES[feature_pipeline]
+
+        vectorizer = LoadModel(vectorizer_name, models_path, mmap_mode)
+        feature_selector = LoadModel(feature_selector_name, models_path, mmap_mode)
+        random_forest_clf = LoadModel(model_name, models_path, mmap_mode)
+        names = [vectorizer_name, feature_selector_name, model_name]
+
+    # Part of the keys of the prediction cache
+    model_fingerprint = ModelFingerprint([os.path.join(models_path, name) for name in names])
+
+    # A pipeline exported with export_model.py --quantize already holds a CompactForest
+    if isinstance(random_forest_clf, CompactForest):
+        compact_forest = random_forest_clf
+    else:
+        compact_forest = CompactForest(random_forest_clf) if FOREST_ENGINE == "compact" else None
+
+models_lock = threading.Lock()
+
+def EnsureModels() -> None:
+
+    # The module-level app served directly (gunicorn app:app, flask run) doesn't go
+    # through create_app, so the models are loaded by the first prediction of each worker
+
+    if random_forest_clf is None:
+        with models_lock:
+            if random_forest_clf is None:
+                LoadModels()
+
+def create_app(models_path:str = MODELS_PATH, mmap_mode:str = MODEL_MMAP_MODE) -> Flask:
+
+    '''
+    Application factory. With a pre-fork server the models are loaded only once in the
+    master process and the workers share them (copy-on-write pages or memory maps), e.g
+
+        gunicorn -c gunicorn.conf.py "app:create_app()"
+
+    Parameters
+    ----------
+
+    models_path: str; default=MODELS_PATH
+        Folder with the models
+
+    mmap_mode: str; default=MODEL_MMAP_MODE
+        mmap_mode passed to joblib.load. None loads the models in memory
+
+    Returns
+    -------
+
+    Flask: The flask application with the models loaded
+
+    '''
+
+    if random_forest_clf is None:
+        LoadModels(models_path, mmap_mode)
+
+    # Objects created until now are moved out of the garbage collector, otherwise each
+    # collection in a worker writes on their pages and they stop being shared
+    gc.collect()
+    gc.freeze()
+
+    return app
 
 # Map the machine learning output into something more friendly
 map_class = {
@@ -26,8 +158,186 @@ map_class = {
 
 }
 
+# Seconds spent by each stage of the predictions and by each request (per process, every
+# worker of a pre-fork server exposes its own values on /metrics)
+stage_seconds = Histogram("sentiment_stage_seconds", "Seconds spent by each stage of the predictions", "stage")
+request_seconds = Histogram("sentiment_request_seconds", "Seconds spent by each request", "endpoint")
+
+# PROFILE_SAMPLE_RATE is the fraction of requests profiled with cProfile (0 disables it),
+# the stats of each one are saved in PROFILE_PATH
+profiler = SamplingProfiler(
+    sample_rate = float(os.environ.get("PROFILE_SAMPLE_RATE", "0")),
+    output_path = os.environ.get("PROFILE_PATH", "profiles")
+)
+
 # Initialize the cleaner of the text supplied in the front-end (by the user)
-cleaner = CleanText()
+cleaner = CleanText(html_observer = lambda seconds: stage_seconds.Observe("html", seconds))
+
+# Cache of the predictions keyed by the cleaned text and model_fingerprint (new artifacts
+# never get old predictions). PREDICTION_CACHE_SIZE=0 disables it, PREDICTION_CACHE_TTL
+# sets the seconds a prediction is valid and PREDICTION_CACHE_SQLITE the path of a SQLite
+# file to share the cache between workers
+prediction_cache = PredictionCache(
+    maxsize = int(os.environ.get("PREDICTION_CACHE_SIZE", "10000")),
+    ttl = float(os.environ["PREDICTION_CACHE_TTL"]) if os.environ.get("PREDICTION_CACHE_TTL") else None,
+    sqlite_path = os.environ.get("PREDICTION_CACHE_SQLITE") or None
+)
+
+def ReadBatchRequest() -> list:
+
+    '''
+    This function reads the texts sent to /predict_batch. Two formats are accepted
+
+    1. JSON: a list of texts, e.g ["text 1", "text 2"], or an object with the list
+       under the key "texts", e.g {"texts": ["text 1", "text 2"]}
+    2. NDJSON (Content-Type: application/x-ndjson): one JSON value per line, either
+       a string or an object with the key "text"
+
+    Returns
+    -------
+
+    list: The texts received in the same order they were sent
+
+    '''
+
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+
+        texts = []
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            texts.append(record["text"] if isinstance(record, dict) else record)
+
+        return texts
+
+    payload = request.get_json()
+    texts = payload["texts"] if isinstance(payload, dict) else payload
+
+    if not isinstance(texts, list):
+        raise ValueError("Expected a list of texts")
+
+    return texts
+
+def Vectorize(texts_lemma_str:list):
+
+    # This function returns the features used by the model (TF-IDF + chi2) of the texts
+
+    # The compiled pipeline has no feature selector, chi2 is already included in "tfidf"
+    with stage_seconds.Time("tfidf"):
+        X = vectorizer.transform(texts_lemma_str)
+
+    if feature_selector is not None:
+        with stage_seconds.Time("chi2"):
+            X = feature_selector.transform(X)
+
+    return X
+
+def PredictTexts(texts:list) -> "(np.ndarray, np.ndarray)":
+
+    '''
+    This function runs the whole pipeline (cleaning, lemmatization, TF-IDF, chi2 and
+    random forest) over several texts at once. The vectorizer, feature selector and
+    model are called only once on the stacked sparse matrix of all the texts
+
+    Parameters
+    ----------
+
+    texts: list
+        List of texts to predict
+
+    Returns
+    -------
+
+    (np.ndarray, np.ndarray): A tuple containing the predicted classes and the
+        probabilities of each class respectively, in the same order as texts
+
+    '''
+
+    EnsureModels()
+
+    with stage_seconds.Time("clean"):
+        texts_cleaned = [cleaner.FastCleaner(text) for text in texts]
+
+    with stage_seconds.Time("cache"):
+        keys = [PredictionCache.Key(text, model_fingerprint) for text in texts_cleaned]
+        probabilities = [prediction_cache.Get(key) for key in keys]
+
+    # Only the texts not found in the cache are lemmatized and predicted (once each)
+    missing = {}
+    for i, (key, probability) in enumerate(zip(keys, probabilities)):
+        if probability is None:
+            missing.setdefault(key, []).append(i)
+
+    if missing:
+
+        texts_missing = [texts_cleaned[indexes[0]] for indexes in missing.values()]
+
+        # Same steps as LemmatizeChunk, split to time each one. The tagger is requested
+        # first, it loads (or downloads) the NLTK resources that word_tokenize needs too
+        pos_tagger = GetPosTagger()
+
+        with stage_seconds.Time("tokenize"):
+            tokens_sents = [word_tokenize(text) for text in texts_missing]
+
+        with stage_seconds.Time("pos_tag"):
+            pos_sents = pos_tagger.tag_sents(tokens_sents)
+
+        with stage_seconds.Time("lemmatize"):
+            texts_lemma_str = [LemmatizeTagged(pos, as_list = False) for pos in pos_sents]
+
+        X = Vectorize(texts_lemma_str)
+
+        use_compact_forest = compact_forest is not None and X.shape[0] <= COMPACT_FOREST_MAX_ROWS
+        forest = compact_forest if use_compact_forest else random_forest_clf
+
+        with stage_seconds.Time("forest"):
+            probabilities_missing = forest.predict_proba(X).tolist()
+
+        for (key, indexes), probability in zip(missing.items(), probabilities_missing):
+            prediction_cache.Set(key, probability)
+            for i in indexes:
+                probabilities[i] = probability
+
+    probabilities = np.asarray(probabilities, dtype = np.float64).reshape(len(texts), -1)
+    predictions = random_forest_clf.classes_.take(np.argmax(probabilities, axis=1))
+
+    return predictions, probabilities
+
+def PredictTextsBatched(texts:list) -> list:
+
+    # PredictTexts returning a tuple (class, probabilities) for each text
+
+    predictions, probabilities = PredictTexts(texts)
+    return list(zip(predictions, probabilities))
+
+# Concurrent requests to /predict are grouped into one call to the model when MICRO_BATCHING=1.
+# MICRO_BATCH_WAIT_MS is the time a request waits for others and MICRO_BATCH_MAX_SIZE
+# the maximum number of requests grouped
+micro_batcher = MicroBatcher(
+    PredictTextsBatched,
+    max_batch_size = int(os.environ.get("MICRO_BATCH_MAX_SIZE", "64")),
+    max_wait_ms = float(os.environ.get("MICRO_BATCH_WAIT_MS", "5"))
+) if os.environ.get("MICRO_BATCHING", "0") == "1" else None
+
+@app.before_request
+def start_request():
+    g.start_time = perf_counter()
+    profiler.Start()
+
+@app.after_request
+def finish_request(response):
+
+    request_seconds.Observe(request.endpoint or "unknown", perf_counter() - g.start_time)
+
+    return response
+
+@app.teardown_request
+def stop_profiler(error = None):
+
+    # teardown_request also runs when the view raises, after_request doesn't
+    profiler.Stop(request.endpoint or "unknown")
 
 @app.route("/")
 def home():
@@ -36,18 +346,69 @@ def home():
 @app.route('/predict', methods=['POST'])
 def predict():
 
-    # Retrieving, cleaning and getting lemmas of the request
+    # Retrieving, cleaning, getting lemmas of the request and predicting
     text_received = request.get_json()["text"]
-    text_cleaned = cleaner.Cleaner(text_received)
-    text_lemma_str = LemmatizeWithPos(text_cleaned, as_list = False)
 
-    # Predicting
-    X = vectorizer.transform([text_lemma_str])
-    X = feature_selector.transform(X)
-    prediction = random_forest_clf.predict(X)[0]
-    prediction = map_class[prediction]
+    if micro_batcher is None:
+        predictions, _ = PredictTexts([text_received])
+        prediction = map_class[predictions[0]]
+    else:
+        prediction, _ = micro_batcher.Predict(text_received)
+        prediction = map_class[prediction]
 
     return jsonify({"prediction_text": f"Polarity: {prediction}"})
 
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+
+    try:
+        texts_received = ReadBatchRequest()
+    except (ValueError, KeyError, TypeError) as ErrorRequest:
+        return jsonify({"error": f"Invalid request: {ErrorRequest}"}), 400
+
+    if not texts_received:
+        return jsonify({"predictions": [], "probabilities": []})
+
+    predictions, probabilities = PredictTexts(texts_received)
+    class_names = [map_class[label] for label in random_forest_clf.classes_]
+
+    return jsonify({
+        "predictions": [map_class[label] for label in predictions],
+        "probabilities": [dict(zip(class_names, row.tolist())) for row in probabilities]
+    })
+
+@app.route('/cache_info', methods=['GET'])
+def cache_info():
+    return jsonify(prediction_cache.Info())
+
+@app.route('/batching_info', methods=['GET'])
+def batching_info():
+    return jsonify(micro_batcher.Info() if micro_batcher is not None else {"enabled": False})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+
+    # Timing histograms, cache and batching counters in the Prometheus text format
+
+    cache = prediction_cache.Info()
+    lemma_cache = LemmaCacheInfo()
+
+    sections = [
+        stage_seconds.Render(),
+        request_seconds.Render(),
+        RenderValues("sentiment_prediction_cache_hits_total", "Predictions found in the cache", "counter", {None: cache["hits"]}),
+        RenderValues("sentiment_prediction_cache_misses_total", "Predictions not found in the cache", "counter", {None: cache["misses"]}),
+        RenderValues("sentiment_prediction_cache_size", "Predictions stored in the cache", "gauge", {None: cache["size"]}),
+        RenderValues("sentiment_lemma_cache_hits_total", "Lemmas found in the cache", "counter", {None: lemma_cache["hits"]}),
+        RenderValues("sentiment_lemma_cache_misses_total", "Lemmas not found in the cache", "counter", {None: lemma_cache["misses"]})
+    ]
+
+    if micro_batcher is not None:
+        batching = micro_batcher.Info()
+        sections.append(RenderValues("sentiment_batches_total", "Micro-batches sent to the model", "counter", {None: batching["batches"]}))
+        sections.append(RenderValues("sentiment_batched_items_total", "Texts predicted in micro-batches", "counter", {None: batching["items"]}))
+
+    return Response("\n".join(sections) + "\n", mimetype = "text/plain; version=0.0.4")
+
 if __name__ == "__main__":
-    app.run(debug = True)
+    create_app().run(debug = True)
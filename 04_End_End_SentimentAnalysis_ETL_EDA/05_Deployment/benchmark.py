@@ -0,0 +1,478 @@
+import os
+import re
+import sys
+import json
+import random
+import platform
+import argparse as arg
+from time import perf_counter, strftime
+
+import numpy as np
+
+from utils.process_text import CleanText, GetStopWords, RemoveStopWords, RemoveStopWordsTokens, LemmatizeWithPos, LemmatizeChunk
+from utils.inference import CompactForest
+
+# Pieces used to build synthetic youtube comments. They try to cover what is found in the
+# real ones: plain words, html tags and entities, links, emojis, mentions, hashtags and
+# non-printable characters
+WORDS = ["this", "video", "is", "amazing", "great", "explanation", "i", "love", "kurzgesagt",
+         "the", "animation", "science", "first", "bad", "boring", "why", "don't", "whales",
+         "cancer", "climate", "change", "nuclear", "bomb", "mars", "base", "human", "history"]
+
+DECORATIONS = ["!", "?", "...", ",", ".", "!!!", "%", "$5", "#science", "@kurzgesagt", ":)",
+               "(lol)", "\"quote\"", "'s", "<br>", "<b>bold</b>", "&#39;", "&quot;", "&amp;",
+               "<a href=\"https://www.youtube.com/watch?v=dGiQaabX3_o&amp;t=1m\">1:00</a>",
+               "https://example.com/page?x=1", "\U0001F600", "\U0001F680\U0001F680", "❤️",
+               "‍", "\r\n", "\t", "\x0b", "  ", "été", "漢字", "< 3", "a & b"]
+
+def CreateArguments() -> arg.ArgumentParser.parse_args:
+
+    '''
+    This function creates the arguments of the command line
+
+    Returns
+    -------
+
+    argparse: argparse object created by ArgumentParser.parse_args
+
+    '''
+
+    args = arg.ArgumentParser(description="Benchmark of the text preprocessing used by the sentiment app")
+    args.add_argument("--corpus", dest="corpus", type=str, default=None,
+                    help="Recorded comments to use (.txt one comment per line, .csv or .feather with a 'comment' column). Default is a synthetic corpus")
+    args.add_argument("--n", dest="n", type=int, default=20000,
+                    help="Number of synthetic comments. Ignored if --corpus is supplied. Default is 20000")
+    args.add_argument("--seed", dest="seed", type=int, default=0,
+                    help="Seed used to create the synthetic comments. Default is 0")
+    args.add_argument("--n-slow", dest="n_slow", type=int, default=2000,
+                    help="Number of comments used by the slow benchmarks (lemmatization, model and http). Default is 2000")
+    args.add_argument("--batch-size", dest="batch_size", type=int, default=256,
+                    help="Number of comments per batch in the batch benchmarks. Default is 256")
+    args.add_argument("--models", dest="models", type=str, default="models",
+                    help="Folder with the models. The model benchmarks are skipped if it doesn't exist. Default is 'models'")
+    args.add_argument("--output", dest="output", type=str, default=None,
+                    help="Path of the JSON file where the results are saved")
+    args.add_argument("--baseline", dest="baseline", type=str, default=None,
+                    help="JSON file of a previous run to compare with")
+    args.add_argument("--tolerance", dest="tolerance", type=float, default=0.1,
+                    help="Relative drop of throughput reported as a regression. Default is 0.1")
+
+    return args.parse_args()
+
+def SyntheticComments(n:int, seed:int = 0) -> list:
+
+    # This function creates n random comments mixing words and decorations
+
+    rng = random.Random(seed)
+    comments = []
+
+    for _ in range(n):
+        pieces = [rng.choice(WORDS) for _ in range(rng.randint(1, 40))]
+        for _ in range(rng.randint(0, 6)):
+            pieces.insert(rng.randint(0, len(pieces)), rng.choice(DECORATIONS))
+        comments.append(" ".join(pieces).capitalize())
+
+    return comments
+
+def LoadComments(path:str, column:str = "comment") -> list:
+
+    # This function loads recorded comments from a text, csv or feather file
+
+    if path.endswith(".txt"):
+        with open(path, "r", encoding="utf-8") as iFile:
+            return iFile.read().splitlines()
+
+    import pandas as pd
+
+    if path.endswith(".feather"):
+        comments = pd.read_feather(path, columns=[column])[column]
+    else:
+        comments = pd.read_csv(path, usecols=[column])[column]
+
+    return comments.astype(str).tolist()
+
+def CompareCleaners(comments:list, on:str = "youtube") -> list:
+
+    '''
+    This function checks that CleanText.FastCleaner returns exactly the same text as
+    CleanText.Cleaner
+
+    Parameters
+    ----------
+
+    comments: list
+        Comments to clean
+
+    on:str; ["twitter","youtube"]
+        Argument passed to both cleaners
+
+    Returns
+    -------
+
+    list: A list of tuples (comment, Cleaner output, FastCleaner output) for the comments
+        where the outputs are different. An empty list means both cleaners are equivalent
+
+    '''
+
+    cleaner = CleanText()
+    mismatches = []
+
+    for comment in comments:
+        expected = cleaner.Cleaner(comment, on = on)
+        obtained = cleaner.FastCleaner(comment, on = on)
+        if expected != obtained:
+            mismatches.append((comment, expected, obtained))
+
+    return mismatches
+
+def TimeFunction(function, items:list, n_items:int = None) -> dict:
+
+    '''
+    This function applies function to each item and measures the throughput and the
+    latency of each call
+
+    Parameters
+    ----------
+
+    function: callable
+        Function to measure, called with one item at a time
+
+    items: list
+        Items passed to function
+
+    n_items: int; default=None
+        Number of items used to compute the throughput, e.g the number of comments if
+        each item is a batch of comments. None uses len(items)
+
+    Returns
+    -------
+
+    dict: total seconds, items per second and the latency (milliseconds) p50 and p99 of
+        the calls
+
+    '''
+
+    latencies = np.empty(len(items))
+
+    start = perf_counter()
+    for i, item in enumerate(items):
+        call_start = perf_counter()
+        function(item)
+        latencies[i] = perf_counter() - call_start
+    elapsed = perf_counter() - start
+
+    n_items = len(items) if n_items is None else n_items
+
+    return {
+        "seconds": elapsed,
+        "items_per_sec": n_items / elapsed if elapsed else float("inf"),
+        "p50_ms": 1000 * float(np.percentile(latencies, 50)) if len(items) else 0.0,
+        "p99_ms": 1000 * float(np.percentile(latencies, 99)) if len(items) else 0.0
+    }
+
+def Batches(items:list, size:int) -> list:
+
+    # This function splits items in lists of size elements
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def BenchmarkCleaners(comments:list) -> dict:
+
+    # This function measures the throughput of Cleaner and FastCleaner on the same comments
+
+    cleaner = CleanText()
+
+    return {
+        "Cleaner": TimeFunction(cleaner.Cleaner, comments),
+        "FastCleaner": TimeFunction(cleaner.FastCleaner, comments)
+    }
+
+def StopWordsAlternationPattern() -> re.Pattern:
+
+    # This function builds the regex used before to remove stop words: one alternation with
+    # every stop word. Sorted from the longest to the shortest word to get always the same
+    # output (the order of a set changes between runs, e.g "can't" vs "can")
+
+    stop_words = sorted(GetStopWords(), key=lambda word: (-len(word), word))
+    return re.compile(fr"\b(?:{'|'.join(stop_words)})\b")
+
+def CompareStopWords(sentences:list) -> list:
+
+    # This function returns the sentences where RemoveStopWords (trie regex) and the
+    # alternation regex give a different output
+
+    alternation_pattern = StopWordsAlternationPattern()
+    mismatches = []
+
+    for sentence in sentences:
+        expected = alternation_pattern.sub(" ", sentence)
+        obtained = RemoveStopWords(sentence)
+        if expected != obtained:
+            mismatches.append((sentence, expected, obtained))
+
+    return mismatches
+
+def BenchmarkStopWords(sentences:list) -> dict:
+
+    # This function measures the cost of removing stop words with the alternation regex,
+    # the trie regex and the set of stop words over tokens
+
+    alternation_pattern = StopWordsAlternationPattern()
+    tokens = [sentence.split() for sentence in sentences]
+
+    results = {
+        "alternation_regex": TimeFunction(lambda sentence: alternation_pattern.sub(" ", sentence), sentences),
+        "trie_regex": TimeFunction(RemoveStopWords, sentences),
+        "token_set": TimeFunction(RemoveStopWordsTokens, tokens)
+    }
+
+    for result in results.values():
+        result["us_per_sentence"] = 1e6 * result["seconds"] / len(sentences) if sentences else 0.0
+
+    return results
+
+def BenchmarkLemmatization(sentences:list) -> dict:
+
+    # This function measures LemmatizeWithPos (tokenize, POS tagging and lemmas). The cache
+    # of lemmas is warmed up with the same sentences first, as it's in a running server
+
+    for sentence in sentences:
+        LemmatizeWithPos(sentence)
+
+    return {"LemmatizeWithPos": TimeFunction(LemmatizeWithPos, sentences)}
+
+def LoadApp(models_path:str):
+
+    # This function returns the flask module with the models loaded and the cache of
+    # predictions disabled (every text goes through the whole model chain)
+
+    import app
+    from utils.prediction_cache import PredictionCache
+
+    app.create_app(models_path)
+    app.prediction_cache = PredictionCache(maxsize = 0)
+
+    return app
+
+def BenchmarkModel(app, comments:list, batch_size:int) -> dict:
+
+    # This function measures the whole chain (cleaning, lemmas, TF-IDF, chi2 and forest)
+    # with one comment per call and with batches of comments
+
+    batches = Batches(comments, batch_size)
+
+    return {
+        "single": TimeFunction(lambda comment: app.PredictTexts([comment]), comments),
+        "batch": TimeFunction(app.PredictTexts, batches, n_items = len(comments))
+    }
+
+def BenchmarkForest(app, comments:list) -> dict:
+
+    # This function checks that CompactForest gives exactly the same probabilities as the
+    # random forest and measures both with one comment per call (the case of /predict)
+
+    texts_lemma_str = LemmatizeChunk(CleanText().CleanMany(comments, n_jobs = 1), as_list = False)
+    X = app.Vectorize(texts_lemma_str).tocsr()
+    rows = [X[i] for i in range(X.shape[0])]
+
+    # The pipeline exported with --quantize has no sklearn forest, both sides are the same
+    compact_forest = app.random_forest_clf
+    if not isinstance(compact_forest, CompactForest):
+        compact_forest = CompactForest(app.random_forest_clf)
+    mismatches = int(np.sum(np.any(compact_forest.predict_proba(X) != app.random_forest_clf.predict_proba(X), axis=1)))
+
+    return {
+        "sklearn_single": TimeFunction(app.random_forest_clf.predict_proba, rows),
+        "compact_single": dict(TimeFunction(compact_forest.predict_proba, rows), mismatches = mismatches)
+    }
+
+def BenchmarkEndpoints(app, comments:list, batch_size:int) -> dict:
+
+    # This function measures /predict and /predict_batch through the test client of flask,
+    # i.e. including the parsing of the requests and the serialization of the responses
+
+    client = app.app.test_client()
+    batches = Batches(comments, batch_size)
+
+    def Post(path:str, payload):
+        response = client.post(path, json = payload)
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}: {response.get_data(as_text = True)}")
+
+    return {
+        "predict": TimeFunction(lambda comment: Post("/predict", {"text": comment}), comments),
+        "predict_batch": TimeFunction(lambda batch: Post("/predict_batch", batch), batches, n_items = len(comments))
+    }
+
+def RunBenchmarks(comments:list, n_slow:int = 2000, batch_size:int = 256, models_path:str = "models") -> dict:
+
+    '''
+    This function runs all the benchmarks. The ones needing missing resources (NLTK data
+    or models) are recorded as skipped with the reason
+
+    Parameters
+    ----------
+
+    comments: list
+        Comments used by the benchmarks
+
+    n_slow: int; default=2000
+        Number of comments used by the slow benchmarks (lemmatization, model and http)
+
+    batch_size: int; default=256
+        Number of comments per batch in the batch benchmarks
+
+    models_path: str; default="models"
+        Folder with the models
+
+    Returns
+    -------
+
+    dict: Results of each benchmark grouped by stage, e.g results["cleaner"]["FastCleaner"]
+
+    '''
+
+    results = {}
+
+    results["cleaner"] = BenchmarkCleaners(comments)
+
+    sentences = CleanText().CleanMany(comments, n_jobs = 1)
+    try:
+        results["stop_words"] = BenchmarkStopWords(sentences)
+    except LookupError as ErrorNltk:
+        results["stop_words"] = {"skipped": f"NLTK resource not found: {ErrorNltk}"}
+
+    slow_comments = comments[:n_slow]
+    slow_sentences = sentences[:n_slow]
+
+    try:
+        results["lemmatization"] = BenchmarkLemmatization(slow_sentences)
+    except LookupError as ErrorNltk:
+        results["lemmatization"] = {"skipped": f"NLTK resource not found: {ErrorNltk}"}
+
+    if not os.path.isdir(models_path):
+        results["model"] = results["forest"] = results["http"] = {"skipped": f"Models not found in {models_path}"}
+        return results
+
+    try:
+        app = LoadApp(models_path)
+        results["model"] = BenchmarkModel(app, slow_comments, batch_size)
+        results["forest"] = BenchmarkForest(app, slow_comments)
+        results["http"] = BenchmarkEndpoints(app, slow_comments, batch_size)
+    except LookupError as ErrorNltk:
+        results["model"] = results["forest"] = results["http"] = {"skipped": f"NLTK resource not found: {ErrorNltk}"}
+
+    return results
+
+def Flatten(results:dict) -> dict:
+
+    # This function returns the benchmarks not skipped as {"group.name": result}
+
+    return {f"{group}.{name}": result
+            for group, group_results in results.items() if "skipped" not in group_results
+            for name, result in group_results.items()}
+
+def CompareResults(results:dict, baseline:dict, tolerance:float = 0.1) -> list:
+
+    '''
+    This function compares the results of a run against a baseline run
+
+    Parameters
+    ----------
+
+    results: dict
+        Results returned by RunBenchmarks
+
+    baseline: dict
+        Results of a previous run (key "results" of the JSON saved)
+
+    tolerance: float; default=0.1
+        Relative drop of throughput reported as a regression
+
+    Returns
+    -------
+
+    list: A list of tuples (benchmark, throughput ratio, p99 ratio, is regression) for
+        the benchmarks found in both runs. Ratios are current / baseline
+
+    '''
+
+    current, previous = Flatten(results), Flatten(baseline)
+    comparison = []
+
+    for name in current.keys() & previous.keys():
+
+        throughput_ratio = current[name]["items_per_sec"] / previous[name]["items_per_sec"]
+        p99_ratio = current[name]["p99_ms"] / previous[name]["p99_ms"] if previous[name]["p99_ms"] else float("nan")
+
+        comparison.append((name, throughput_ratio, p99_ratio, throughput_ratio < 1 - tolerance))
+
+    return sorted(comparison)
+
+if __name__ == "__main__":
+
+    arguments = CreateArguments()
+
+    if arguments.corpus is None:
+        comments = SyntheticComments(arguments.n, arguments.seed)
+    else:
+        comments = LoadComments(arguments.corpus)
+
+    print(f"Comments: {len(comments)}")
+
+    for on in ["youtube", "twitter"]:
+        mismatches = CompareCleaners(comments, on = on)
+        print(f"Cleaner vs FastCleaner (on='{on}'): {len(mismatches)} mismatches")
+        for comment, expected, obtained in mismatches[:5]:
+            print(f"\t{comment!r}\n\t\tCleaner:     {expected!r}\n\t\tFastCleaner: {obtained!r}")
+
+    sentences = CleanText().CleanMany(comments, n_jobs = 1)
+
+    try:
+        mismatches = CompareStopWords(sentences)
+        print(f"Alternation regex vs trie regex: {len(mismatches)} mismatches")
+    except LookupError as ErrorNltk:
+        print(f"Alternation regex vs trie regex: skipped (NLTK resource not found: {ErrorNltk})")
+
+    # Read before running, the output can be the same file as the baseline
+    baseline = None
+    if arguments.baseline is not None:
+        with open(arguments.baseline, "r", encoding="utf-8") as iFile:
+            baseline = json.load(iFile)["results"]
+
+    results = RunBenchmarks(comments, arguments.n_slow, arguments.batch_size, arguments.models)
+
+    for group, group_results in results.items():
+        if "skipped" in group_results:
+            print(f"{group}: skipped ({group_results['skipped']})")
+            continue
+        for name, result in group_results.items():
+            mismatches = f", {result['mismatches']} mismatches" if "mismatches" in result else ""
+            print(f"{group}.{name}: {result['items_per_sec']:.0f} comments/sec, "
+                  f"p50 {result['p50_ms']:.3f} ms, p99 {result['p99_ms']:.3f} ms{mismatches}")
+
+    if arguments.output is not None:
+
+        report = {
+            "metadata": {
+                "date": strftime("%Y-%m-%d %H:%M:%S"),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "corpus": arguments.corpus or f"synthetic(n={arguments.n}, seed={arguments.seed})",
+                "comments": len(comments),
+                "n_slow": arguments.n_slow,
+                "batch_size": arguments.batch_size
+            },
+            "results": results
+        }
+
+        with open(arguments.output, "w", encoding="utf-8") as oFile:
+            json.dump(report, oFile, indent = 2)
+
+        print(f"Results saved in {arguments.output}")
+
+    if baseline is not None:
+
+        print(f"Against {arguments.baseline} (current / baseline):")
+        for name, throughput_ratio, p99_ratio, regression in CompareResults(results, baseline, arguments.tolerance):
+            flag = " REGRESSION" if regression else ""
+            print(f"\t{name}: throughput x{throughput_ratio:.2f}, p99 x{p99_ratio:.2f}{flag}")
@@ -0,0 +1,254 @@
+import os
+import joblib
+import tempfile
+import argparse as arg
+from time import perf_counter
+
+from utils.inference import CompiledPipeline, CompactForest
+
+def CreateArguments() -> arg.ArgumentParser.parse_args:
+
+    '''
+    This function creates the arguments of the command line
+
+    Returns
+    -------
+
+    argparse: argparse object created by ArgumentParser.parse_args
+
+    '''
+
+    args = arg.ArgumentParser(description="Export the fitted vectorizer, feature selector and model as one pruned artifact")
+    args.add_argument("--models", dest="models", type=str, default="models",
+                    help="Folder with the artifacts saved by 03_SentimentAnalysis.ipynb. Default is 'models'")
+    args.add_argument("--output", dest="output", type=str, default="models/04_compiled_pipeline_fitted.joblib",
+                    help="Path of the artifact exported. Default is 'models/04_compiled_pipeline_fitted.joblib'")
+    args.add_argument("--uncompressed", const=True, default=False, nargs="?",
+                    help="Save again the three artifacts in --models without compression, so they can be loaded with mmap_mode='r'. No value is expected")
+    args.add_argument("--quantize", dest="quantize", type=str, default=None, choices=["float64", "float32", "float16"],
+                    help="Replace the random forest with a quantized CompactForest whose leaf probabilities use this dtype")
+    args.add_argument("--compress", dest="compress", type=str, default="zlib:3",
+                    help="Compression of the quantized artifact as method:level (zlib, lzma, lz4, ...) or 0. Default is 'zlib:3'")
+    args.add_argument("--data", dest="data", type=str, default=None,
+                    help="Labeled feather file (comment, class) used to report the agreement and accuracy of the quantized forest")
+    args.add_argument("--test-size", dest="test_size", type=float, default=0.3,
+                    help="Fraction of --data resampled to compare both forests (not a held-out set, it overlaps the training rows). Default is 0.3")
+    args.add_argument("--seed", dest="seed", type=int, default=0,
+                    help="Seed used to resample --data. Default is 0")
+
+    return args.parse_args()
+
+def LoadArtifacts(models_path:str) -> tuple:
+
+    # This function loads the vectorizer, feature selector and model saved by the training notebook
+
+    artifacts = []
+    for name in ["01_tfidf_vectorizer_fitted.joblib",
+                 "02_chi2_250_feature_selector_fitted.joblib",
+                 "03_random_forest_model_fitted.joblib"]:
+
+        with open(os.path.join(models_path, name), "rb") as iFile:
+            artifacts.append(joblib.load(iFile))
+
+    return tuple(artifacts)
+
+def ExportCompiledPipeline(models_path:str, output_path:str) -> CompiledPipeline:
+
+    '''
+    This function fuses the three artifacts used by app.py into one CompiledPipeline
+    and saves it
+
+    Parameters
+    ----------
+
+    models_path: str
+        Folder with the artifacts saved by 03_SentimentAnalysis.ipynb
+
+    output_path: str
+        Path where the compiled pipeline is saved
+
+    Returns
+    -------
+
+    CompiledPipeline: The pipeline saved
+
+    '''
+
+    vectorizer, feature_selector, model = LoadArtifacts(models_path)
+    pipeline = CompiledPipeline(vectorizer, feature_selector, model)
+
+    # Uncompressed, so it can be loaded with mmap_mode
+    joblib.dump(pipeline, output_path, compress = 0)
+
+    print(f"Terms in the vocabulary: {len(vectorizer.vocabulary_)} -> {len(pipeline.vectorizer.vocabulary_)}")
+    print(f"Terms removed by min_df/max_df dropped: {len(getattr(vectorizer, 'stop_words_', None) or [])}")
+    print(f"Features out: {pipeline.vectorizer.n_features_out_}")
+    print(f"Artifact saved: {output_path} ({os.path.getsize(output_path) / 2**20:.2f} MB)")
+
+    return pipeline
+
+def ParseCompress(compress:str):
+
+    # This function converts "method:level" (or "0") into the compress argument of joblib.dump
+
+    if compress in ("0", "", None):
+        return 0
+
+    method, _, level = compress.partition(":")
+    return (method, int(level or 3))
+
+def ExportQuantizedPipeline(models_path:str, output_path:str, value_dtype:str = "float16",
+                            compress:str = "zlib:3") -> CompiledPipeline:
+
+    '''
+    This function saves the compiled pipeline with the random forest replaced by a
+    quantized CompactForest (thresholds in float32, indexes in the smallest integer dtype
+    and leaf probabilities in value_dtype), compressed
+
+    Parameters
+    ----------
+
+    models_path: str
+        Folder with the artifacts saved by 03_SentimentAnalysis.ipynb
+
+    output_path: str
+        Path where the pipeline is saved
+
+    value_dtype: str; ["float64","float32","float16"]; default="float16"
+        dtype of the probabilities of the leaves
+
+    compress: str; default="zlib:3"
+        Compression as method:level or "0"
+
+    Returns
+    -------
+
+    CompiledPipeline: The pipeline saved
+
+    '''
+
+    vectorizer, feature_selector, model = LoadArtifacts(models_path)
+
+    pipeline = CompiledPipeline(vectorizer, feature_selector, model)
+    pipeline.model = CompactForest(model).Quantize(value_dtype)
+
+    joblib.dump(pipeline, output_path, compress = ParseCompress(compress))
+    print(f"Artifact saved: {output_path} ({os.path.getsize(output_path) / 2**20:.2f} MB)")
+
+    return pipeline
+
+def TimeLoad(path:str, repeat:int = 3) -> float:
+
+    # This function returns the best time (secs) to load an artifact
+
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        joblib.load(path)
+        times.append(perf_counter() - start)
+
+    return min(times)
+
+def ReportQuantizedForest(models_path:str, quantized_forest:CompactForest, compress:str = "zlib:3",
+                          data_path:str = None, test_size:float = 0.3, seed:int = 0) -> dict:
+
+    '''
+    This function compares the quantized forest against the random forest saved by the
+    training notebook: size of the artifact, time to load it and, if data_path is
+    supplied, the agreement of their predictions and their accuracy on a resampled split.
+    The vectorizer and chi2 were fitted with all the comments and the split of the
+    notebook wasn't seeded, so the split overlaps the training rows: it measures the
+    changes caused by the quantization, not how well the forest generalizes
+
+    Parameters
+    ----------
+
+    models_path: str
+        Folder with the artifacts saved by 03_SentimentAnalysis.ipynb
+
+    quantized_forest: CompactForest
+        Quantized forest
+
+    compress: str; default="zlib:3"
+        Compression used to save the quantized forest
+
+    data_path: str; default=None
+        Labeled feather file with the columns comment (list of lemmas) and class
+
+    test_size: float; default=0.3
+        Fraction of data_path resampled to compare both forests
+
+    seed: int; default=0
+        Seed used to resample data_path
+
+    Returns
+    -------
+
+    dict: The measures of both forests
+
+    '''
+
+    forest_path = os.path.join(models_path, "03_random_forest_model_fitted.joblib")
+
+    with tempfile.TemporaryDirectory() as temporary_path:
+
+        quantized_path = os.path.join(temporary_path, "quantized_forest.joblib")
+        joblib.dump(quantized_forest, quantized_path, compress = ParseCompress(compress))
+
+        report = {
+            "size_mb": (os.path.getsize(forest_path) / 2**20, os.path.getsize(quantized_path) / 2**20),
+            "load_secs": (TimeLoad(forest_path), TimeLoad(quantized_path))
+        }
+
+    if data_path is not None:
+
+        import pandas as pd
+        from sklearn.model_selection import train_test_split
+        from sklearn.metrics import accuracy_score
+
+        vectorizer, feature_selector, model = LoadArtifacts(models_path)
+
+        Xy_data = pd.read_feather(data_path)
+        _, X_test, _, y_test = train_test_split(Xy_data["comment"].apply(" ".join), Xy_data["class"],
+                                                test_size = test_size, random_state = seed)
+
+        X_test = feature_selector.transform(vectorizer.transform(X_test))
+        y_hat, y_hat_quantized = model.predict(X_test), quantized_forest.predict(X_test)
+
+        report["resampled_accuracy"] = (accuracy_score(y_test, y_hat), accuracy_score(y_test, y_hat_quantized))
+        report["agreement"] = float((y_hat == y_hat_quantized).mean())
+
+    for key, (original, quantized) in ((key, value) for key, value in report.items() if key != "agreement"):
+        print(f"{key}: {original:.4f} -> {quantized:.4f} ({quantized - original:+.4f})")
+
+    if "agreement" in report:
+        print(f"Predictions equal to the original forest: {100 * report['agreement']:.2f}%")
+
+    return report
+
+def SaveUncompressed(models_path:str) -> None:
+
+    # This function saves again the artifacts of the training notebook without compression.
+    # joblib can only load the numpy arrays as memory maps from uncompressed files
+
+    names = ["01_tfidf_vectorizer_fitted.joblib",
+             "02_chi2_250_feature_selector_fitted.joblib",
+             "03_random_forest_model_fitted.joblib"]
+
+    for name, artifact in zip(names, LoadArtifacts(models_path)):
+        joblib.dump(artifact, os.path.join(models_path, name), compress = 0)
+        print(f"Saved uncompressed: {name}")
+
+if __name__ == "__main__":
+
+    arguments = CreateArguments()
+
+    if arguments.uncompressed:
+        SaveUncompressed(arguments.models)
+
+    if arguments.quantize is None:
+        ExportCompiledPipeline(arguments.models, arguments.output)
+    else:
+        pipeline = ExportQuantizedPipeline(arguments.models, arguments.output, arguments.quantize, arguments.compress)
+        ReportQuantizedForest(arguments.models, pipeline.model, arguments.compress,
+                              arguments.data, arguments.test_size, arguments.seed)
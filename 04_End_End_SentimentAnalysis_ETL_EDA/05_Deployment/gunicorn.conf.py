@@ -0,0 +1,16 @@
+# Configuration of gunicorn to serve the app with several workers:
+#
+#   gunicorn -c gunicorn.conf.py "app:create_app()"
+#
+# preload_app loads the models once in the master process before creating the workers,
+# so the memory of the models is shared instead of being loaded by each worker
+
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+preload_app = True
+
+# Threads per worker. Several threads are needed to group concurrent requests into one
+# batch when MICRO_BATCHING=1
+threads = int(os.environ.get("GUNICORN_THREADS", "1"))
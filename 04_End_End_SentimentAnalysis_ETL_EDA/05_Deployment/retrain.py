@@ -0,0 +1,135 @@
+import os
+import joblib
+import argparse as arg
+from time import perf_counter
+
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from sklearn.linear_model import SGDClassifier
+
+from utils.incremental import IncrementalTrainer
+from export_model import LoadArtifacts, ExportCompiledPipeline
+
+ARTIFACT_NAMES = ["01_tfidf_vectorizer_fitted.joblib",
+                  "02_chi2_250_feature_selector_fitted.joblib",
+                  "03_random_forest_model_fitted.joblib"]
+
+def CreateArguments() -> arg.ArgumentParser.parse_args:
+
+    '''
+    This function creates the arguments of the command line
+
+    Returns
+    -------
+
+    argparse: argparse object created by ArgumentParser.parse_args
+
+    '''
+
+    args = arg.ArgumentParser(description="Update the sentiment model with new labeled comments without a full refit")
+    args.add_argument("data", type=str,
+                    help="Labeled comments (.feather, .csv or parquet dataset folder with the columns comment and class). With --bootstrap, all the comments used to train the current models")
+    args.add_argument("--models", dest="models", type=str, default="models",
+                    help="Folder with the models. Default is 'models'")
+    args.add_argument("--state", dest="state", type=str, default="models/incremental_state.joblib",
+                    help="File with the statistics kept between updates. Default is 'models/incremental_state.joblib'")
+    args.add_argument("--bootstrap", const=True, default=False, nargs="?",
+                    help="Create the state from the current models and the comments used to train them. No value is expected")
+    args.add_argument("--classifier", dest="classifier", type=str, default="forest", choices=["forest", "sgd"],
+                    help="forest keeps the random forest of --models and adds trees, sgd trains an online linear model from scratch. Default is 'forest'")
+    args.add_argument("--trees-per-update", dest="trees_per_update", type=int, default=10,
+                    help="Trees added to the forest with each update. Default is 10")
+    args.add_argument("--max-estimators", dest="max_estimators", type=int, default=None,
+                    help="Maximum number of trees, the oldest ones are removed. Default keeps all of them")
+
+    return args.parse_args()
+
+def LoadLabeledComments(path:str) -> "(list, np.ndarray)":
+
+    # This function loads comments and their class. Comments saved as lists of lemmas
+    # (labeled_data_clean.feather) are joined by spaces as in the training notebook
+
+    # Parquet dataset of utils/comments_dataset.py, the lemmas are joined by arrow
+    if os.path.isdir(path):
+        table = ds.dataset(path, format = "parquet", partitioning = "hive").to_table(columns = ["comment", "class"])
+        return pc.binary_join(table.column("comment"), " ").to_pylist(), table.column("class").to_numpy()
+
+    Xy_data = pd.read_feather(path) if path.endswith(".feather") else pd.read_csv(path)
+
+    texts = [" ".join(comment) if not isinstance(comment, str) else comment for comment in Xy_data["comment"]]
+    return texts, Xy_data["class"].to_numpy()
+
+def Bootstrap(models_path:str, texts:list, labels, classifier:str = "forest", **kwargs) -> IncrementalTrainer:
+
+    '''
+    This function creates the trainer from the artifacts of the training notebook
+
+    Parameters
+    ----------
+
+    models_path: str
+        Folder with the artifacts saved by 03_SentimentAnalysis.ipynb
+
+    texts: list
+        Comments used to train the artifacts (lemmas joined by spaces)
+
+    labels: list
+        Class of each comment
+
+    classifier: str; ["forest","sgd"]; default="forest"
+        forest keeps the random forest, sgd replaces it with SGDClassifier(loss="log_loss")
+        trained on the same comments
+
+    kwargs:
+        Other parameters of IncrementalTrainer
+
+    Returns
+    -------
+
+    IncrementalTrainer: The trainer ready to be updated
+
+    '''
+
+    vectorizer, feature_selector, model = LoadArtifacts(models_path)
+    trainer = IncrementalTrainer.FromArtifacts(vectorizer, feature_selector, model, texts, labels, **kwargs)
+
+    if classifier == "sgd":
+        trainer.classifier = SGDClassifier(loss = "log_loss").fit(trainer.Transform(texts), labels)
+
+    return trainer
+
+def SaveArtifacts(trainer:IncrementalTrainer, models_path:str) -> None:
+
+    # This function saves the artifacts used by app.py (and the compiled pipeline if it exists)
+
+    for name, artifact in zip(ARTIFACT_NAMES, trainer.Artifacts()):
+        joblib.dump(artifact, os.path.join(models_path, name))
+
+    compiled_path = os.path.join(models_path, "04_compiled_pipeline_fitted.joblib")
+    if os.path.exists(compiled_path):
+        ExportCompiledPipeline(models_path, compiled_path)
+
+if __name__ == "__main__":
+
+    arguments = CreateArguments()
+
+    texts, labels = LoadLabeledComments(arguments.data)
+    start = perf_counter()
+
+    if arguments.bootstrap:
+        trainer = Bootstrap(arguments.models, texts, labels, arguments.classifier,
+                            trees_per_update = arguments.trees_per_update,
+                            max_estimators = arguments.max_estimators)
+    else:
+        trainer = joblib.load(arguments.state)
+        trainer.Update(texts, labels)
+
+    SaveArtifacts(trainer, arguments.models)
+    joblib.dump(trainer, arguments.state)
+
+    print(f"{len(texts)} comments processed in {perf_counter() - start:.1f} secs "
+          f"({trainer.n_documents} comments seen, {len(trainer.vectorizer.vocabulary_)} terms in the vocabulary)")
+    print(f"Terms used by the classifier still in the top {len(trainer.selected_terms)} by chi2: "
+          f"{100 * trainer.SelectionOverlap():.1f}%")
@@ -0,0 +1,324 @@
+import os
+import json
+import argparse as arg
+from time import perf_counter
+from itertools import islice
+from collections import deque
+from multiprocessing import Pool
+
+import pandas as pd
+
+import app
+from utils.process_text import Chunks
+
+def CreateArguments() -> arg.ArgumentParser.parse_args:
+
+    '''
+    This function creates the arguments of the command line
+
+    Returns
+    -------
+
+    argparse: argparse object created by ArgumentParser.parse_args
+
+    '''
+
+    args = arg.ArgumentParser(description="Score the sentiment of the comments of a large file in chunks")
+    args.add_argument("input", type=str,
+                    help="File with the comments (.csv, .feather, .ndjson or .jsonl)")
+    args.add_argument("output", type=str,
+                    help="File where the predictions are written (.csv, .ndjson or .jsonl)")
+    args.add_argument("--column", dest="column", type=str, default="comment",
+                    help="Column with the text of the comments. Default is 'comment'")
+    args.add_argument("--id-column", dest="id_column", type=str, default=None,
+                    help="Column copied to the output to identify each comment. Default is the number of the row")
+    args.add_argument("--models", dest="models", type=str, default=app.MODELS_PATH,
+                    help="Folder with the models. Default is 'models'")
+    args.add_argument("--chunksize", dest="chunksize", type=int, default=5000,
+                    help="Number of comments read and scored at once. Default is 5000")
+    args.add_argument("--n-jobs", dest="n_jobs", type=int, default=1,
+                    help="Number of processes. 0 uses all the cpus. Default is 1")
+    args.add_argument("--restart", const=True, default=False, nargs="?",
+                    help="Ignore the checkpoint of a previous run and start again. No value is expected")
+
+    return args.parse_args()
+
+def ReadChunks(path:str, columns:list, chunksize:int, skip_rows:int = 0):
+
+    '''
+    Generator reading a csv, feather or NDJSON file in chunks, so the memory used doesn't
+    depend on the size of the file
+
+    Parameters
+    ----------
+
+    path: str
+        File to read (.csv, .feather, .ndjson or .jsonl)
+
+    columns: list
+        Columns read
+
+    chunksize: int
+        Number of rows of each chunk
+
+    skip_rows: int; default=0
+        Number of rows skipped at the beginning (rows already scored)
+
+    Yields
+    ------
+
+    pd.DataFrame: The rows of each chunk with the columns requested
+
+    '''
+
+    if path.endswith(".csv"):
+
+        skip = range(1, skip_rows + 1) if skip_rows else None
+        yield from pd.read_csv(path, usecols = columns, chunksize = chunksize, skiprows = skip)
+
+    elif path.endswith(".feather"):
+
+        import pyarrow as pa
+
+        # Feather (v2) is the Arrow IPC format, the file is memory-mapped and read by record batch
+        with pa.memory_map(path, "r") as source:
+
+            reader = pa.ipc.open_file(source)
+            batches = (reader.get_batch(i).select(columns) for i in range(reader.num_record_batches))
+
+            pending = []
+            for batch in batches:
+
+                if skip_rows >= batch.num_rows:
+                    skip_rows -= batch.num_rows
+                    continue
+
+                pending.append(batch.slice(skip_rows))
+                skip_rows = 0
+
+                while sum(piece.num_rows for piece in pending) >= chunksize:
+                    table = pa.Table.from_batches(pending)
+                    yield table.slice(0, chunksize).to_pandas()
+                    pending = table.slice(chunksize).to_batches()
+
+            if pending and sum(piece.num_rows for piece in pending):
+                yield pa.Table.from_batches(pending).to_pandas()
+
+    elif path.endswith((".ndjson", ".jsonl")):
+
+        with open(path, "r", encoding = "utf-8") as iFile:
+            lines = islice((line for line in iFile if line.strip()), skip_rows, None)
+            for chunk in Chunks(lines, chunksize):
+                yield pd.DataFrame([json.loads(line) for line in chunk], columns = columns)
+
+    else:
+        raise ValueError(f"Input format not supported: {path}")
+
+def InitWorker(models_path:str) -> None:
+
+    # Each process loads the models once (they are already loaded if the process was forked)
+
+    if app.random_forest_clf is None:
+        app.LoadModels(models_path)
+
+def ToText(value) -> str:
+
+    # Comments saved as lists of lemmas (labeled_data_clean.feather) are joined by spaces
+    # as in the training notebook, missing values are scored as empty texts
+
+    if isinstance(value, str):
+        return value
+    if pd.api.types.is_list_like(value):
+        return " ".join(str(token) for token in value)
+
+    return "" if value is None or pd.isna(value) else str(value)
+
+def ScoreChunk(ids:list, texts:list) -> pd.DataFrame:
+
+    # This function runs the same chain as the app (cleaning, lemmas, vectorizer, feature
+    # selector and forest) over a chunk and returns the prediction and probabilities of each text
+
+    predictions, probabilities = app.PredictTexts([ToText(text) for text in texts])
+    class_names = [app.map_class[label] for label in app.random_forest_clf.classes_]
+
+    scores = pd.DataFrame(probabilities, columns = [f"probability_{name}" for name in class_names])
+    scores.insert(0, "prediction", [app.map_class[label] for label in predictions])
+    scores.insert(0, "id", ids)
+
+    return scores
+
+def ScoreChunks(chunks, n_jobs:int = 1, models_path:str = app.MODELS_PATH):
+
+    '''
+    Generator scoring the chunks in order. With n_jobs > 1 only a few chunks are sent to
+    the pool at the same time, so the memory used doesn't depend on the number of chunks
+
+    Parameters
+    ----------
+
+    chunks: iterable
+        Tuples (ids, texts) of each chunk
+
+    n_jobs: int; default=1
+        Number of processes. None uses all the cpus and 1 doesn't create any process
+
+    models_path: str; default=MODELS_PATH
+        Folder with the models
+
+    Yields
+    ------
+
+    pd.DataFrame: The scores of each chunk returned by ScoreChunk
+
+    '''
+
+    InitWorker(models_path)
+
+    if n_jobs == 1:
+        for ids, texts in chunks:
+            yield ScoreChunk(ids, texts)
+        return
+
+    with Pool(n_jobs, initializer = InitWorker, initargs = (models_path,)) as pool:
+
+        pending = deque()
+        max_pending = 2 * (n_jobs or os.cpu_count() or 1)
+
+        for ids, texts in chunks:
+            pending.append(pool.apply_async(ScoreChunk, (ids, texts)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+def ReadCheckpoint(path:str, settings:dict) -> dict:
+
+    # This function returns the checkpoint of a previous run with the same settings or None
+
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r", encoding = "utf-8") as iFile:
+        checkpoint = json.load(iFile)
+
+    return checkpoint if checkpoint.get("settings") == settings else None
+
+def WriteCheckpoint(path:str, checkpoint:dict) -> None:
+
+    # The checkpoint is replaced atomically, an interruption never leaves it half written
+
+    with open(path + ".tmp", "w", encoding = "utf-8") as oFile:
+        json.dump(checkpoint, oFile)
+        oFile.flush()
+        os.fsync(oFile.fileno())
+
+    os.replace(path + ".tmp", path)
+
+def ScoreFile(input_path:str, output_path:str, column:str = "comment", id_column:str = None,
+              models_path:str = app.MODELS_PATH, chunksize:int = 5000, n_jobs:int = 1,
+              restart:bool = False) -> dict:
+
+    '''
+    This function scores all the comments of a file and writes the predictions in another
+    one, chunk by chunk. After each chunk written a checkpoint (output_path + ".checkpoint")
+    saves the rows done and the size of the output, so an interrupted run continues from
+    the last chunk written. The checkpoint is removed when the run finishes
+
+    Parameters
+    ----------
+
+    input_path: str
+        File with the comments (.csv, .feather, .ndjson or .jsonl)
+
+    output_path: str
+        File where the predictions are written (.csv, .ndjson or .jsonl)
+
+    column: str; default="comment"
+        Column with the text of the comments
+
+    id_column: str; default=None
+        Column copied to the output as "id". None uses the number of the row
+
+    models_path: str; default=MODELS_PATH
+        Folder with the models
+
+    chunksize: int; default=5000
+        Number of comments read and scored at once
+
+    n_jobs: int; default=1
+        Number of processes. None uses all the cpus and 1 doesn't create any process
+
+    restart: bool; default=False
+        Ignore the checkpoint of a previous run
+
+    Returns
+    -------
+
+    dict: Rows scored in this run, total rows in the output and seconds taken
+
+    '''
+
+    as_csv = output_path.endswith(".csv")
+    if not as_csv and not output_path.endswith((".ndjson", ".jsonl")):
+        raise ValueError(f"Output format not supported: {output_path}")
+
+    checkpoint_path = output_path + ".checkpoint"
+    settings = {"input": os.path.abspath(input_path), "column": column, "id_column": id_column}
+
+    checkpoint = None if restart else ReadCheckpoint(checkpoint_path, settings)
+    if checkpoint is None:
+        checkpoint = {"settings": settings, "rows": 0, "output_bytes": 0}
+
+    # Anything written after the last checkpoint (a chunk partially written) is dropped
+    with open(output_path, "ab") as oFile:
+        oFile.truncate(checkpoint["output_bytes"])
+
+    columns = [column] if id_column is None or id_column == column else [id_column, column]
+    start_row = checkpoint["rows"]
+
+    def Chunk():
+        row = start_row
+        for chunk in ReadChunks(input_path, columns, chunksize, skip_rows = start_row):
+            ids = chunk[id_column].tolist() if id_column else list(range(row, row + len(chunk)))
+            row += len(chunk)
+            yield ids, chunk[column].tolist()
+
+    start = perf_counter()
+
+    with open(output_path, "ab") as oFile:
+
+        for scores in ScoreChunks(Chunk(), n_jobs, models_path):
+
+            if as_csv:
+                text = scores.to_csv(header = (checkpoint["output_bytes"] == 0), index = False)
+            else:
+                text = scores.to_json(orient = "records", lines = True, force_ascii = False).rstrip("\n")
+                text = text + "\n" if text else text
+
+            oFile.write(text.encode("utf-8"))
+            oFile.flush()
+            os.fsync(oFile.fileno())
+
+            checkpoint["rows"] += len(scores)
+            checkpoint["output_bytes"] = oFile.tell()
+            WriteCheckpoint(checkpoint_path, checkpoint)
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    return {
+        "rows_scored": checkpoint["rows"] - start_row,
+        "rows_total": checkpoint["rows"],
+        "seconds": perf_counter() - start
+    }
+
+if __name__ == "__main__":
+
+    arguments = CreateArguments()
+
+    summary = ScoreFile(arguments.input, arguments.output, arguments.column, arguments.id_column,
+                        arguments.models, arguments.chunksize, arguments.n_jobs or None, arguments.restart)
+
+    print(f"{summary['rows_scored']} comments scored in {summary['seconds']:.1f} secs "
+          f"({summary['rows_total']} in {arguments.output})")
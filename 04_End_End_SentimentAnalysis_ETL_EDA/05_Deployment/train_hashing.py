@@ -0,0 +1,126 @@
+import os
+import joblib
+import argparse as arg
+from time import perf_counter
+
+from sklearn.model_selection import train_test_split
+from sklearn.feature_selection import SelectKBest, chi2
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import f1_score, accuracy_score
+
+from utils.hashing import HashingTfidfVectorizer
+from retrain import LoadLabeledComments
+from app import FEATURE_PIPELINES
+
+def CreateArguments() -> arg.ArgumentParser.parse_args:
+
+    '''
+    This function creates the arguments of the command line
+
+    Returns
+    -------
+
+    argparse: argparse object created by ArgumentParser.parse_args
+
+    '''
+
+    args = arg.ArgumentParser(description="Train the sentiment model with hashed TF-IDF features (no vocabulary), used by app.py with FEATURE_PIPELINE=hashing")
+    args.add_argument("data", type=str,
+                    help="Labeled comments (.feather, .csv or parquet dataset folder with the columns comment and class), e.g ../data/labeled_data_clean.feather")
+    args.add_argument("--models", dest="models", type=str, default="models",
+                    help="Folder where the artifacts are saved. Default is 'models'")
+    args.add_argument("--n-features", dest="n_features", type=int, default=2**18,
+                    help="Number of columns of the hashed space. Default is 2**18")
+    args.add_argument("--min-df", dest="min_df", type=int, default=10,
+                    help="Minimum number of documents of a column, as min_df of the notebook. Default is 10")
+    args.add_argument("--k", dest="k", type=int, default=250,
+                    help="Number of columns selected by chi2. Default is 250")
+    args.add_argument("--n-jobs", dest="n_jobs", type=int, default=1,
+                    help="Processes used to fit the idf and the forest. 0 uses all the cpus. Default is 1")
+    args.add_argument("--seed", dest="seed", type=int, default=None,
+                    help="Seed of the train/test split. Default is a random split as the notebook")
+
+    return args.parse_args()
+
+def TrainHashingPipeline(texts:list, labels, n_features:int = 2**18, min_df:int = 10, k:int = 250,
+                         n_jobs:int = 1, seed:int = None) -> "(tuple, dict)":
+
+    '''
+    This function trains the same chain as 03_SentimentAnalysis.ipynb (vectorizer and chi2
+    fitted with all the comments, random forest fitted with 70% of them) with hashed
+    TF-IDF features. chi2 selects the k best columns of the hashed space
+
+    Parameters
+    ----------
+
+    texts: list
+        Comments (lemmas joined by spaces)
+
+    labels: array-like
+        Class of each comment
+
+    n_features: int; default=2**18
+        Number of columns of the hashed space
+
+    min_df: int; default=10
+        Minimum number of documents of a column
+
+    k: int; default=250
+        Number of columns selected by chi2
+
+    n_jobs: int; default=1
+        Number of processes. None uses all the cpus
+
+    seed: int; default=None
+        Seed of the train/test split and the forest
+
+    Returns
+    -------
+
+    (tuple, dict): A tuple containing the fitted vectorizer, feature selector and model,
+        and the scores on the test set with the times of each step respectively
+
+    '''
+
+    start = perf_counter()
+    vectorizer = HashingTfidfVectorizer(n_features = n_features, min_df = min_df).fit(texts, n_jobs = n_jobs)
+    X_vect = vectorizer.transform(texts)
+    time_vectorizer = perf_counter() - start
+
+    start = perf_counter()
+    feature_selector = SelectKBest(chi2, k = k).fit(X_vect, labels)
+    X_chi2 = feature_selector.transform(X_vect)
+    time_chi2 = perf_counter() - start
+
+    X_train, X_test, y_train, y_test = train_test_split(X_chi2, labels, train_size = 0.7, random_state = seed)
+
+    start = perf_counter()
+    model = RandomForestClassifier(n_jobs = n_jobs, random_state = seed).fit(X_train, y_train)
+    time_model = perf_counter() - start
+
+    y_hat = model.predict(X_test)
+    scores = {
+        "f1_score": f1_score(y_test, y_hat, average = "macro"),
+        "accuracy": accuracy_score(y_test, y_hat),
+        "columns_used": vectorizer.n_columns_used_,
+        "time": {"vectorizer": time_vectorizer, "chi2": time_chi2, "training": time_model}
+    }
+
+    return (vectorizer, feature_selector, model), scores
+
+if __name__ == "__main__":
+
+    arguments = CreateArguments()
+
+    texts, labels = LoadLabeledComments(arguments.data)
+    artifacts, scores = TrainHashingPipeline(texts, labels, arguments.n_features, arguments.min_df, arguments.k,
+                                             arguments.n_jobs or None, arguments.seed)
+
+    os.makedirs(arguments.models, exist_ok = True)
+    for name, artifact in zip(FEATURE_PIPELINES["hashing"], artifacts):
+        joblib.dump(artifact, os.path.join(arguments.models, name))
+
+    print(f"{scores['columns_used']} columns of {arguments.n_features} with at least {arguments.min_df} comments")
+    print(f"f1 (macro): {scores['f1_score']:.4f}, accuracy: {scores['accuracy']:.4f}")
+    print("Seconds: " + ", ".join(f"{step} {seconds:.1f}" for step, seconds in scores["time"].items()))
+    print(f"Run the app with FEATURE_PIPELINE=hashing MODELS_PATH={arguments.models}")
@@ -0,0 +1,175 @@
+import os
+from collections import deque
+from multiprocessing import Pool
+
+import numpy as np
+import scipy.sparse as sp
+
+from sklearn.preprocessing import normalize
+from sklearn.feature_extraction.text import HashingVectorizer
+
+from utils.process_text import Chunks
+
+def DocumentFrequency(hashing:HashingVectorizer, documents:list) -> np.ndarray:
+
+    # This function returns the number of documents with each column of the hashed space.
+    # Defined at module level to be sent to other processes
+
+    X = hashing.transform(documents)
+    return np.bincount(X.indices, minlength = hashing.n_features)
+
+class HashingTfidfVectorizer:
+
+    '''
+    This class gives the same kind of features as TfidfVectorizer without a vocabulary:
+    terms are mapped to n_features columns with a hash (HashingVectorizer) and only the
+    idf of each column is fitted. There is no dictionary of terms to keep in memory or to
+    save, and the fit is split in chunks across a pool of processes (the hash doesn't
+    need to see the other chunks)
+
+    Columns with less than min_df documents get an idf of 0, so they are removed from the
+    output and from the norm as TfidfVectorizer does with the terms. Different terms can
+    share a column (collisions), a larger n_features makes it less likely
+
+    Parameters
+    ----------
+
+        n_features: int; default=2**18
+            Number of columns of the hashed space
+
+        min_df: int, float; default=10
+            Minimum number (int) or fraction (float) of documents of a column
+
+        sublinear_tf: bool; default=False
+            Replace tf with 1 + log(tf)
+
+        smooth_idf: bool; default=True
+            Add one to the document frequencies as TfidfVectorizer
+
+        norm: str; ["l2","l1",None]; default="l2"
+            Norm of each document
+
+        hashing_params:
+            Other parameters of HashingVectorizer (e.g ngram_range, token_pattern).
+            alternate_sign and norm are always False and None
+
+    Examples
+    --------
+
+    >>> vectorizer = HashingTfidfVectorizer(min_df = 10).fit(comments, n_jobs = None)
+    >>> X = vectorizer.transform(comments)
+
+    '''
+
+    def __init__(self, n_features:int = 2**18, min_df = 10, sublinear_tf:bool = False,
+                 smooth_idf:bool = True, norm:str = "l2", **hashing_params):
+
+        self.n_features = n_features
+        self.min_df = min_df
+        self.sublinear_tf = sublinear_tf
+        self.smooth_idf = smooth_idf
+        self.norm = norm
+        self.hashing_params = hashing_params
+
+    def BuildHashing(self) -> HashingVectorizer:
+
+        # Counts of each column, the weights are applied by transform
+        return HashingVectorizer(n_features = self.n_features, alternate_sign = False,
+                                 norm = None, **self.hashing_params)
+
+    def fit(self, raw_documents, y = None, n_jobs:int = 1, chunksize:int = 10000) -> "HashingTfidfVectorizer":
+
+        '''
+        Fit the idf of each column
+
+        Parameters
+        ----------
+
+        raw_documents: iterable
+            Documents (str). It can be a generator, it's read only once
+
+        y: None
+            Ignored
+
+        n_jobs: int; default=1
+            Number of processes. None uses all the cpus and 1 doesn't create any process
+
+        chunksize: int; default=10000
+            Number of documents sent to each process at once
+
+        Returns
+        -------
+
+        HashingTfidfVectorizer: self
+
+        '''
+
+        hashing = self.BuildHashing()
+        document_frequency = np.zeros(self.n_features, dtype = np.int64)
+        n_documents = 0
+
+        if n_jobs == 1:
+            for chunk in Chunks(raw_documents, chunksize):
+                document_frequency += DocumentFrequency(hashing, chunk)
+                n_documents += len(chunk)
+
+        else:
+            with Pool(n_jobs) as pool:
+
+                # Only a few chunks are sent to the pool at the same time
+                pending = deque()
+                max_pending = 2 * (n_jobs or os.cpu_count() or 1)
+
+                for chunk in Chunks(raw_documents, chunksize):
+                    pending.append(pool.apply_async(DocumentFrequency, (hashing, chunk)))
+                    n_documents += len(chunk)
+                    if len(pending) >= max_pending:
+                        document_frequency += pending.popleft().get()
+
+                while pending:
+                    document_frequency += pending.popleft().get()
+
+        min_count = self.min_df if isinstance(self.min_df, (int, np.integer)) else self.min_df * n_documents
+
+        idf = np.log((n_documents + int(self.smooth_idf)) / (document_frequency + int(self.smooth_idf))) + 1.0
+        idf[document_frequency < max(min_count, 1)] = 0.0
+
+        self.idf_ = idf
+        self.n_documents_ = n_documents
+        self.n_columns_used_ = int(np.count_nonzero(idf))
+
+        return self
+
+    def transform(self, raw_documents) -> sp.csr_matrix:
+
+        '''
+        TF-IDF of each document in the hashed space
+
+        Parameters
+        ----------
+
+        raw_documents: iterable
+            Documents (str) to transform
+
+        Returns
+        -------
+
+        sp.csr_matrix: A sparse matrix of shape (n_documents, n_features)
+
+        '''
+
+        X = self.BuildHashing().transform(raw_documents).tocsr()
+
+        if self.sublinear_tf:
+            np.log(X.data, out = X.data)
+            X.data += 1.0
+
+        X.data *= self.idf_[X.indices]
+        X.eliminate_zeros()
+
+        return normalize(X, norm = self.norm, copy = False) if self.norm is not None else X
+
+    def fit_transform(self, raw_documents, y = None, n_jobs:int = 1, chunksize:int = 10000) -> sp.csr_matrix:
+
+        # The documents are read twice, raw_documents must be a list or similar
+        return self.fit(raw_documents, y, n_jobs, chunksize).transform(raw_documents)
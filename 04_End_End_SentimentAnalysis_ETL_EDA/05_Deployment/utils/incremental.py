@@ -0,0 +1,452 @@
+import numpy as np
+import scipy.sparse as sp
+
+from scipy.stats import chi2 as chi2_distribution
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+class TermSelector:
+
+    '''
+    This class selects the columns of a fixed list of terms from the output of a
+    vectorizer. It has the methods used from SelectKBest (transform and get_support),
+    so it can replace it in the app and in CompiledPipeline
+
+    Parameters
+    ----------
+
+        support: np.ndarray
+            Indexes of the columns selected, sorted
+
+        n_features_in: int
+            Number of columns of the vectorizer
+
+        scores: np.ndarray; default=None
+            Score (chi2) of each column of the vectorizer, kept for information
+
+    '''
+
+    def __init__(self, support:np.ndarray, n_features_in:int, scores:np.ndarray = None):
+
+        self.support_ = np.asarray(support, dtype = np.int64)
+        self.n_features_in_ = n_features_in
+        self.scores_ = scores
+
+    def get_support(self, indices:bool = False) -> np.ndarray:
+
+        if indices:
+            return self.support_
+
+        mask = np.zeros(self.n_features_in_, dtype = bool)
+        mask[self.support_] = True
+        return mask
+
+    def transform(self, X):
+        return X[:, self.support_]
+
+class IncrementalTrainer:
+
+    '''
+    This class keeps the statistics needed by TfidfVectorizer and chi2 (documents by term
+    and counts of each term by class) updated with new labeled comments, so the vectorizer
+    is rebuilt without reading again all the comments and only the classifier is trained
+    with the new ones
+
+    1. The vectorizer is exactly the same as TfidfVectorizer(**vectorizer_params) fitted
+       with all the comments seen (vocabulary by min_df/max_df and idf)
+    2. The terms used by the classifier (k best by chi2) are kept fixed, otherwise the
+       trees or weights already trained would read other columns. chi2 is updated with
+       every batch and SelectionOverlap tells how many of these terms are still in the
+       top k (a low value means it's time for a full retraining)
+    3. The classifier is updated with the new comments only:
+       - Forests (warm_start): trees_per_update new trees are added, the oldest ones are
+         removed above max_estimators
+       - Models with partial_fit (e.g SGDClassifier(loss="log_loss")): one more pass
+
+    Note that chi2 is computed on the counts of the terms by class and not on the TF-IDF
+    values as in 03_SentimentAnalysis.ipynb, since TF-IDF values change with every update
+    of the idf
+
+    Parameters
+    ----------
+
+        classes: list
+            All the classes (labels), e.g [0, 1, 2]
+
+        k: int; default=250
+            Number of terms used by the classifier
+
+        classifier: estimator; default=None
+            Classifier to train. None uses RandomForestClassifier()
+
+        trees_per_update: int; default=10
+            Trees added to a forest with each update
+
+        max_estimators: int; default=None
+            Maximum number of trees of a forest. None keeps all of them
+
+        vectorizer_params: dict; default=None
+            Parameters of TfidfVectorizer. None uses {"min_df": 10} as the training notebook
+
+    Examples
+    --------
+
+    >>> trainer = IncrementalTrainer([0, 1, 2]).Fit(texts, labels)
+    >>> trainer.Update(new_texts, new_labels)
+    >>> vectorizer, feature_selector, model = trainer.Artifacts()
+
+    '''
+
+    def __init__(self, classes:list, k:int = 250, classifier = None, trees_per_update:int = 10,
+                 max_estimators:int = None, vectorizer_params:dict = None):
+
+        self.classes_ = np.unique(classes)
+        self.k = k
+        self.classifier = RandomForestClassifier() if classifier is None else classifier
+        self.trees_per_update = trees_per_update
+        self.max_estimators = max_estimators
+        self.vectorizer_params = {"min_df": 10} if vectorizer_params is None else dict(vectorizer_params)
+
+        if self.vectorizer_params.get("max_features") is not None:
+            raise ValueError("max_features is not supported")
+
+        self.n_documents = 0
+        self.class_counts = np.zeros(len(self.classes_), dtype = np.int64)
+        self.term_index = {}
+        self.document_frequency = np.zeros(0, dtype = np.int64)
+        self.class_term_counts = np.zeros((len(self.classes_), 0), dtype = np.float64)
+
+        self.selected_terms = None
+        self.vectorizer = None
+        self.feature_selector = None
+
+    def __getstate__(self):
+
+        # The analyzer is built again after loading (it could contain lambdas)
+
+        state = self.__dict__.copy()
+        state.pop("_analyzer", None)
+        return state
+
+    def BuildAnalyzer(self):
+
+        # This method returns the function used by TfidfVectorizer to get the terms of a document
+
+        if getattr(self, "_analyzer", None) is None:
+            self._analyzer = TfidfVectorizer(**self.vectorizer_params).build_analyzer()
+
+        return self._analyzer
+
+    def __CountTerms(self, texts:list) -> sp.csr_matrix:
+
+        # This method returns the counts of each term (columns of term_index, new terms are
+        # added) in each text
+
+        analyzer = self.BuildAnalyzer()
+        data, indices, indptr = [], [], [0]
+
+        for text in texts:
+            for term in analyzer(text):
+                indices.append(self.term_index.setdefault(term, len(self.term_index)))
+            indptr.append(len(indices))
+
+        data = np.ones(len(indices), dtype = np.float64)
+        counts = sp.csr_matrix((data, indices, indptr), shape = (len(texts), len(self.term_index)))
+        counts.sum_duplicates()
+
+        return counts
+
+    def UpdateStatistics(self, texts:list, labels) -> None:
+
+        '''
+        Add the documents by term, documents by class and counts of each term by class of
+        a batch of labeled comments
+
+        Parameters
+        ----------
+
+        texts: list
+            Comments (lemmas joined by spaces)
+
+        labels: list
+            Class of each comment
+
+        '''
+
+        labels = np.asarray(labels)
+        unknown = np.setdiff1d(labels, self.classes_)
+        if unknown.size:
+            raise ValueError(f"Unknown classes: {unknown.tolist()}")
+
+        counts = self.__CountTerms(texts)
+        n_terms = len(self.term_index)
+
+        # Arrays grow with the new terms
+        self.document_frequency = np.concatenate([self.document_frequency,
+                                                  np.zeros(n_terms - self.document_frequency.size, dtype = np.int64)])
+        self.class_term_counts = np.hstack([self.class_term_counts,
+                                            np.zeros((len(self.classes_), n_terms - self.class_term_counts.shape[1]))])
+
+        self.document_frequency += np.bincount(counts.indices, minlength = n_terms)
+
+        label_index = np.searchsorted(self.classes_, labels)
+        Y = sp.csr_matrix((np.ones(len(labels)), (label_index, np.arange(len(labels)))),
+                          shape = (len(self.classes_), len(labels)))
+
+        self.class_term_counts += (Y @ counts).toarray()
+        self.class_counts += np.bincount(label_index, minlength = len(self.classes_))
+        self.n_documents += len(labels)
+
+    def Vocabulary(self) -> list:
+
+        # This method returns the terms kept by min_df/max_df, sorted as TfidfVectorizer does
+
+        min_df = self.vectorizer_params.get("min_df", 1)
+        max_df = self.vectorizer_params.get("max_df", 1.0)
+
+        min_count = min_df if isinstance(min_df, (int, np.integer)) else min_df * self.n_documents
+        max_count = max_df if isinstance(max_df, (int, np.integer)) else max_df * self.n_documents
+
+        return sorted(term for term, index in self.term_index.items()
+                      if min_count <= self.document_frequency[index] <= max_count)
+
+    def BuildVectorizer(self) -> TfidfVectorizer:
+
+        '''
+        Return a TfidfVectorizer equal to TfidfVectorizer(**vectorizer_params) fitted
+        with all the comments seen
+
+        Returns
+        -------
+
+        TfidfVectorizer: The vectorizer ready to transform
+
+        '''
+
+        vocabulary = self.Vocabulary()
+        if not vocabulary:
+            raise ValueError("No terms left after min_df/max_df, more comments are needed")
+
+        vectorizer = TfidfVectorizer(**self.vectorizer_params)
+        vectorizer.vocabulary_ = {term: column for column, term in enumerate(vocabulary)}
+        vectorizer.fixed_vocabulary_ = False
+
+        if vectorizer.use_idf:
+
+            # Same operations as TfidfTransformer.fit, so the idf is exactly the same
+            df = self.document_frequency[[self.term_index[term] for term in vocabulary]].astype(np.float64)
+            df += float(vectorizer.smooth_idf)
+            n_samples = self.n_documents + int(vectorizer.smooth_idf)
+
+            idf = np.full_like(df, fill_value = n_samples, dtype = np.float64)
+            idf /= df
+            np.log(idf, out = idf)
+            idf += 1.0
+
+            vectorizer.idf_ = idf
+
+        return vectorizer
+
+    def Chi2Scores(self, vocabulary:list) -> "(np.ndarray, np.ndarray)":
+
+        '''
+        Return chi2 and its p-value for each term of vocabulary, computed with the counts
+        of the terms by class
+
+        Parameters
+        ----------
+
+        vocabulary: list
+            Terms to score
+
+        Returns
+        -------
+
+        (np.ndarray, np.ndarray): A tuple containing the scores and p-values respectively
+
+        '''
+
+        observed = self.class_term_counts[:, [self.term_index[term] for term in vocabulary]]
+        class_probability = self.class_counts / self.n_documents
+        expected = np.outer(class_probability, observed.sum(axis = 0))
+
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            scores = ((observed - expected) ** 2 / expected).sum(axis = 0)
+
+        return scores, chi2_distribution.sf(scores, len(self.classes_) - 1)
+
+    def TopTerms(self, vocabulary:list, k:int) -> list:
+
+        # This method returns the k terms of vocabulary with the highest chi2
+
+        scores, _ = self.Chi2Scores(vocabulary)
+        order = np.argsort(-np.nan_to_num(scores, nan = -np.inf), kind = "stable")
+
+        return [vocabulary[i] for i in order[:k]]
+
+    def SelectionOverlap(self) -> float:
+
+        # Fraction of the terms used by the classifier that are still in the top k by chi2
+
+        top_terms = self.TopTerms(self.Vocabulary(), len(self.selected_terms))
+        return len(set(top_terms) & set(self.selected_terms)) / len(self.selected_terms)
+
+    def __Rebuild(self) -> None:
+
+        # Vectorizer and selector of the fixed terms after updating the statistics
+
+        self.vectorizer = self.BuildVectorizer()
+
+        missing = [term for term in self.selected_terms if term not in self.vectorizer.vocabulary_]
+        if missing:
+            raise ValueError(f"Terms used by the classifier not in the vocabulary: {missing[:10]}")
+
+        # Columns sorted, as SelectKBest.transform. The order of the terms (alphabetical) is
+        # the same in every update even if the vocabulary grows
+        support = np.sort([self.vectorizer.vocabulary_[term] for term in self.selected_terms])
+        vocabulary = sorted(self.vectorizer.vocabulary_, key = self.vectorizer.vocabulary_.get)
+        scores, _ = self.Chi2Scores(vocabulary)
+
+        self.feature_selector = TermSelector(support, len(vocabulary), scores)
+
+    def Transform(self, texts:list):
+
+        # Features used by the classifier
+        return self.feature_selector.transform(self.vectorizer.transform(texts))
+
+    def Fit(self, texts:list, labels) -> "IncrementalTrainer":
+
+        '''
+        Compute the statistics of all the comments, select the k best terms by chi2 and
+        train the classifier from scratch
+
+        Parameters
+        ----------
+
+        texts: list
+            Comments (lemmas joined by spaces)
+
+        labels: list
+            Class of each comment
+
+        Returns
+        -------
+
+        IncrementalTrainer: self
+
+        '''
+
+        self.UpdateStatistics(texts, labels)
+        self.selected_terms = self.TopTerms(self.Vocabulary(), self.k)
+        self.__Rebuild()
+
+        self.classifier = clone(self.classifier).fit(self.Transform(texts), labels)
+
+        return self
+
+    @classmethod
+    def FromArtifacts(cls, vectorizer, feature_selector, model, texts:list, labels, **kwargs) -> "IncrementalTrainer":
+
+        '''
+        Create the trainer of the artifacts saved by 03_SentimentAnalysis.ipynb: the
+        statistics are computed with the comments used to train them, the terms selected
+        and the model are kept
+
+        Parameters
+        ----------
+
+        vectorizer: TfidfVectorizer
+            Fitted vectorizer
+
+        feature_selector: SelectKBest
+            Fitted feature selector
+
+        model: estimator
+            Fitted classifier
+
+        texts: list
+            Comments used to fit the vectorizer (lemmas joined by spaces)
+
+        labels: list
+            Class of each comment
+
+        kwargs:
+            Other parameters of IncrementalTrainer
+
+        Returns
+        -------
+
+        IncrementalTrainer: The trainer ready to be updated
+
+        '''
+
+        vectorizer_params = {key: value for key, value in vectorizer.get_params().items() if key != "vocabulary"}
+
+        terms = np.array(sorted(vectorizer.vocabulary_, key = vectorizer.vocabulary_.get))
+
+        trainer = cls(model.classes_, k = int(feature_selector.get_support().sum()), classifier = model,
+                      vectorizer_params = vectorizer_params, **kwargs)
+
+        trainer.UpdateStatistics(texts, labels)
+        trainer.selected_terms = terms[feature_selector.get_support(indices = True)].tolist()
+        trainer.__Rebuild()
+
+        return trainer
+
+    def Update(self, texts:list, labels) -> "IncrementalTrainer":
+
+        '''
+        Add a batch of new labeled comments: statistics, vectorizer and selector are updated
+        and the classifier is trained with the new comments only
+
+        Parameters
+        ----------
+
+        texts: list
+            New comments (lemmas joined by spaces)
+
+        labels: list
+            Class of each comment
+
+        Returns
+        -------
+
+        IncrementalTrainer: self
+
+        '''
+
+        labels = np.asarray(labels)
+
+        self.UpdateStatistics(texts, labels)
+        self.__Rebuild()
+
+        X = self.Transform(texts)
+
+        if hasattr(self.classifier, "partial_fit"):
+            self.classifier.partial_fit(X, labels, classes = self.classes_)
+
+        elif hasattr(self.classifier, "estimators_") and "warm_start" in self.classifier.get_params():
+
+            # New trees learn the classes from the new comments, all of them must be present
+            if not np.array_equal(np.unique(labels), self.classes_):
+                raise ValueError("Every class must be in the new comments to add trees to the forest")
+
+            n_estimators = len(self.classifier.estimators_) + self.trees_per_update
+            self.classifier.set_params(warm_start = True, n_estimators = n_estimators)
+            self.classifier.fit(X, labels)
+
+            if self.max_estimators is not None and len(self.classifier.estimators_) > self.max_estimators:
+                self.classifier.estimators_ = self.classifier.estimators_[-self.max_estimators:]
+                self.classifier.set_params(n_estimators = self.max_estimators)
+
+        else:
+            raise ValueError(f"{type(self.classifier).__name__} can't be updated, it needs partial_fit or warm_start")
+
+        return self
+
+    def Artifacts(self) -> tuple:
+
+        # Vectorizer, feature selector and model used by app.py
+
+        return self.vectorizer, self.feature_selector, self.classifier
@@ -0,0 +1,378 @@
+import copy
+
+import numpy as np
+import scipy.sparse as sp
+
+from sklearn import __version__ as sklearn_version
+from sklearn.feature_extraction.text import CountVectorizer
+
+# Since sklearn 1.4 tree_.value holds the fraction of each class. Before, it held the
+# (weighted) counts, normalized by DecisionTreeClassifier.predict_proba
+NORMALIZED_TREE_VALUES = tuple(int(part) for part in sklearn_version.split(".")[:2]) >= (1, 4)
+
+def SmallestIntDtype(minimum:int, maximum:int) -> np.dtype:
+
+    # This function returns the smallest integer dtype holding values from minimum to maximum
+
+    for dtype in (np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32):
+        if np.iinfo(dtype).min <= minimum and maximum <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+
+    return np.dtype(np.int64)
+
+class PrunedTfidfVectorizer:
+
+    '''
+    This class fuses a fitted TfidfVectorizer and a fitted feature selector (e.g SelectKBest)
+    into one transformer that only outputs the selected features. The output is exactly
+    the same as feature_selector.transform(vectorizer.transform(documents)) (for vectorizers
+    with dtype float64, the default), but the matrix with all the columns of the vocabulary
+    is never built
+
+    The weights (idf) of the terms not selected are kept only because the norm of each
+    document depends on all its terms. Terms not used by the norm are dropped as well as
+    the stop_words_ attribute of the vectorizer (every term removed by min_df/max_df)
+
+    Parameters
+    ----------
+
+        vectorizer: TfidfVectorizer
+            Fitted vectorizer
+
+        feature_selector: SelectKBest, SelectorMixin
+            Fitted feature selector applied to the output of the vectorizer
+
+    '''
+
+    def __init__(self, vectorizer, feature_selector):
+
+        if vectorizer.norm not in (None, "l1", "l2"):
+            raise ValueError(f"Norm not supported: {vectorizer.norm}")
+
+        analyzer_parameters = CountVectorizer().get_params().keys()
+        self.analyzer_params = {key: value for key, value in vectorizer.get_params().items()
+                                if key in analyzer_parameters and key != "vocabulary"}
+
+        self.binary = vectorizer.binary
+        self.sublinear_tf = vectorizer.sublinear_tf
+        self.norm = vectorizer.norm
+        self.dtype = vectorizer.dtype
+
+        # All the terms are only needed to compute the norm of the documents. Columns
+        # keep the order of the vocabulary (the order used by sklearn to sum the norm)
+        n_terms = len(vectorizer.vocabulary_)
+        idf = vectorizer.idf_ if vectorizer.use_idf else np.ones(n_terms)
+        keep_all_terms = self.norm is not None
+
+        support = feature_selector.get_support(indices = True)
+        output_column = np.full(n_terms, -1, dtype = np.int64)
+        output_column[support] = np.arange(support.size)
+
+        self.vocabulary_ = {term: column for term, column in vectorizer.vocabulary_.items()
+                            if keep_all_terms or output_column[column] >= 0}
+
+        columns = np.array(sorted(self.vocabulary_.values()), dtype = np.int64)
+        remap = np.empty(n_terms, dtype = np.int64)
+        remap[columns] = np.arange(columns.size)
+
+        self.vocabulary_ = {term: int(remap[column]) for term, column in self.vocabulary_.items()}
+        self.idf_ = np.asarray(idf, dtype = np.float64)[columns]
+        self.output_column_ = output_column[columns]
+        self.n_features_out_ = int(support.size)
+
+        self._analyzer = None
+
+    def __getstate__(self):
+
+        # The analyzer is built again after loading (it could contain lambdas)
+
+        state = self.__dict__.copy()
+        state["_analyzer"] = None
+        return state
+
+    def BuildAnalyzer(self):
+
+        # This method returns the function used by the vectorizer to get the terms of a document
+
+        if self._analyzer is None:
+            self._analyzer = CountVectorizer(**self.analyzer_params).build_analyzer()
+
+        return self._analyzer
+
+    def Normalize(self, values:np.ndarray) -> np.ndarray:
+
+        # This method normalizes the values of one document. cumsum adds the values one by
+        # one in the same order as sklearn, so the result is exactly the same
+
+        if self.norm is None or values.size == 0:
+            return values
+
+        if self.norm == "l2":
+            norm = np.sqrt(np.cumsum(values * values)[-1])
+        else:
+            norm = np.cumsum(np.abs(values))[-1]
+
+        return values / norm if norm != 0 else values
+
+    def transform(self, raw_documents) -> sp.csr_matrix:
+
+        '''
+        Same output as feature_selector.transform(vectorizer.transform(raw_documents))
+
+        Parameters
+        ----------
+
+        raw_documents: iterable
+            Documents (str) to transform
+
+        Returns
+        -------
+
+        sp.csr_matrix: A sparse matrix of shape (n_documents, n_features_out_)
+
+        '''
+
+        analyzer = self.BuildAnalyzer()
+
+        data, indices, indptr = [], [], [0]
+
+        for document in raw_documents:
+
+            columns = [self.vocabulary_[term] for term in analyzer(document) if term in self.vocabulary_]
+            columns, counts = np.unique(np.asarray(columns, dtype = np.int64), return_counts = True)
+
+            values = np.ones(columns.size) if self.binary else counts.astype(np.float64)
+            if self.sublinear_tf:
+                values = np.log(values) + 1.0
+
+            values = self.Normalize(values * self.idf_[columns])
+
+            output_columns = self.output_column_[columns]
+            selected = output_columns >= 0
+
+            data.append(values[selected].astype(self.dtype, copy = False))
+            indices.append(output_columns[selected])
+            indptr.append(indptr[-1] + int(selected.sum()))
+
+        data = np.concatenate(data) if data else np.empty(0, dtype = self.dtype)
+        indices = np.concatenate(indices) if indices else np.empty(0, dtype = np.int64)
+
+        return sp.csr_matrix((data, indices, np.asarray(indptr, dtype = np.int64)),
+                             shape = (len(indptr) - 1, self.n_features_out_))
+
+class CompactForest:
+
+    '''
+    This class flattens a fitted RandomForestClassifier into contiguous numpy arrays (one
+    row per node of all the trees) and evaluates all the trees at once for a batch of
+    samples, moving every sample one level down in all the trees with each numpy operation.
+    The probabilities are exactly the same as forest.predict_proba(X)
+
+    Only the pairs (sample, tree) not in a leaf yet are moved at each step, so the cost
+    depends on the length of the paths followed and not on the depth of the deepest tree
+
+    Parameters
+    ----------
+
+        forest: RandomForestClassifier, ExtraTreesClassifier
+            Fitted forest with one output
+
+    Examples
+    --------
+
+    >>> compact_forest = CompactForest(random_forest_clf)
+    >>> np.array_equal(compact_forest.predict_proba(X), random_forest_clf.predict_proba(X))
+    True
+
+    '''
+
+    def __init__(self, forest):
+
+        if getattr(forest, "n_outputs_", 1) != 1:
+            raise ValueError("Only forests with one output are supported")
+
+        trees = [estimator.tree_ for estimator in forest.estimators_]
+
+        self.classes_ = forest.classes_
+        self.n_features_in_ = forest.n_features_in_
+        self.n_estimators = len(trees)
+
+        # Internal nodes and leaves are stored apart. A child (or a root) is the index of an
+        # internal node if it's >= 0 and the leaf -(child + 1) otherwise
+        roots, feature, threshold, left, right, leaf_value = [], [], [], [], [], []
+        n_internal = n_leaves = 0
+
+        for tree in trees:
+
+            is_leaf = tree.children_left < 0
+            internal, leaves = np.flatnonzero(~is_leaf), np.flatnonzero(is_leaf)
+
+            code = np.empty(tree.node_count, dtype = np.int64)
+            code[internal] = n_internal + np.arange(internal.size)
+            code[leaves] = -(n_leaves + np.arange(leaves.size) + 1)
+
+            roots.append(code[0])
+            feature.append(tree.feature[internal])
+            threshold.append(tree.threshold[internal])
+            left.append(code[tree.children_left[internal]])
+            right.append(code[tree.children_right[internal]])
+
+            proba = tree.value[leaves, 0, :len(forest.classes_)].astype(np.float64)
+
+            # Same normalization as DecisionTreeClassifier.predict_proba
+            if not NORMALIZED_TREE_VALUES:
+                normalizer = proba.sum(axis=1)[:, np.newaxis]
+                normalizer[normalizer == 0.0] = 1.0
+                proba /= normalizer
+
+            leaf_value.append(proba)
+
+            n_internal += internal.size
+            n_leaves += leaves.size
+
+        self.roots = np.asarray(roots, dtype = np.intp)
+        self.feature = np.concatenate(feature).astype(np.intp)
+        self.threshold = np.concatenate(threshold).astype(np.float64)
+        self.children_left = np.concatenate(left).astype(np.intp)
+        self.children_right = np.concatenate(right).astype(np.intp)
+        self.leaf_value = np.concatenate(leaf_value)
+
+    def apply(self, X) -> np.ndarray:
+
+        '''
+        Return the leaf reached by each sample in each tree
+
+        Parameters
+        ----------
+
+        X: np.ndarray, sp.spmatrix
+            Samples of shape (n_samples, n_features_in_)
+
+        Returns
+        -------
+
+        np.ndarray: Indexes of the leaves (rows of leaf_value) of shape (n_samples, n_estimators)
+
+        '''
+
+        # The trees of sklearn compare float32 values of X against float64 thresholds
+        X = X.toarray() if sp.issparse(X) else np.asarray(X)
+        X = X.astype(np.float32, copy = False)
+
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has {X.shape[1]} features, but the forest expects {self.n_features_in_}")
+
+        # One position per pair (sample, tree), active keeps the ones not in a leaf yet.
+        # X is read flattened, row_start is the position of the first value of each sample
+        values = np.ascontiguousarray(X).ravel()
+        nodes = np.tile(self.roots, X.shape[0])
+        row_start = np.repeat(np.arange(X.shape[0]) * X.shape[1], self.n_estimators)
+        active = np.flatnonzero(nodes >= 0)
+
+        while active.size:
+            current = nodes[active]
+            go_left = values[row_start[active] + self.feature[current]] <= self.threshold[current]
+            current = np.where(go_left, self.children_left[current], self.children_right[current])
+            nodes[active] = current
+            active = active[current >= 0]
+
+        return (-1 - nodes.astype(np.intp)).reshape(X.shape[0], self.n_estimators)
+
+    def predict_proba(self, X) -> np.ndarray:
+
+        # Probabilities of the leaves added tree by tree (cumsum keeps the order of the
+        # sum used by sklearn, so the result is exactly the same) and averaged
+
+        proba = self.leaf_value[self.apply(X)].astype(np.float64, copy = False)
+        proba = np.cumsum(proba, axis=1)[:, -1]
+        proba /= self.n_estimators
+
+        return proba
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+    def Quantize(self, value_dtype:str = "float16") -> "CompactForest":
+
+        '''
+        Return a copy of the forest using less memory: thresholds in float32, indexes in the
+        smallest integer dtype and probabilities of the leaves in value_dtype
+
+        Thresholds are rounded down to the closest float32. X is compared in float32, so
+        x <= threshold gives the same result and the path followed in each tree doesn't
+        change. Only the probabilities of the leaves (float16) can change the output
+
+        Parameters
+        ----------
+
+        value_dtype: str; ["float64","float32","float16"]; default="float16"
+            dtype of the probabilities of the leaves
+
+        Returns
+        -------
+
+        CompactForest: The forest with the arrays in smaller dtypes
+
+        '''
+
+        quantized = copy.copy(self)
+
+        threshold = self.threshold.astype(np.float32)
+        rounded_up = threshold.astype(np.float64) > self.threshold
+        threshold[rounded_up] = np.nextafter(threshold[rounded_up], np.float32(-np.inf))
+
+        n_internal, n_leaves = self.feature.size, self.leaf_value.shape[0]
+        index_dtype = SmallestIntDtype(-n_leaves, n_internal - 1)
+
+        quantized.threshold = threshold
+        quantized.feature = self.feature.astype(SmallestIntDtype(0, self.n_features_in_ - 1))
+        quantized.roots = self.roots.astype(index_dtype)
+        quantized.children_left = self.children_left.astype(index_dtype)
+        quantized.children_right = self.children_right.astype(index_dtype)
+        quantized.leaf_value = self.leaf_value.astype(value_dtype)
+
+        return quantized
+
+    def Nbytes(self) -> int:
+
+        # Bytes used by the arrays of the forest
+        return sum(array.nbytes for array in (self.roots, self.feature, self.threshold,
+                                              self.children_left, self.children_right, self.leaf_value))
+
+class CompiledPipeline:
+
+    '''
+    This class contains all the steps needed to predict (vectorizer, feature selection
+    and model) in one single object, so it can be saved and loaded as one artifact
+
+    Parameters
+    ----------
+
+        vectorizer: TfidfVectorizer
+            Fitted vectorizer
+
+        feature_selector: SelectKBest, SelectorMixin
+            Fitted feature selector applied to the output of the vectorizer
+
+        model: RandomForestClassifier
+            Fitted classifier trained on the features selected
+
+    '''
+
+    def __init__(self, vectorizer, feature_selector, model):
+
+        self.vectorizer = PrunedTfidfVectorizer(vectorizer, feature_selector)
+        self.model = model
+
+    @property
+    def classes_(self) -> np.ndarray:
+        return self.model.classes_
+
+    def transform(self, raw_documents) -> sp.csr_matrix:
+        return self.vectorizer.transform(raw_documents)
+
+    def predict(self, raw_documents) -> np.ndarray:
+        return self.model.predict(self.transform(raw_documents))
+
+    def predict_proba(self, raw_documents) -> np.ndarray:
+        return self.model.predict_proba(self.transform(raw_documents))
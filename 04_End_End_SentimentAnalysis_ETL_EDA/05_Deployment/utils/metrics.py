@@ -0,0 +1,190 @@
+import os
+import random
+import cProfile
+import threading
+from time import perf_counter, time
+from contextlib import contextmanager
+
+# Upper bounds (secs) of the buckets of the histograms. From 50 microseconds to 5 seconds
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class Histogram:
+
+    '''
+    This class counts observations (e.g seconds taken by a stage) in cumulative buckets
+    by label, and renders them in the Prometheus text format
+
+    Parameters
+    ----------
+
+        name: str
+            Name of the metric, e.g "sentiment_stage_seconds"
+
+        documentation: str
+            Description of the metric (HELP line)
+
+        label_name: str
+            Name of the label used to split the observations, e.g "stage"
+
+        buckets: tuple; default=DEFAULT_BUCKETS
+            Upper bounds of the buckets in increasing order
+
+    Examples
+    --------
+
+    >>> stages = Histogram("sentiment_stage_seconds", "Time by stage", "stage")
+    >>> with stages.Time("clean"):
+    ...     text = cleaner.FastCleaner(text)
+    >>> print(stages.Render())
+
+    '''
+
+    def __init__(self, name:str, documentation:str, label_name:str, buckets:tuple = DEFAULT_BUCKETS):
+
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self.buckets = tuple(buckets)
+
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._sums = {}
+
+    def Observe(self, label_value:str, value:float) -> None:
+
+        # This method adds one observation to the buckets of label_value
+
+        with self._lock:
+
+            if label_value not in self._counts:
+                self._counts[label_value] = [0] * (len(self.buckets) + 1)
+                self._sums[label_value] = 0.0
+
+            counts = self._counts[label_value]
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._sums[label_value] += value
+
+    @contextmanager
+    def Time(self, label_value:str):
+
+        # Context manager observing the seconds taken by the block
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.Observe(label_value, perf_counter() - start)
+
+    def Render(self) -> str:
+
+        # This method returns the histogram in the Prometheus text format
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+
+        with self._lock:
+            for label_value, counts in sorted(self._counts.items()):
+
+                label = f'{self.label_name}="{label_value}"'
+                for upper_bound, count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{label},le="{upper_bound}"}} {count}')
+
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {counts[-1]}')
+                lines.append(f"{self.name}_sum{{{label}}} {self._sums[label_value]}")
+                lines.append(f"{self.name}_count{{{label}}} {counts[-1]}")
+
+        return "\n".join(lines)
+
+def RenderValues(name:str, documentation:str, metric_type:str, values:dict, label_name:str = None) -> str:
+
+    '''
+    This function renders gauges or counters in the Prometheus text format
+
+    Parameters
+    ----------
+
+    name: str
+        Name of the metric
+
+    documentation: str
+        Description of the metric (HELP line)
+
+    metric_type: str; ["gauge","counter"]
+        Type of the metric
+
+    values: dict
+        Values of the metric by label value. If label_name is None, only the key None is used
+
+    label_name: str; default=None
+        Name of the label
+
+    Returns
+    -------
+
+    str: The metric in the Prometheus text format
+
+    '''
+
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+
+    for label_value, value in values.items():
+        label = "" if label_name is None else f'{{{label_name}="{label_value}"}}'
+        lines.append(f"{name}{label} {float(value)}")
+
+    return "\n".join(lines)
+
+class SamplingProfiler:
+
+    '''
+    This class profiles (cProfile) a random sample of the requests and saves the stats
+    of each one in a folder, so they can be checked with pstats or snakeviz
+
+    Parameters
+    ----------
+
+        sample_rate: float; default=0.0
+            Fraction of requests profiled. 0 disables the profiler
+
+        output_path: str; default="profiles"
+            Folder where the stats (.prof) are saved
+
+    '''
+
+    def __init__(self, sample_rate:float = 0.0, output_path:str = "profiles"):
+
+        self.sample_rate = sample_rate
+        self.output_path = output_path
+        self._local = threading.local()
+
+    def Start(self) -> None:
+
+        # This method starts profiling the current request if it's chosen in the sample
+
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            self._local.profiler = None
+            return
+
+        self._local.profiler = cProfile.Profile()
+        self._local.profiler.enable()
+
+    def Stop(self, name:str) -> str:
+
+        # This method stops the profiler of the current request (if any) and saves its stats.
+        # Returns the path of the stats or None
+
+        profiler = getattr(self._local, "profiler", None)
+        self._local.profiler = None
+
+        if profiler is None:
+            return None
+
+        profiler.disable()
+
+        os.makedirs(self.output_path, exist_ok = True)
+        path = os.path.join(self.output_path, f"{name}_{time():.6f}_{os.getpid()}.prof")
+        profiler.dump_stats(path)
+
+        return path
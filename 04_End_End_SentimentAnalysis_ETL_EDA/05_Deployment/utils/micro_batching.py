@@ -0,0 +1,140 @@
+import os
+import queue
+import threading
+from time import monotonic
+from concurrent.futures import Future
+
+class MicroBatcher:
+
+    '''
+    This class groups the requests received at the same time into one batch. A background
+    thread waits up to max_wait_ms after the first request of a batch (or until
+    max_batch_size requests are collected), calls predict_function once with all of them
+    and returns to each request its own result
+
+    It's useful with servers handling several requests at the same time with threads
+    (e.g the flask development server or gunicorn --threads), since the cost of the model
+    is mostly paid per call and not per row
+
+    Parameters
+    ----------
+
+        predict_function: callable
+            Function receiving a list of items and returning a list with the result of each
+            item in the same order
+
+        max_batch_size: int; default=64
+            Maximum number of items in a batch
+
+        max_wait_ms: float; default=5
+            Maximum time (milliseconds) the first item of a batch waits for other items
+
+    Examples
+    --------
+
+    >>> batcher = MicroBatcher(lambda texts: [len(text) for text in texts], max_wait_ms = 2)
+    >>> batcher.Predict("hello")
+    5
+
+    '''
+
+    def __init__(self, predict_function, max_batch_size:int = 64, max_wait_ms:float = 5):
+
+        self.predict_function = predict_function
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def __Start(self) -> None:
+
+        # The thread is started with the first request of each process. Threads don't
+        # survive a fork, so a worker of a pre-fork server starts its own thread
+
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target = self.__Run, daemon = True, name = "MicroBatcher")
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def __CollectBatch(self) -> list:
+
+        # This method blocks until one item arrives and then collects more items until the
+        # batch is full or the time of the first item is over
+
+        batch = [self._queue.get()]
+        deadline = monotonic() + self.max_wait_ms / 1000
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout = remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def __Run(self) -> None:
+
+        while True:
+
+            batch = self.__CollectBatch()
+            items = [item for item, _ in batch]
+
+            try:
+                results = list(self.predict_function(items))
+                if len(results) != len(items):
+                    raise ValueError(f"predict_function returned {len(results)} results for {len(items)} items")
+            except Exception as ErrorBatch:
+                for _, future in batch:
+                    future.set_exception(ErrorBatch)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+
+    def Submit(self, item) -> Future:
+
+        # This method adds an item to the next batch and returns the future of its result
+
+        if self._thread is None or self._pid != os.getpid():
+            self.__Start()
+
+        future = Future()
+        self._queue.put((item, future))
+
+        return future
+
+    def Predict(self, item, timeout:float = None):
+
+        # This method adds an item to the next batch and waits for its result
+
+        return self.Submit(item).result(timeout = timeout)
+
+    def Info(self) -> dict:
+
+        # This method returns the number of batches and items processed
+
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms
+        }
@@ -0,0 +1,198 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from time import time
+from collections import OrderedDict
+
+class PredictionCache:
+
+    '''
+    This class stores the predictions already computed, keyed by a hash of the cleaned
+    text and a fingerprint of the model, so repeated comments ("first!", "great video",
+    spam...) skip the lemmatization and the model
+
+    Two backends are available:
+    1. Memory (default): a LRU dictionary per process
+    2. SQLite (sqlite_path is supplied): a file shared by all the workers of the server.
+       The oldest entries (by insertion) and the expired ones are removed every
+       EVICT_EVERY insertions, so the size can be slightly above maxsize
+
+    Parameters
+    ----------
+
+        maxsize: int; default=10000
+            Maximum number of predictions stored. 0 disables the cache
+
+        ttl: float; default=None
+            Seconds a prediction is valid. None means it never expires
+
+        sqlite_path: str; default=None
+            Path of the SQLite file used as shared backend. None uses memory
+
+    '''
+
+    EVICT_EVERY = 100
+
+    def __init__(self, maxsize:int = 10000, ttl:float = None, sqlite_path:str = None):
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sqlite_path = sqlite_path
+
+        self.hits = 0
+        self.misses = 0
+        self._insertions = 0
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._local = threading.local()
+
+        if self.sqlite_path is not None:
+            self.__CreateTable()
+
+    @staticmethod
+    def Key(text:str, model:str = "") -> str:
+
+        # Same key in every process (the built-in hash changes between processes). model
+        # is a fingerprint of the artifacts, so the predictions of other models (e.g.
+        # before a retrain, kept in a SQLite file) are never returned
+
+        return hashlib.sha1(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def __Connection(self) -> sqlite3.Connection:
+
+        # One connection per thread and process, sqlite3 connections can't be shared
+        # between threads nor used after a fork (workers of a pre-fork server)
+
+        connection, pid = getattr(self._local, "connection", (None, None))
+
+        if connection is None or pid != os.getpid():
+            connection = sqlite3.connect(self.sqlite_path, timeout = 30, isolation_level = None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = (connection, os.getpid())
+
+        return connection
+
+    def __CreateTable(self) -> None:
+
+        connection = self.__Connection()
+        connection.execute("CREATE TABLE IF NOT EXISTS predictions ("
+                           "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS predictions_created ON predictions (created)")
+
+    def __Evict(self, connection:sqlite3.Connection) -> None:
+
+        # Removing the expired predictions and the oldest ones above maxsize
+
+        if self.ttl is not None:
+            connection.execute("DELETE FROM predictions WHERE created < ?", (time() - self.ttl,))
+
+        connection.execute("DELETE FROM predictions WHERE key IN ("
+                           "SELECT key FROM predictions ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                           (self.maxsize,))
+
+    def __Expired(self, created:float) -> bool:
+        return self.ttl is not None and (time() - created) > self.ttl
+
+    def Get(self, key:str):
+
+        '''
+        Return the value stored for key or None if it's not found or expired
+
+        Parameters
+        ----------
+
+        key: str
+            Key returned by PredictionCache.Key
+
+        '''
+
+        if self.maxsize <= 0:
+            return None
+
+        if self.sqlite_path is None:
+            with self._lock:
+                entry = self._memory.get(key)
+                if entry is not None and self.__Expired(entry[1]):
+                    del self._memory[key]
+                    entry = None
+                if entry is not None:
+                    self._memory.move_to_end(key)
+        else:
+            row = self.__Connection().execute("SELECT value, created FROM predictions WHERE key = ?",
+                                              (key,)).fetchone()
+            entry = None if row is None or self.__Expired(row[1]) else (json.loads(row[0]), row[1])
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return None if entry is None else entry[0]
+
+    def Set(self, key:str, value) -> None:
+
+        '''
+        Store value (it must be JSON serializable if the backend is SQLite) for key
+
+        Parameters
+        ----------
+
+        key: str
+            Key returned by PredictionCache.Key
+
+        value: object
+            Value to store
+
+        '''
+
+        if self.maxsize <= 0:
+            return
+
+        if self.sqlite_path is None:
+            with self._lock:
+                self._memory[key] = (value, time())
+                self._memory.move_to_end(key)
+                while len(self._memory) > self.maxsize:
+                    self._memory.popitem(last = False)
+            return
+
+        connection = self.__Connection()
+        connection.execute("INSERT OR REPLACE INTO predictions (key, value, created) VALUES (?, ?, ?)",
+                           (key, json.dumps(value), time()))
+
+        with self._lock:
+            self._insertions += 1
+            evict = (self._insertions % self.EVICT_EVERY) == 0
+
+        if evict:
+            self.__Evict(connection)
+
+    def Size(self) -> int:
+
+        # Number of predictions stored
+
+        if self.sqlite_path is None:
+            return len(self._memory)
+
+        return self.__Connection().execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def Info(self) -> dict:
+
+        # This method returns the hits, misses, hit ratio and size of the cache
+
+        requests = self.hits + self.misses
+
+        return {
+            "backend": "memory" if self.sqlite_path is None else "sqlite",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / requests if requests else 0.0,
+            "size": self.Size() if self.maxsize > 0 else 0,
+            "maxsize": self.maxsize,
+            "ttl": self.ttl
+        }
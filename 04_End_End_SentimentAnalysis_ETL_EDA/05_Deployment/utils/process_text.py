@@ -1,29 +1,250 @@
+import os
 import re
 import string
+import warnings
+from time import time, perf_counter
+from functools import lru_cache
+from itertools import islice
+from collections import deque
+from multiprocessing import Pool
 
 from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords, wordnet
+from nltk.corpus.reader.wordnet import ADJ, NOUN, VERB, ADV
 from nltk.stem import WordNetLemmatizer
-from nltk.tag import pos_tag
+from nltk.tag.perceptron import PerceptronTagger
 
 from wordcloud import STOPWORDS
 
 from bs4 import BeautifulSoup
 
 import nltk
-nltk.download("all")
 
-stop_words_word = set(STOPWORDS)
-stop_words_nltk = set(stopwords.words("english"))
-stop_words = stop_words_word.union(stop_words_nltk)
-stop_words_pattern = re.compile(fr"\b(?:{'|'.join(stop_words)})\b")
+# nltk >= 3.8.2 replaced the pickled punkt and tagger by punkt_tab and
+# averaged_perceptron_tagger_eng (word_tokenize and PerceptronTagger fail without them)
+NLTK_TAB_RESOURCES = tuple(int(part) for part in re.findall(r"\d+", nltk.__version__)[:3]) >= (3, 8, 2)
+
+# Only the NLTK resources used in this module are needed. Keys are the names used by
+# nltk.download and values the paths used by nltk.data.find
+NLTK_RESOURCES = {
+    "punkt_tab": "tokenizers/punkt_tab",
+    "averaged_perceptron_tagger_eng": "taggers/averaged_perceptron_tagger_eng",
+    "wordnet": "corpora/wordnet",
+    "stopwords": "corpora/stopwords"
+} if NLTK_TAB_RESOURCES else {
+    "punkt": "tokenizers/punkt",
+    "averaged_perceptron_tagger": "taggers/averaged_perceptron_tagger",
+    "wordnet": "corpora/wordnet",
+    "stopwords": "corpora/stopwords"
+}
+
+# Local folder with the NLTK resources. Set NLTK_DOWNLOAD_MISSING=1 to download the
+# missing ones into it (only the first time). NLTK_STARTUP_BUDGET is the time (secs)
+# expected to load the resources, a warning is shown if it's exceeded
+NLTK_DATA_DIR = os.environ.get("NLTK_DATA_DIR",
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "nltk_data"))
+NLTK_DOWNLOAD_MISSING = os.environ.get("NLTK_DOWNLOAD_MISSING", "0") == "1"
+NLTK_STARTUP_BUDGET = float(os.environ.get("NLTK_STARTUP_BUDGET", "1.0"))
+
+if NLTK_DATA_DIR not in nltk.data.path:
+    nltk.data.path.insert(0, NLTK_DATA_DIR)
+
+# Report of the time (secs) taken to load each resource. Empty until the first use
+nltk_startup_report = {}
+_pos_tagger = None
+
+def LoadNltkResources(download_missing:bool = NLTK_DOWNLOAD_MISSING,
+                      budget:float = NLTK_STARTUP_BUDGET, names:list = None) -> dict:
+
+    '''
+    This function checks that the NLTK resources used in this module are available and
+    loads them. It's called lazily the first time a text is processed (all of them) or
+    the stop words are requested (only stopwords), but it can be called before to warm
+    up a worker. Resources already loaded are skipped
+
+    Parameters
+    ----------
+
+    download_missing: bool; default=NLTK_DOWNLOAD_MISSING
+        Download into NLTK_DATA_DIR the resources not found. If False, a LookupError is raised
+
+    budget: float; default=NLTK_STARTUP_BUDGET
+        Time (secs) expected to load the resources. A warning is shown if it's exceeded
+
+    names: list; default=None
+        Keys of NLTK_RESOURCES to load. None loads all of them
+
+    Returns
+    -------
+
+    dict: Time (secs) taken by each resource loaded until now plus the key "total"
+
+    '''
+
+    global _pos_tagger
+
+    pending = [name for name in (NLTK_RESOURCES if names is None else names) if name not in nltk_startup_report]
+    if not pending:
+        return nltk_startup_report
+
+    report = {}
+    start = time()
+
+    for name in pending:
+
+        path = NLTK_RESOURCES[name]
+
+        start_resource = time()
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            if not download_missing:
+                raise LookupError(f"NLTK resource '{name}' not found in {nltk.data.path}. "
+                                  f"Run nltk.download('{name}', download_dir='{NLTK_DATA_DIR}') "
+                                  "or set NLTK_DOWNLOAD_MISSING=1")
+            nltk.download(name, download_dir=NLTK_DATA_DIR, quiet=True)
+
+        # Forcing the load of the resource now instead of on the first request
+        if name.startswith("averaged_perceptron_tagger"):
+            _pos_tagger = PerceptronTagger()
+        elif name == "wordnet":
+            wordnet.fileids()
+        elif name == "stopwords":
+            stopwords.fileids()
+
+        report[name] = time() - start_resource
+
+    seconds = time() - start
+    report["total"] = nltk_startup_report.get("total", 0.0) + seconds
+    nltk_startup_report.update(report)
+
+    if seconds > budget:
+        warnings.warn(f"Loading NLTK resources took {seconds:.3f} secs. "
+                      f"Budget: {budget} secs")
+
+    return nltk_startup_report
+
+def GetPosTagger() -> PerceptronTagger:
+
+    # This function returns the pos tagger used by LemmatizeWithPos loading it only
+    # the first time. nltk.pos_tag loads the model from disk in each call
+
+    if _pos_tagger is None:
+        LoadNltkResources()
+
+    return _pos_tagger
+
+_stop_words = None
+_stop_words_pattern = None
+
+def GetStopWords() -> set:
+
+    # This function returns the union of the stop words from wordcloud and nltk
+    # loading them only the first time
+
+    global _stop_words
+
+    if _stop_words is None:
+        LoadNltkResources(names = ["stopwords"])
+        stop_words_word = set(STOPWORDS)
+        stop_words_nltk = set(stopwords.words("english"))
+        _stop_words = stop_words_word.union(stop_words_nltk)
+
+    return _stop_words
+
+def TrieRegex(words) -> str:
+
+    '''
+    This function builds a regex matching any of the words, where the words are stored
+    as a trie (words with the same prefix share the same branch). The engine checks
+    each character once instead of trying every word of an alternation one by one
+
+    The regex always prefers the longest word (e.g "don't" before "don"), the same as
+    an alternation sorted from the longest to the shortest word
+
+    Parameters
+    ----------
+
+    words: iterable
+        Words to match
+
+    Returns
+    -------
+
+    str: The regex (not compiled)
+
+    '''
+
+    trie = {}
+    for word in words:
+        node = trie
+        for character in word:
+            node = node.setdefault(character, {})
+        node[""] = True
+
+    def Build(node:dict) -> str:
+
+        is_word = "" in node
+        branches = [re.escape(character) + Build(child)
+                    for character, child in sorted(node.items()) if character != ""]
+
+        if not branches:
+            return ""
+        if len(branches) == 1 and not is_word:
+            return branches[0]
+
+        group = "(?:" + "|".join(branches) + ")"
+        return group + "?" if is_word else group
+
+    return Build(trie)
+
+def GetStopWordsPattern() -> re.Pattern:
+
+    # This function returns the regex compiled to remove stop words
+
+    global _stop_words_pattern
+
+    if _stop_words_pattern is None:
+        _stop_words_pattern = re.compile(fr"\b(?:{TrieRegex(w for w in GetStopWords() if w)})\b")
+
+    return _stop_words_pattern
+
+def __getattr__(name:str):
+
+    # Keeping stop_words and stop_words_pattern available as module attributes without
+    # loading the nltk corpus on import
+
+    if name == "stop_words":
+        return GetStopWords()
+    if name == "stop_words_pattern":
+        return GetStopWordsPattern()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 def RemoveStopWords(sentence:str) -> str:
-    return stop_words_pattern.sub(" ", sentence)
+    return GetStopWordsPattern().sub(" ", sentence)
+
+def RemoveStopWordsTokens(tokens:list) -> list:
+
+    # This function removes the stop words of a sentence already tokenized (e.g the
+    # output of LemmatizeWithPos) checking each token in a set, no regex is needed
+
+    stop_words = GetStopWords()
+    return [token for token in tokens if token not in stop_words]
 
 class CleanText:
+
+    # Characters that need the html parser (tags, entities and the byte order mark, which
+    # lxml handles in its own way) and white spaces removed by lxml at the beginning of a document
+    HTML_MARKUP_CHARACTERS = ("<", "&", "\ufeff")
+    HTML_LEADING_CHARACTERS = " \t\n\r\x0c"
     
-    def __init__(self):
-        
+    def __init__(self, html_observer = None):
+
+        # Optional function receiving the seconds spent by BeautifulSoup in FastCleaner
+        # (used to monitor the cost of the html parser)
+        self.html_observer = html_observer
+
         self.r_link_compiled = self.__RemoveLinksPattern()
         self.r_punc_compiled = self.__RemovePunctuationsPattern()
         self.r_nonp_compiled = self.__RemoveNonPrintablePattern()
@@ -31,6 +252,11 @@ class CleanText:
         self.r_whit_compiled = self.__RemoveWhiteSpaces()
         self.r_hash_compiled = self.__RemoveHashTagsPattern()
         self.r_ment_compiled = self.__RemoveMentionsPattern()
+
+        # Fused steps used by FastCleaner
+        self.t_punc_nonp_table = self.__PunctuationsNonPrintableTable()
+        self.r_emoj_whit_compiled = self.__RemoveEmojisWhiteSpacesPattern()
+        self.r_hash_ment_compiled = self.__RemoveHashTagsMentionsPattern()
         
         
     def __RemoveHtml(self, text):
@@ -39,16 +265,19 @@ class CleanText:
     def __RemoveLinksPattern(self):
         return re.compile(r'https?://\S+')
 
-    def __RemovePunctuationsPattern(self):
+    def __Punctuations(self):
         punctuations = string.punctuation.replace("?","").replace("'","").replace("!","")
         punctuations = punctuations.replace(".","").replace("%","").replace("#","").replace("$","")
-        return re.compile(r'[' + re.escape(punctuations) + ']+')
+        return punctuations
+
+    def __RemovePunctuationsPattern(self):
+        return re.compile(r'[' + re.escape(self.__Punctuations()) + ']+')
     
     def __RemoveNonPrintablePattern(self):
         return re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F\r]')
 
-    def __RemoveEmojisPattern(self):
-        emoji_patterns = re.compile("["
+    def __EmojisCharacters(self):
+        return (
             u"\U0001F600-\U0001F64F"
             u"\U0001F300-\U0001F5FF"
             u"\U0001F680-\U0001F6FF"
@@ -67,7 +296,10 @@ class CleanText:
             u"\u231a"
             u"\ufe0f"
             u"\u3030"
-                        "]+", re.UNICODE)
+        )
+
+    def __RemoveEmojisPattern(self):
+        emoji_patterns = re.compile("[" + self.__EmojisCharacters() + "]+", re.UNICODE)
         
         return emoji_patterns
     
@@ -80,6 +312,24 @@ class CleanText:
     def __RemoveMentionsPattern(self):
         return re.compile(r'@\w+')
 
+    def __PunctuationsNonPrintableTable(self):
+
+        # Every punctuation and non-printable character is replaced by a white space
+        # in a single str.translate call
+
+        non_printable = [chr(c) for c in [*range(0x00, 0x09), 0x0B, 0x0C, *range(0x0E, 0x20), 0x7F, 0x0D]]
+        return str.maketrans({character: " " for character in [*self.__Punctuations(), *non_printable]})
+
+    def __RemoveEmojisWhiteSpacesPattern(self):
+
+        # Emojis and white spaces are both replaced by one white space, so a single pass
+        # over the text does both steps
+
+        return re.compile("[" + self.__EmojisCharacters() + r"\s]+", re.UNICODE)
+
+    def __RemoveHashTagsMentionsPattern(self):
+        return re.compile(r'[#@]\w+')
+
     def Cleaner(self, text:str, on:str = "youtube"):
         
         '''
@@ -109,29 +359,171 @@ class CleanText:
         
         return clean_text
 
+    def FastCleaner(self, text:str, on:str = "youtube"):
+        
+        '''
+        Same output as Cleaner but in fewer passes over the text. Punctuation and
+        non-printable characters are replaced with a translation table, emojis and
+        white spaces are collapsed in one regex and BeautifulSoup is only used if
+        the text could contain html (tags or entities)
+
+        Parameters
+        ----------
+        
+        text:str
+            Text to clean
+        
+        on:str; ["twitter","youtube"]
+            If on='twitter', add some extra steps to clean mentions @ and hashtags #
+        
+        '''
+
+        clean_text = str(text).lower()
+
+        if "http" in clean_text:
+            clean_text = self.r_link_compiled.sub(" ", clean_text)
+
+        if any(character in clean_text for character in self.HTML_MARKUP_CHARACTERS):
+            if self.html_observer is None:
+                clean_text = self.__RemoveHtml(clean_text)
+            else:
+                start = perf_counter()
+                clean_text = self.__RemoveHtml(clean_text)
+                self.html_observer(perf_counter() - start)
+        else:
+            clean_text = clean_text.lstrip(self.HTML_LEADING_CHARACTERS)
+
+        if on == "twitter":
+            clean_text = self.r_hash_ment_compiled.sub(" ", clean_text)
+
+        clean_text = clean_text.translate(self.t_punc_nonp_table)
+        clean_text = self.r_emoj_whit_compiled.sub(" ", clean_text)
+
+        return clean_text
+
+    def CleanMany(self, texts, on:str = "youtube", n_jobs:int = None, chunksize:int = 1000):
+
+        '''
+        Same output as Cleaner applied to each text, but every step runs over all the texts
+        at once with the vectorized methods of pandas.Series.str. BeautifulSoup (the only
+        step that can't be vectorized) is only applied to the texts with html, split in
+        chunks across a pool of processes
+
+        Parameters
+        ----------
+
+        texts: iterable, pd.Series
+            Texts to clean
+
+        on:str; ["twitter","youtube"]
+            If on='twitter', add some extra steps to clean mentions @ and hashtags #
+
+        n_jobs:int; default=None
+            Number of processes used to remove html. None uses all the cpus and
+            1 doesn't create any process
+
+        chunksize:int; default=1000
+            Number of texts sent to each process at once
+
+        Returns
+        -------
+
+        pd.Series|list: A pandas Series (with the same index) if texts is a Series,
+            otherwise a list
+
+        '''
+
+        import pandas as pd
+
+        # object dtype, the str methods of arrow strings (default with pandas >= 3) don't
+        # give the same output as the ones of python (e.g. lower of "İ")
+        is_series = isinstance(texts, pd.Series)
+        clean_text = pd.Series([str(text).lower() for text in texts], dtype=object,
+                               index=texts.index if is_series else None)
+        clean_text = clean_text.str.replace(self.r_link_compiled, " ", regex=True)
+
+        html_pattern = "[" + "".join(self.HTML_MARKUP_CHARACTERS) + "]"
+        has_html = clean_text.str.contains(html_pattern, regex=True)
+
+        clean_text[~has_html] = clean_text[~has_html].str.lstrip(self.HTML_LEADING_CHARACTERS)
+        if has_html.any():
+            clean_text[has_html] = RemoveHtmlMany(clean_text[has_html].tolist(), n_jobs, chunksize)
+
+        if on == "twitter":
+            clean_text = clean_text.str.replace(self.r_hash_ment_compiled, " ", regex=True)
+
+        clean_text = clean_text.str.translate(self.t_punc_nonp_table)
+        clean_text = clean_text.str.replace(self.r_emoj_whit_compiled, " ", regex=True)
+
+        return clean_text if is_series else clean_text.tolist()
+
+def RemoveHtml(texts:list) -> list:
+
+    # This function removes the html of each text. Defined at module level to be
+    # sent to other processes
+
+    return [BeautifulSoup(text, "lxml").text for text in texts]
+
+def RemoveHtmlMany(texts:list, n_jobs:int = None, chunksize:int = 1000) -> list:
+
+    # This function removes the html of the texts splitting them in chunks across
+    # a pool of processes. Few texts are processed in the current process
+
+    chunks = [texts[i:i + chunksize] for i in range(0, len(texts), chunksize)]
+
+    if n_jobs == 1 or len(chunks) == 1:
+        return [text for chunk in chunks for text in RemoveHtml(chunk)]
+
+    with Pool(n_jobs) as pool:
+        return [text for chunk in pool.imap(RemoveHtml, chunks) for text in chunk]
+
 def TruncateText(text, max_length):
     return str(text)[:max_length]
 
-def LemmatizeWithPos(text, as_list = True):
-    
-    lemmatizer = WordNetLemmatizer()
-    
-    pos_tag_dict = {
-        "J": wordnet.ADJ,
-        "N": wordnet.NOUN,
-        "V": wordnet.VERB,
-        "R": wordnet.ADV
+# The lemmatizer and the lemmas already computed are shared by all the calls. Comments
+# repeat the same words a lot, so most of the lemmas are taken from the cache
+LEMMA_CACHE_SIZE = int(os.environ.get("LEMMA_CACHE_SIZE", "100000"))
+
+lemmatizer = WordNetLemmatizer()
+
+pos_tag_dict = {
+    "J": ADJ,
+    "N": NOUN,
+    "V": VERB,
+    "R": ADV
+}
+
+@lru_cache(maxsize = LEMMA_CACHE_SIZE)
+def Lemmatize(token:str, pos:str) -> str:
+    return lemmatizer.lemmatize(word = token, pos = pos)
+
+def LemmaCacheInfo() -> dict:
+
+    # This function returns the hits, misses and size of the cache of lemmas
+
+    info = Lemmatize.cache_info()
+    requests = info.hits + info.misses
+
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+        "hit_ratio": info.hits / requests if requests else 0.0
     }
-    
-    tokens = word_tokenize(text)
-    pos = pos_tag(tokens)
+
+def LemmatizeTagged(pos:list, as_list = True):
+
+    # This function returns the lemmas of a sentence already tagged, i.e. a list
+    # of tuples (token, penn treebank tag)
+
     new_sentence = []
         
     for token, tag_pos in pos:
         
         first_letter_pos = tag_pos[0].upper() 
         word_net_value = pos_tag_dict.get(first_letter_pos, "n")
-        lemma = lemmatizer.lemmatize(word = token, pos = word_net_value)
+        lemma = Lemmatize(token, word_net_value)
 
         new_sentence.append(lemma)
         
@@ -140,6 +532,95 @@ def LemmatizeWithPos(text, as_list = True):
     else:
         return " ".join(new_sentence)
 
+def LemmatizeWithPos(text, as_list = True):
+    
+    pos_tagger = GetPosTagger()
+    
+    tokens = word_tokenize(text)
+    pos = pos_tagger.tag(tokens)
+
+    return LemmatizeTagged(pos, as_list)
+
+def LemmatizeChunk(texts:list, as_list = True) -> list:
+
+    # This function returns LemmatizeWithPos of each text. The texts are tokenized
+    # first and then tagged together as nltk.pos_tag_sents does (one tagger for all)
+
+    pos_tagger = GetPosTagger()
+
+    tokens_sents = [word_tokenize(text) for text in texts]
+    pos_sents = pos_tagger.tag_sents(tokens_sents)
+
+    return [LemmatizeTagged(pos, as_list) for pos in pos_sents]
+
+def Chunks(iterable, size:int):
+
+    # This generator splits an iterable in lists of size elements (the last one can be smaller)
+
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+def LemmatizeMany(texts, as_list = True, n_jobs:int = 1, chunksize:int = 1000):
+
+    '''
+    Generator with the same output as LemmatizeWithPos applied to each text. The texts
+    are read, tokenized, tagged and lemmatized in chunks, so the memory used doesn't
+    depend on the number of texts
+
+    Parameters
+    ----------
+
+    texts: iterable
+        Texts to lemmatize. It can be a generator
+
+    as_list: bool; default=True
+        Return each text as a list of lemmas or as a string of lemmas joined by spaces
+
+    n_jobs:int; default=1
+        Number of processes used. None uses all the cpus and 1 doesn't create any process
+
+    chunksize:int; default=1000
+        Number of texts sent to each process at once
+
+    Yields
+    ------
+
+    list|str: The lemmas of each text in the same order as texts
+
+    Examples
+    --------
+
+    >>> comments = pd.read_feather("data/labeled_data_clean.feather")["comment"]
+    >>> lemmas = list(LemmatizeMany(comments, as_list = False, n_jobs = None))
+
+    '''
+
+    chunks = Chunks(texts, chunksize)
+
+    if n_jobs == 1:
+        for chunk in chunks:
+            yield from LemmatizeChunk(chunk, as_list)
+        return
+
+    with Pool(n_jobs) as pool:
+
+        # Only a few chunks are sent to the pool at the same time. Pool.imap would
+        # read all the texts in advance
+        pending = deque()
+        max_pending = 2 * (n_jobs or os.cpu_count() or 1)
+
+        for chunk in chunks:
+            pending.append(pool.apply_async(LemmatizeChunk, (chunk, as_list)))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().get()
+
+        while pending:
+            yield from pending.popleft().get()
+
 
 if __name__ == "__main__":
     sentence = "Hi, how are you!"
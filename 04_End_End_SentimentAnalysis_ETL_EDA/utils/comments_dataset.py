@@ -0,0 +1,277 @@
+import argparse as arg
+import tracemalloc
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+
+def CreateArguments() -> arg.ArgumentParser.parse_args:
+
+    '''
+    This function creates the arguments of the command line
+
+    Returns
+    -------
+
+    argparse: argparse object created by ArgumentParser.parse_args
+
+    '''
+
+    args = arg.ArgumentParser(description="Convert the cleaned comments (lists of lemmas) into a partitioned parquet dataset")
+    args.add_argument("data", type=str,
+                    help="Cleaned comments (.feather), e.g data/labeled_data_clean.feather")
+    args.add_argument("output", type=str,
+                    help="Folder of the dataset, e.g data/comments_dataset")
+    args.add_argument("--partition-by", dest="partition_by", type=str, nargs="*", default=["class"],
+                    help="Columns used as partitions (folders column=value). Default is class")
+    args.add_argument("--max-rows-per-file", dest="max_rows_per_file", type=int, default=500000,
+                    help="Maximum number of comments of each file. Default is 500000")
+    args.add_argument("--benchmark", const=True, default=False, nargs="?",
+                    help="Compare the time and memory needed to get the texts of the model from the feather file (pandas) and from the dataset. No value is expected")
+
+    return args.parse_args()
+
+def TokensToArrow(tokens) -> pa.ListArray:
+
+    # This function converts lists of tokens (lists or numpy arrays of str) into an arrow
+    # list<string> array, with a single array of all the tokens and the offsets of each row
+
+    lengths = np.fromiter(map(len, tokens), dtype = np.int32, count = len(tokens))
+    offsets = np.concatenate([[0], np.cumsum(lengths, dtype = np.int64)]).astype(np.int32)
+    values = pa.array([token for row in tokens for token in row], type = pa.string())
+
+    return pa.ListArray.from_arrays(pa.array(offsets), values)
+
+def ToArrowTable(comments, token_column:str = "comment") -> pa.Table:
+
+    '''
+    This function returns the comments as an arrow table where token_column is a
+    list<string> column
+
+    Parameters
+    ----------
+
+    comments: str, pd.DataFrame, pa.Table
+        Path of a feather file (read directly by arrow, without python lists), a
+        DataFrame with lists of tokens in token_column or an arrow table
+
+    token_column: str; default="comment"
+        Column with the lists of tokens
+
+    Returns
+    -------
+
+    pa.Table: The comments with token_column as list<string>
+
+    '''
+
+    if isinstance(comments, str):
+        table = feather.read_table(comments)
+    elif isinstance(comments, pd.DataFrame):
+        table = pa.Table.from_pandas(comments.drop(columns = [token_column]), preserve_index = False)
+        table = table.append_column(token_column, TokensToArrow(comments[token_column].to_numpy()))
+    else:
+        table = comments
+
+    field_type = table.schema.field(token_column).type
+    if pa.types.is_large_list(field_type) or (pa.types.is_list(field_type) and field_type.value_type != pa.string()):
+        table = table.set_column(table.schema.get_field_index(token_column), token_column,
+                                 table[token_column].cast(pa.list_(pa.string())))
+
+    return table
+
+def WriteCommentsDataset(comments, path:str, partition_by:list = None, token_column:str = "comment",
+                         max_rows_per_file:int = 500000, max_rows_per_group:int = 50000) -> None:
+
+    '''
+    This function writes the cleaned comments as a parquet dataset partitioned by the
+    columns partition_by (folders column=value). The tokens are kept as a list<string>
+    column, so they are never converted to python lists to be stored or read
+
+    Parameters
+    ----------
+
+    comments: str, pd.DataFrame, pa.Table
+        Comments (see ToArrowTable)
+
+    path: str
+        Folder of the dataset. Existing files of the partitions written are replaced
+
+    partition_by: list; default=None
+        Columns used as partitions (e.g. ["class"] or ["id_video"])
+
+    token_column: str; default="comment"
+        Column with the lists of tokens
+
+    max_rows_per_file: int; default=500000
+        Maximum number of comments of each file
+
+    max_rows_per_group: int; default=50000
+        Comments of each row group (the unit read by IterBatches)
+
+    '''
+
+    table = ToArrowTable(comments, token_column)
+
+    partitioning = None
+    if partition_by:
+        partitioning = ds.partitioning(pa.schema([table.schema.field(column) for column in partition_by]), flavor = "hive")
+
+    ds.write_dataset(table, path, format = "parquet", partitioning = partitioning,
+                     max_rows_per_file = max_rows_per_file, max_rows_per_group = max_rows_per_group,
+                     min_rows_per_group = min(max_rows_per_group, max_rows_per_file),
+                     existing_data_behavior = "delete_matching")
+
+def OpenCommentsDataset(path:str) -> ds.Dataset:
+
+    # This function opens the dataset without reading it (the partitions are found in
+    # the names of the folders)
+    return ds.dataset(path, format = "parquet", partitioning = "hive")
+
+def IterBatches(path:str, columns:list = None, filter:ds.Expression = None, batch_size:int = 50000):
+
+    '''
+    This generator reads the dataset lazily by batches, only the columns and partitions
+    needed are read
+
+    Parameters
+    ----------
+
+    path: str
+        Folder of the dataset
+
+    columns: list; default=None
+        Columns read. None reads all of them
+
+    filter: ds.Expression; default=None
+        Filter of the rows, e.g ds.field("class") == 1. Partitions not matched are not read
+
+    batch_size: int; default=50000
+        Maximum number of comments of each batch
+
+    Returns
+    -------
+
+    generator: pa.RecordBatch objects
+
+    '''
+
+    dataset = OpenCommentsDataset(path)
+    yield from dataset.to_batches(columns = columns, filter = filter, batch_size = batch_size)
+
+def IterPartitions(path:str, columns:list = None):
+
+    # This generator yields the values of the partition (dict) and its table, one
+    # partition at a time
+
+    dataset = OpenCommentsDataset(path)
+    for fragment in dataset.get_fragments():
+        yield ds.get_partition_keys(fragment.partition_expression), fragment.to_table(columns = columns)
+
+def JoinTokens(tokens) -> pa.Array:
+
+    # This function joins the tokens of each comment by spaces inside arrow (same texts
+    # as " ".join of the training notebook, without python lists)
+    return pc.binary_join(tokens, " ")
+
+def IterTexts(path:str, label_column:str = "class", token_column:str = "comment",
+              filter:ds.Expression = None, batch_size:int = 50000):
+
+    '''
+    This generator yields the texts used by the vectorizer (tokens joined by spaces) and
+    their labels by batches, e.g. to fit HashingTfidfVectorizer or IncrementalTrainer
+    without loading the whole dataset
+
+    Parameters
+    ----------
+
+    path: str
+        Folder of the dataset
+
+    label_column: str; default="class"
+        Column of the labels. None yields only the texts
+
+    token_column: str; default="comment"
+        Column with the lists of tokens
+
+    filter: ds.Expression; default=None
+        Filter of the rows
+
+    batch_size: int; default=50000
+        Maximum number of comments of each batch
+
+    Returns
+    -------
+
+    generator: tuples (list of str, np.ndarray) or lists of str if label_column is None
+
+    '''
+
+    columns = [token_column] if label_column is None else [token_column, label_column]
+
+    for batch in IterBatches(path, columns, filter, batch_size):
+
+        texts = JoinTokens(batch.column(token_column)).to_pylist()
+        if label_column is None:
+            yield texts
+        else:
+            yield texts, batch.column(label_column).to_numpy(zero_copy_only = False)
+
+def ReadTexts(path:str, label_column:str = "class", token_column:str = "comment",
+              filter:ds.Expression = None) -> "(list, np.ndarray)":
+
+    # This function returns all the texts (tokens joined by spaces) and labels of the
+    # dataset, as Xy_data["comment"].apply(" ".join) and Xy_data["class"] in the notebook
+
+    table = OpenCommentsDataset(path).to_table(columns = [token_column, label_column], filter = filter)
+
+    return JoinTokens(table.column(token_column)).to_pylist(), table.column(label_column).to_numpy()
+
+def MeasureTexts(function) -> dict:
+
+    # This function returns the seconds and the peak of memory of python objects needed
+    # to get the texts
+
+    tracemalloc.start()
+    start = perf_counter()
+
+    texts, labels = function()
+
+    seconds = perf_counter() - start
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"seconds": seconds, "python_peak_mb": python_peak / 2**20, "rows": len(texts)}
+
+if __name__ == "__main__":
+
+    arguments = CreateArguments()
+
+    start = perf_counter()
+    WriteCommentsDataset(arguments.data, arguments.output, arguments.partition_by,
+                         max_rows_per_file = arguments.max_rows_per_file)
+
+    dataset = OpenCommentsDataset(arguments.output)
+    print(f"{dataset.count_rows()} comments written in {len(dataset.files)} files in {perf_counter() - start:.1f} secs")
+
+    if arguments.benchmark:
+
+        def ReadPandas():
+            Xy_data = pd.read_feather(arguments.data)
+            Xy_data["comment"] = Xy_data["comment"].transform(list)
+            return Xy_data["comment"].apply(" ".join).tolist(), Xy_data["class"].to_numpy()
+
+        for name, function in [("pandas (feather)", ReadPandas), ("arrow (dataset)", lambda: ReadTexts(arguments.output))]:
+            result = MeasureTexts(function)
+            print(f"{name}: {result['rows']} texts in {result['seconds']:.2f} secs, "
+                  f"peak of python objects {result['python_peak_mb']:.0f} MB")
+
+        # Same texts and labels (the dataset is ordered by partition)
+        texts, labels = ReadPandas()
+        dataset_texts, dataset_labels = ReadTexts(arguments.output)
+        same = sorted(zip(texts, labels.tolist())) == sorted(zip(dataset_texts, dataset_labels.tolist()))
+        print(f"Same texts and labels: {same}")
@@ -0,0 +1,344 @@
+import os
+import json
+import joblib
+import argparse as arg
+from time import time
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from sklearn.metrics import classification_report, confusion_matrix, \
+                            f1_score, accuracy_score, recall_score, \
+                            precision_score
+from sklearn.model_selection import train_test_split
+from sklearn.ensemble import RandomForestClassifier, BaggingClassifier
+from sklearn.svm import SVC
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_selection import chi2
+
+from utils.comments_dataset import ReadTexts
+
+# Same grid as 03_SentimentAnalysis.ipynb. Each model uses one core, the pool runs
+# several models at the same time
+MODELS = {
+
+    "random_forest": RandomForestClassifier(),
+
+    "svm_linear": BaggingClassifier(SVC(kernel = "linear", class_weight = "balanced"),
+                                    max_samples = 2.5 / 10, n_estimators = 10),
+
+    "multinomial": BaggingClassifier(MultinomialNB(), max_samples = 2.5 / 10, n_estimators = 10)
+
+}
+
+try:
+    import xgboost as xgb
+    MODELS["xgb"] = xgb.XGBClassifier(tree_method = "hist", objective = "multi:softprob",
+                                      n_estimators = 1000, n_jobs = 1)
+except ImportError:
+    pass
+
+SELECT_K_FEATURES = [2000, 1000, 500, 250]
+
+# Minimum k of each model, as in the notebook ("SVM doesn't work for 500 and 250")
+MIN_K_FEATURES = {"svm_linear": 501}
+
+def CreateArguments() -> arg.ArgumentParser.parse_args:
+
+    '''
+    This function creates the arguments of the command line
+
+    Returns
+    -------
+
+    argparse: argparse object created by ArgumentParser.parse_args
+
+    '''
+
+    args = arg.ArgumentParser(description="Grid of models and number of features selected by chi2, run in parallel")
+    args.add_argument("--data", dest="data", type=str, default="data/labeled_data_clean.feather",
+                    help="Labeled comments (lists of lemmas and class), .feather or folder of utils/comments_dataset.py. Default is 'data/labeled_data_clean.feather'")
+    args.add_argument("--output", dest="output", type=str, default="model_search",
+                    help="Folder where each model and report is saved as soon as it finishes. Default is 'model_search'")
+    args.add_argument("--k", dest="k", type=int, nargs="+", default=SELECT_K_FEATURES,
+                    help="Number of features selected by chi2. Default is 2000 1000 500 250")
+    args.add_argument("--models", dest="models", type=str, nargs="+", default=list(MODELS),
+                    help=f"Models of the grid. Default is {' '.join(MODELS)}")
+    args.add_argument("--n-jobs", dest="n_jobs", type=int, default=0,
+                    help="Number of processes. 0 uses all the cpus. Default is 0")
+    args.add_argument("--seed", dest="seed", type=int, default=None,
+                    help="Seed of the train/test split. Default is a random split as the notebook")
+
+    return args.parse_args()
+
+def ShareArray(array:np.ndarray) -> "(shared_memory.SharedMemory, tuple)":
+
+    # This function copies an array into shared memory and returns the block and what is
+    # needed to attach it (name, shape, dtype)
+
+    block = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype = array.dtype, buffer = block.buf)[...] = array
+
+    return block, (block.name, array.shape, array.dtype.str)
+
+def AttachArray(spec:tuple) -> "(shared_memory.SharedMemory, np.ndarray)":
+
+    # This function returns the array of a shared memory block without copying it. The
+    # workers of the pool share the resource tracker of the process that created the
+    # block, which unlinks it at the end
+
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name = name)
+
+    return block, np.ndarray(shape, dtype = np.dtype(dtype), buffer = block.buf)
+
+def ShareSparse(matrix:sp.csr_matrix) -> "(list, dict)":
+
+    # This function shares the three arrays of a csr matrix
+
+    blocks, spec = [], {"shape": matrix.shape}
+    for key in ("data", "indices", "indptr"):
+        block, spec[key] = ShareArray(getattr(matrix, key))
+        blocks.append(block)
+
+    return blocks, spec
+
+def AttachSparse(spec:dict) -> "(list, sp.csr_matrix)":
+
+    # This function returns the csr matrix of the shared arrays (no copy)
+
+    blocks, arrays = [], []
+    for key in ("data", "indices", "indptr"):
+        block, array = AttachArray(spec[key])
+        blocks.append(block)
+        arrays.append(array)
+
+    return blocks, sp.csr_matrix(tuple(arrays), shape = spec["shape"], copy = False)
+
+def Chi2Ranking(X, y) -> "(np.ndarray, np.ndarray)":
+
+    '''
+    This function computes chi2 once and ranks the columns as SelectKBest does, so the
+    columns of SelectKBest(chi2, k).fit(X, y) are TopKColumns(ranking, k) for any k
+
+    Parameters
+    ----------
+
+    X: sp.spmatrix
+        Features used to fit the selector
+
+    y: array-like
+        Labels
+
+    Returns
+    -------
+
+    (np.ndarray, np.ndarray): A tuple containing the chi2 scores and the columns sorted
+        from the lowest to the highest score respectively
+
+    '''
+
+    scores, _ = chi2(X, y)
+
+    # NaN as the lowest value and a stable sort, same as SelectKBest
+    clean_scores = np.array(scores, dtype = np.float64)
+    clean_scores[np.isnan(clean_scores)] = np.finfo(clean_scores.dtype).min
+
+    return scores, np.argsort(clean_scores, kind = "mergesort")
+
+def TopKColumns(ranking:np.ndarray, k:int) -> np.ndarray:
+
+    # This function returns the k best columns in increasing order (order of SelectKBest.transform)
+    return np.sort(ranking[-k:])
+
+def CreateFullReport(model_name:str, model_obj:object,
+                     y_true:list, y_predict:list,
+                     time_train:float, time_predict:float,
+                     n_features:int) -> "tuple(dict)":
+
+    # Same report as CreateFullReport of 03_SentimentAnalysis.ipynb, so the results can be
+    # analyzed with the same cells
+
+    report = classification_report(y_true, y_predict)
+    cm_matrix = pd.DataFrame(confusion_matrix(y_true, y_predict, labels=[0,1,2]))
+
+    scores = {
+        "f1_score": f1_score(y_true, y_predict, labels=[0,1,2], average="macro"),
+        "accuracy": accuracy_score(y_true, y_predict),
+        "recall": recall_score(y_true, y_predict, labels=[0,1,2], average="macro"),
+        "precision": precision_score(y_true, y_predict, labels=[0,1,2], average="macro"),
+        "cm": cm_matrix,
+        "report": report
+    }
+
+    return ({"chi2": n_features},
+            {model_name: model_obj},
+            {"scores": scores},
+            {"time": {"training": time_train, "prediction": time_predict}})
+
+# Data shared by the workers, attached once per process by InitWorker
+shared_data = {}
+
+def InitWorker(specs:dict) -> None:
+
+    blocks = []
+    for key in ("X_train", "X_test"):
+        key_blocks, shared_data[key] = AttachSparse(specs[key])
+        blocks.extend(key_blocks)
+    for key in ("y_train", "y_test", "ranking"):
+        block, shared_data[key] = AttachArray(specs[key])
+        blocks.append(block)
+
+    # The blocks must live as long as the arrays using them
+    shared_data["blocks"] = blocks
+
+def RunJob(job:tuple) -> dict:
+
+    '''
+    This function trains and evaluates one model with the k best features and saves its
+    report as soon as it finishes
+
+    Parameters
+    ----------
+
+    job: tuple
+        (k, model name, unfitted model, output folder)
+
+    Returns
+    -------
+
+    dict: The scores and times of the model and the path of its report
+
+    '''
+
+    k, model_name, model, output_path = job
+
+    columns = TopKColumns(shared_data["ranking"], k)
+    X_train_chi2 = shared_data["X_train"][:, columns]
+    X_test_chi2 = shared_data["X_test"][:, columns]
+
+    time_start_train_model = time()
+    model.fit(X_train_chi2, shared_data["y_train"])
+    time_train = time() - time_start_train_model
+
+    time_start_predic_model = time()
+    y_hat = model.predict(X_test_chi2)
+    time_predic = time() - time_start_predic_model
+
+    report = CreateFullReport(model_name, model, shared_data["y_test"], y_hat, time_train, time_predic, k)
+
+    path = os.path.join(output_path, f"{model_name}_{k}.joblib")
+    joblib.dump(report, path)
+
+    summary = {key: value for key, value in report[2]["scores"].items() if key not in ("cm", "report")}
+    return dict(chi2 = k, model = model_name, path = path, **summary, **report[3]["time"])
+
+def ModelSearch(X_vect, y_vect, X_train, y_train, X_test, y_test, output_path:str,
+                select_k_features:list = SELECT_K_FEATURES, models:dict = MODELS,
+                n_jobs:int = None) -> pd.DataFrame:
+
+    '''
+    This function runs every pair (k, model) in a pool of processes. chi2 is computed once
+    with X_vect and each job takes the k best columns of the ranking. The training and
+    test matrices are in shared memory (not copied to each process), and each model is
+    saved in output_path as soon as it finishes (nothing is kept in memory). A line is
+    added to output_path/results.jsonl for each job, jobs already done are skipped. As in
+    the notebook, svm_linear is only run with more than 500 features (MIN_K_FEATURES)
+
+    Parameters
+    ----------
+
+    X_vect, y_vect: sp.spmatrix, array-like
+        Features and labels used to fit chi2 (all the data in the notebook)
+
+    X_train, y_train, X_test, y_test: sp.spmatrix, array-like
+        Features and labels used to train and evaluate the models
+
+    output_path: str
+        Folder where the reports are saved
+
+    select_k_features: list; default=SELECT_K_FEATURES
+        Number of features selected by chi2
+
+    models: dict; default=MODELS
+        Unfitted models by name
+
+    n_jobs: int; default=None
+        Number of processes. None uses all the cpus
+
+    Returns
+    -------
+
+    pd.DataFrame: The scores and times of all the jobs done
+
+    '''
+
+    os.makedirs(output_path, exist_ok = True)
+    results_path = os.path.join(output_path, "results.jsonl")
+
+    done = set()
+    if os.path.exists(results_path):
+        with open(results_path, "r", encoding = "utf-8") as iFile:
+            done = {(result["chi2"], result["model"]) for result in map(json.loads, iFile)}
+
+    jobs = [(k, model_name, model, output_path) for k in select_k_features
+            for model_name, model in models.items()
+            if (k, model_name) not in done and k >= MIN_K_FEATURES.get(model_name, 0)]
+
+    if jobs:
+
+        _, ranking = Chi2Ranking(X_vect, y_vect)
+
+        blocks, specs = [], {}
+        for key, matrix in (("X_train", X_train), ("X_test", X_test)):
+            key_blocks, specs[key] = ShareSparse(sp.csr_matrix(matrix))
+            blocks.extend(key_blocks)
+        for key, array in (("y_train", y_train), ("y_test", y_test), ("ranking", ranking)):
+            block, specs[key] = ShareArray(np.asarray(array))
+            blocks.append(block)
+
+        try:
+            with Pool(n_jobs, initializer = InitWorker, initargs = (specs,)) as pool, \
+                 open(results_path, "a", encoding = "utf-8") as oFile:
+
+                for result in pool.imap_unordered(RunJob, jobs):
+                    oFile.write(json.dumps(result) + "\n")
+                    oFile.flush()
+                    print(f"Done: {result['model']} with {result['chi2']} features "
+                          f"(f1 {result['f1_score']:.4f}, {result['training']:.1f} secs)")
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    with open(results_path, "r", encoding = "utf-8") as iFile:
+        return pd.DataFrame([json.loads(line) for line in iFile])
+
+if __name__ == "__main__":
+
+    arguments = CreateArguments()
+
+    if os.path.isdir(arguments.data):
+        comments, classes = ReadTexts(arguments.data)
+        classes = pd.Series(classes)
+    else:
+        Xy_data = pd.read_feather(arguments.data)
+        comments, classes = Xy_data["comment"].apply(" ".join), Xy_data["class"]
+
+    X_train, X_test, y_train, y_test = train_test_split(comments, classes,
+                                                        train_size = 0.7, random_state = arguments.seed)
+
+    tfidf_model = TfidfVectorizer(min_df = 10)
+    X_vect = tfidf_model.fit_transform(comments)
+    X_train = tfidf_model.transform(X_train)
+    X_test = tfidf_model.transform(X_test)
+
+    models = {name: MODELS[name] for name in arguments.models}
+
+    results = ModelSearch(X_vect, classes.to_numpy(), X_train, y_train.to_numpy(), X_test, y_test.to_numpy(),
+                          arguments.output, arguments.k, models, arguments.n_jobs or None)
+
+    print(results.sort_values("f1_score", ascending = False).to_string(index = False))
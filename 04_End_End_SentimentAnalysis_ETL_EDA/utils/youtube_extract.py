@@ -0,0 +1,501 @@
+import json
+import queue
+import random
+import threading
+import warnings
+from time import time, monotonic, sleep
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# A page of comment threads of a video. page_token is the token used to request it (None
+# for the first page) and next_page_token the one of the next page (None for the last page)
+Page = namedtuple("Page", ["video_id", "page_token", "next_page_token", "comments"])
+
+# Sent by the threads when they finish a video (error is None if it ended without errors)
+VideoDone = namedtuple("VideoDone", ["video_id", "error"])
+
+# Errors of the YouTube API (HttpError) by status and reason
+RETRY_STATUS = {429, 500, 502, 503, 504}
+RETRY_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "backendError"}
+QUOTA_REASONS = {"quotaExceeded", "dailyLimitExceeded"}
+SKIP_REASONS = {"commentsDisabled", "videoNotFound", "forbidden"}
+
+class QuotaExceeded(Exception):
+
+    # The daily quota of the API key is used up, no more requests can be made
+    pass
+
+def LoadKeyYotube(path:str = "../.env") -> str:
+
+    # Load the API key of youtube v3 found in .env
+
+    with open(path, "r") as iJSON:
+        key = json.load(iJSON)["keys"]["key_youtube"]
+    return key
+
+def ErrorReason(error:Exception) -> "(int, str)":
+
+    # This function returns the http status and the reason of an error of the API
+    # (googleapiclient.errors.HttpError), None if they are not found
+
+    response = getattr(error, "resp", None)
+    status = getattr(response, "status", None)
+    status = int(status) if status is not None else None
+
+    reason = None
+    try:
+        content = error.content.decode("utf-8") if isinstance(error.content, bytes) else error.content
+        reason = json.loads(content)["error"]["errors"][0]["reason"]
+    except (AttributeError, KeyError, IndexError, TypeError, ValueError):
+        pass
+
+    return status, reason
+
+def ParseComment(item:dict) -> dict:
+
+    # This function formats a comment thread as GetVideoComments of the ETL notebook
+
+    snippet = item["snippet"]["topLevelComment"]["snippet"]
+
+    return {
+        "comment": snippet["textDisplay"],
+        "published_date": snippet["publishedAt"],
+        "name": snippet["authorDisplayName"],
+        "likes": snippet["likeCount"]
+    }
+
+class QuotaLimiter:
+
+    '''
+    This class keeps the units of quota used by all the threads and spaces the requests
+
+    Parameters
+    ----------
+
+        quota: int; default=10000
+            Units available (10000 per day is the default quota of the YouTube API, a
+            request to commentThreads.list costs 1). None means no limit
+
+        requests_per_second: float; default=None
+            Maximum number of requests per second of all the threads. None means no limit
+
+    '''
+
+    def __init__(self, quota:int = 10000, requests_per_second:float = None):
+
+        self.quota = quota
+        self.used = 0
+        self.interval = 1 / requests_per_second if requests_per_second else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def Acquire(self, cost:int = 1) -> None:
+
+        # This function reserves cost units before a request and waits its turn. It
+        # raises QuotaExceeded if there are not enough units left
+
+        with self.lock:
+
+            if self.quota is not None and self.used + cost > self.quota:
+                raise QuotaExceeded(f"Quota of {self.quota} units used up")
+
+            self.used += cost
+
+            now = monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+
+        if start > now:
+            sleep(start - now)
+
+    def Remaining(self) -> int:
+
+        # Units left, None if there is no limit
+        return None if self.quota is None else self.quota - self.used
+
+class CommentFetcher:
+
+    '''
+    This class retrieves the comment threads of several videos at the same time. Each
+    thread walks the pages of one video (the next page needs the token of the previous
+    one) while the pages already received are processed, so the extraction is limited by
+    the quota instead of the latency of each request
+
+    Parameters
+    ----------
+
+        api_key: str; default=None
+            API key of youtube v3. Not needed if client_factory is given
+
+        client_factory: callable; default=None
+            Function without arguments that returns a client with the interface of
+            googleapiclient.discovery.build("youtube", "v3"). Each thread creates its own
+            client (the http object of googleapiclient is not thread safe)
+
+        n_threads: int; default=8
+            Number of videos retrieved at the same time
+
+        limiter: QuotaLimiter; default=None
+            Quota and rate shared by the threads. Default is QuotaLimiter()
+
+        max_retries: int; default=5
+            Retries of a request after a transient error (rate limits, 5xx, connection)
+
+        base_delay: float; default=1.0
+            Seconds waited before the first retry, doubled after each one (with jitter)
+
+        max_delay: float; default=60.0
+            Maximum seconds waited before a retry
+
+        max_results: int; default=100
+            Comment threads by page (100 is the maximum accepted by the API)
+
+        prefetch_pages: int; default=64
+            Pages received and not processed yet. The threads wait when it's reached
+
+    Examples
+    --------
+
+    >>> fetcher = CommentFetcher(api_key = LoadKeyYotube(), n_threads = 16)
+    >>> for page in fetcher.FetchPages(["dGiQaabX3_o", "YbgnlkJPga4"]):
+    ...     print(page.video_id, len(page.comments))
+
+    '''
+
+    def __init__(self, api_key:str = None, client_factory = None, n_threads:int = 8,
+                 limiter:QuotaLimiter = None, max_retries:int = 5, base_delay:float = 1.0,
+                 max_delay:float = 60.0, max_results:int = 100, prefetch_pages:int = 64):
+
+        if client_factory is None:
+
+            if api_key is None:
+                raise ValueError("api_key or client_factory is required")
+
+            from googleapiclient.discovery import build
+            client_factory = lambda: build("youtube", "v3", developerKey = api_key)
+
+        self.client_factory = client_factory
+        self.n_threads = n_threads
+        self.limiter = limiter if limiter is not None else QuotaLimiter()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_results = max_results
+        self.prefetch_pages = prefetch_pages
+
+        self.local = threading.local()
+        self.errors = {}
+
+    def Client(self):
+
+        # Client of the current thread
+
+        if not hasattr(self.local, "client"):
+            self.local.client = self.client_factory()
+        return self.local.client
+
+    def Execute(self, build_request, description:str, stop:threading.Event = None) -> dict:
+
+        '''
+        This function executes a request of the API with exponential backoff for the
+        transient errors
+
+        Parameters
+        ----------
+
+        build_request: callable
+            Function that receives the client and returns the request (e.g.
+            lambda client: client.videos().list(...))
+
+        description: str
+            What is requested, used in the errors
+
+        stop: threading.Event; default=None
+            Event that interrupts the waits between retries
+
+        Returns
+        -------
+
+        dict: The response of the API
+
+        '''
+
+        for attempt in range(self.max_retries + 1):
+
+            self.limiter.Acquire()
+
+            try:
+                return build_request(self.Client()).execute()
+
+            except Exception as error:
+
+                status, reason = ErrorReason(error)
+
+                if reason in QUOTA_REASONS:
+                    raise QuotaExceeded(f"Quota exceeded retrieving {description}") from error
+
+                transient = status in RETRY_STATUS or reason in RETRY_REASONS or \
+                            (status is None and isinstance(error, (OSError, TimeoutError)))
+
+                if not transient or attempt == self.max_retries:
+                    raise
+
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if stop is not None and stop.wait(delay):
+                    raise
+                elif stop is None:
+                    sleep(delay)
+
+    def Request(self, video_id:str, page_token:str = None, stop:threading.Event = None) -> dict:
+
+        # This function requests a page of comment threads, the newest first
+
+        return self.Execute(lambda client: client.commentThreads().list(
+            part = "snippet",
+            videoId = video_id,
+            pageToken = page_token,
+            maxResults = self.max_results,
+            order = "time"
+        ), video_id, stop)
+
+    def CommentCounts(self, videos_id:list) -> dict:
+
+        '''
+        This function returns the number of comments of each video (statistics of
+        videos.list, 50 videos by request). Videos not found are left out
+
+        Parameters
+        ----------
+
+        videos_id: list
+            List containing the ids of the youtube videos
+
+        Returns
+        -------
+
+        dict: Number of comments by video id
+
+        '''
+
+        counts = {}
+        for start in range(0, len(videos_id), 50):
+
+            ids = ",".join(videos_id[start:start + 50])
+            response = self.Execute(lambda client: client.videos().list(
+                part = "statistics",
+                id = ids,
+                maxResults = 50
+            ), "statistics")
+
+            for item in response.get("items", []):
+                counts[item["id"]] = int(item["statistics"].get("commentCount", 0))
+
+        return counts
+
+    def VideoPages(self, video_id:str, page_token:str = None, stop:threading.Event = None,
+                   watermark:str = None):
+
+        '''
+        This generator yields the pages of comment threads of a video one after another,
+        the newest first
+
+        Parameters
+        ----------
+
+        video_id: str
+            id of youtube video
+
+        page_token: str; default=None
+            Token of the first page requested, None starts from the beginning
+
+        stop: threading.Event; default=None
+            Event that ends the generator before the next request
+
+        watermark: str; default=None
+            publishedAt of the newest comment already retrieved. Comments published then or
+            before are left out and the page where they appear is the last one (its
+            next_page_token is None). publishedAt has a resolution of seconds and the
+            comments have no id here, so a comment published in the same second as the
+            watermark but after it was retrieved is never retrieved
+
+        Returns
+        -------
+
+        generator: Page objects
+
+        '''
+
+        while stop is None or not stop.is_set():
+
+            try:
+                response = self.Request(video_id, page_token, stop)
+
+            except QuotaExceeded:
+                raise
+
+            except Exception as error:
+
+                # Videos without comments (or removed) are skipped
+                _, reason = ErrorReason(error)
+                if reason in SKIP_REASONS:
+                    warnings.warn(f"Skipping video {video_id}: {reason}")
+                    return
+                raise
+
+            next_page_token = response.get("nextPageToken")
+            comments = [ParseComment(item) for item in response.get("items", [])]
+
+            # publishedAt is ISO 8601 in UTC, the strings are compared as dates. Strict, the
+            # comments of the watermark second are already loaded (see watermark above)
+            if watermark is not None:
+                new_comments = [comment for comment in comments if comment["published_date"] > watermark]
+                if len(new_comments) < len(comments):
+                    comments, next_page_token = new_comments, None
+
+            yield Page(video_id, page_token, next_page_token, comments)
+
+            if not next_page_token:
+                return
+
+            page_token = next_page_token
+
+    def FetchPages(self, videos_id:list, page_tokens:dict = None, watermarks:dict = None):
+
+        '''
+        This generator retrieves the videos in a pool of threads and yields their pages
+        as soon as they are received (pages of different videos are mixed, pages of one
+        video keep their order). A video that fails after the retries is reported with a
+        warning and kept in self.errors, the rest continue. QuotaExceeded stops all of them
+
+        Parameters
+        ----------
+
+        videos_id: list
+            List containing the ids of the youtube videos
+
+        page_tokens: dict; default=None
+            Token of the first page requested by video id (e.g. to continue an interrupted
+            extraction). Videos missing start from the beginning
+
+        watermarks: dict; default=None
+            publishedAt of the newest comment already retrieved by video id, only newer
+            comments are retrieved (see VideoPages)
+
+        Returns
+        -------
+
+        generator: Page objects
+
+        '''
+
+        page_tokens = page_tokens or {}
+        watermarks = watermarks or {}
+        pages = queue.Queue(maxsize = self.prefetch_pages)
+        stop = threading.Event()
+
+        def Put(item) -> None:
+
+            # Waits for space in the queue unless the consumer stopped
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout = 0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def Worker(video_id:str) -> None:
+
+            try:
+                for page in self.VideoPages(video_id, page_tokens.get(video_id), stop, watermarks.get(video_id)):
+                    Put(page)
+                Put(VideoDone(video_id, None))
+            except BaseException as error:
+                Put(VideoDone(video_id, error))
+
+        executor = ThreadPoolExecutor(self.n_threads)
+
+        try:
+
+            for video_id in videos_id:
+                executor.submit(Worker, video_id)
+
+            # With the quota used up the other threads fail on their next request, their
+            # pages already received are still yielded before raising
+            quota_error = None
+            remaining = len(videos_id)
+            while remaining:
+
+                item = pages.get()
+                if isinstance(item, Page):
+                    yield item
+                    continue
+
+                remaining -= 1
+                if isinstance(item.error, QuotaExceeded):
+                    quota_error = quota_error or item.error
+                elif item.error is not None:
+                    self.errors[item.video_id] = item.error
+                    warnings.warn(f"Video {item.video_id} failed: {item.error!r}")
+
+            if quota_error is not None:
+                raise quota_error
+
+        finally:
+
+            # Also reached if the consumer stops iterating, the threads end after their
+            # current request
+            stop.set()
+            executor.shutdown(wait = True, cancel_futures = True)
+
+def Extract(video_names:list, videos_id:list, api_key:str = None, n_threads:int = 8,
+            fetcher:CommentFetcher = None) -> "list(dict)":
+
+    '''
+    Same as Extract of 01_ETLYoutubeComments.ipynb with the videos retrieved at the same
+    time by CommentFetcher
+
+    Parameters
+    ----------
+    video_names: list
+        List containing the titles of the youtube videos. Useful to inform current state of extraction
+
+    videos_id: list
+        List containing the ids of the youtube videos. It's used to extract comments
+
+    api_key: str; default=None
+        API key to request info from youtube. Not needed if fetcher is given
+
+    n_threads: int; default=8
+        Number of videos retrieved at the same time
+
+    fetcher: CommentFetcher; default=None
+        Fetcher used instead of creating one with api_key
+
+    Returns
+    -------
+
+    list(dict): A list (one element by video, same order as videos_id) of lists of
+        dictionaries with the comments and metadata about them
+
+    '''
+
+    start = time()
+    print("Exctracting comments")
+
+    fetcher = fetcher if fetcher is not None else CommentFetcher(api_key, n_threads = n_threads)
+
+    comments_by_video = {ID: [] for ID in videos_id}
+    for pages_checked, page in enumerate(fetcher.FetchPages(videos_id), start = 1):
+
+        comments_by_video[page.video_id].extend(page.comments)
+
+        # Show on screen current pagination
+        if (pages_checked % 10) == 0:
+            print(f"\tPages checked: {pages_checked}", end = "\r")
+
+    print()
+    for name, ID in zip(video_names, videos_id):
+        print(f"Comments retrieved from video {name}: {len(comments_by_video[ID])}")
+
+    print(f"Extraction took {time() - start} secs ({fetcher.limiter.used} units of quota)")
+    return [comments_by_video[ID] for ID in videos_id]
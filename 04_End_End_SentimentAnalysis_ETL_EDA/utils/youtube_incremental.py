@@ -0,0 +1,343 @@
+import re
+import html
+import sqlite3
+import argparse as arg
+from time import perf_counter
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from bs4 import BeautifulSoup
+
+from utils.youtube_extract import CommentFetcher, QuotaLimiter, QuotaExceeded
+from utils.youtube_load import IsSqlite, CreateSchemaSqlite, UpsertTitles, LoadComments, RefreshAggregates
+from utils.youtube_language import LanguageDetector
+
+# One row by video. last_published_at is the watermark (publishedAt of the newest comment
+# loaded) and comment_count the number of comments of the video when it was reached.
+# page_token and run_published_at keep the progress of a run not finished yet. Dates are
+# kept as the ISO 8601 strings of the API
+STATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS etl_watermarks (
+        id_video VARCHAR(12) NOT NULL PRIMARY KEY,
+        last_published_at VARCHAR(20),
+        comment_count INTEGER,
+        run_published_at VARCHAR(20),
+        page_token VARCHAR,
+        updated_at VARCHAR(20)
+    )
+"""
+
+STATE_COLUMNS = ["id_video", "last_published_at", "comment_count", "run_published_at", "page_token", "updated_at"]
+
+# Emojis and non-printable characters removed by Clean of 01_ETLYoutubeComments.ipynb
+EMOJI_PATTERN = re.compile("["
+    u"\U0001F600-\U0001F64F"
+    u"\U0001F300-\U0001F5FF"
+    u"\U0001F680-\U0001F6FF"
+    u"\U0001F1E0-\U0001F1FF"
+    u"\U00002500-\U00002BEF"
+    u"\U00002702-\U000027B0"
+    u"\U000024C2-\U0001F251"
+    u"\U0001f926-\U0001f937"
+    u"\U00010000-\U0010ffff"
+    u"\u2640-\u2642"
+    u"\u2600-\u2B55"
+    u"\u200d"
+    u"\u23cf"
+    u"\u23e9"
+    u"\u231a"
+    u"\ufe0f"
+    u"\u3030"
+    "]+", re.UNICODE)
+
+NON_PRINTABLE_PATTERN = re.compile(r"[\x00-\x08\x0B\x0C\x0E-\x1F\x7F\r]")
+
+def CreateArguments() -> arg.ArgumentParser.parse_args:
+
+    '''
+    This function creates the arguments of the command line
+
+    Returns
+    -------
+
+    argparse: argparse object created by ArgumentParser.parse_args
+
+    '''
+
+    args = arg.ArgumentParser(description="Run the incremental extraction several times against a local stub of the YouTube API")
+    args.add_argument("--videos", dest="videos", type=int, default=200,
+                    help="Number of videos. Default is 200")
+    args.add_argument("--comments", dest="comments", type=int, default=500,
+                    help="Comments by video. Default is 500")
+    args.add_argument("--active-videos", dest="active_videos", type=int, default=10,
+                    help="Videos with new comments between runs. Default is 10")
+    args.add_argument("--new-comments", dest="new_comments", type=int, default=50,
+                    help="New comments of each active video. Default is 50")
+    args.add_argument("--threads", dest="threads", type=int, default=8,
+                    help="Number of threads of the fetcher. Default is 8")
+
+    return args.parse_args()
+
+def CreateStateTable(connection) -> None:
+
+    # This function creates the table of watermarks if it doesn't exist
+
+    cursor = connection.cursor()
+    cursor.execute(STATE_TABLE)
+    cursor.close()
+    connection.commit()
+
+def ReadWatermarks(connection) -> dict:
+
+    # This function returns the row of etl_watermarks (dict) by video id
+
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT {', '.join(STATE_COLUMNS)} FROM etl_watermarks")
+    watermarks = {row[0]: dict(zip(STATE_COLUMNS, row)) for row in cursor.fetchall()}
+    cursor.close()
+
+    return watermarks
+
+def SaveWatermarks(connection, states:list) -> None:
+
+    # This function inserts or updates the rows (dicts) of etl_watermarks
+
+    if not states:
+        return
+
+    placeholder = "?" if IsSqlite(connection) else "%s"
+    updates = ", ".join(f"{column} = excluded.{column}" for column in STATE_COLUMNS[1:])
+
+    cursor = connection.cursor()
+    cursor.executemany(f"""
+        INSERT INTO etl_watermarks ({', '.join(STATE_COLUMNS)})
+        VALUES ({', '.join([placeholder] * len(STATE_COLUMNS))})
+        ON CONFLICT (id_video) DO UPDATE SET {updates}
+    """, [tuple(state[column] for column in STATE_COLUMNS) for state in states])
+    cursor.close()
+    connection.commit()
+
+def ChangedVideos(videos_id:list, watermarks:dict, counts:dict) -> list:
+
+    # This function returns the videos to retrieve: new ones, the ones with a run not
+    # finished and the ones whose number of comments changed
+
+    changed = []
+    for video_id in videos_id:
+
+        state = watermarks.get(video_id)
+        if state is None or state["page_token"] is not None or counts.get(video_id) != state["comment_count"]:
+            changed.append(video_id)
+
+    return changed
+
+def IncrementalExtract(fetcher:CommentFetcher, connection, videos_id:list, process_batch,
+                       batch_comments:int = 5000) -> dict:
+
+    '''
+    This function retrieves only the comments published after the last run. The number of
+    comments of all the videos is requested first (1 unit of quota by 50 videos) and the
+    videos without changes are skipped. The rest are retrieved from the newest comment
+    until the watermark of the video. Every batch_comments comments, process_batch
+    transforms and loads them and the progress of each video is saved in etl_watermarks,
+    so an interrupted run (e.g. QuotaExceeded) continues from the last page saved (the
+    comments published meanwhile are retrieved by the run after it). A batch processed
+    but not saved can be loaded twice, and a comment published in the same second as the
+    watermark after the run that set it is never retrieved (publishedAt has a resolution
+    of seconds, see CommentFetcher.VideoPages). comments_by_video_language is refreshed
+    once at the end of the run (RefreshAggregates)
+
+    Parameters
+    ----------
+
+    fetcher: CommentFetcher
+        Fetcher used to retrieve the comments
+
+    connection: DB-API connection
+        Database with the table etl_watermarks (psycopg2 or sqlite3)
+
+    videos_id: list
+        List containing the ids of the youtube videos
+
+    process_batch: callable
+        Function that receives a dict with the list of new comments by video id (same
+        format as Extract) and loads them
+
+    batch_comments: int; default=5000
+        Comments processed at once
+
+    Returns
+    -------
+
+    dict: The videos skipped and retrieved, the new comments and the units of quota used
+
+    '''
+
+    start = perf_counter()
+    units_start = fetcher.limiter.used
+
+    CreateStateTable(connection)
+    watermarks = ReadWatermarks(connection)
+
+    counts = fetcher.CommentCounts(videos_id)
+    changed = ChangedVideos(videos_id, watermarks, counts)
+    print(f"Videos without changes: {len(videos_id) - len(changed)}, videos to retrieve: {len(changed)}")
+
+    # Progress of each video in this run, starting from the one of an interrupted run.
+    # A resumed video only walks the pages older than the saved token, the comments
+    # published since the interrupted run started are retrieved by the next run
+    progress = {}
+    resumed = {video_id for video_id in changed if watermarks.get(video_id, {}).get("page_token") is not None}
+    for video_id in changed:
+        state = watermarks.get(video_id, {})
+        progress[video_id] = {
+            "id_video": video_id,
+            "last_published_at": state.get("last_published_at"),
+            "comment_count": state.get("comment_count"),
+            "run_published_at": state.get("run_published_at"),
+            "page_token": state.get("page_token"),
+            "updated_at": None
+        }
+
+    batch, touched = {}, set()
+    n_comments = 0
+
+    def Flush() -> None:
+
+        nonlocal batch, touched
+
+        if any(batch.values()):
+            process_batch(batch)
+
+        updated_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        for video_id in touched:
+            progress[video_id]["updated_at"] = updated_at
+
+        SaveWatermarks(connection, [progress[video_id] for video_id in touched])
+        batch, touched = {}, set()
+
+    pages = fetcher.FetchPages(changed,
+                               page_tokens = {video_id: state["page_token"] for video_id, state in progress.items()},
+                               watermarks = {video_id: state["last_published_at"] for video_id, state in progress.items()})
+
+    try:
+
+        for page in pages:
+
+            state = progress[page.video_id]
+            batch.setdefault(page.video_id, []).extend(page.comments)
+            touched.add(page.video_id)
+            n_comments += len(page.comments)
+
+            newest = max((comment["published_date"] for comment in page.comments), default = None)
+            if newest is not None and (state["run_published_at"] is None or newest > state["run_published_at"]):
+                state["run_published_at"] = newest
+
+            state["page_token"] = page.next_page_token
+
+            # Last page of the video, the watermark moves to the newest comment of the run
+            if page.next_page_token is None:
+                if state["run_published_at"] is not None and \
+                   (state["last_published_at"] is None or state["run_published_at"] > state["last_published_at"]):
+                    state["last_published_at"] = state["run_published_at"]
+                state["run_published_at"] = None
+
+                # Unknown count for a resumed video, so the next run starts again from the
+                # newest page down to the new watermark
+                state["comment_count"] = None if page.video_id in resumed else counts.get(page.video_id)
+
+            if sum(map(len, batch.values())) >= batch_comments:
+                Flush()
+
+    except QuotaExceeded:
+
+        # The pages received until then are loaded and saved, the next run continues
+        Flush()
+        RefreshAggregates(connection)
+        raise
+
+    finally:
+        pages.close()
+
+    Flush()
+
+    # Once by run, the batches are loaded without refreshing it
+    RefreshAggregates(connection)
+
+    seconds = perf_counter() - start
+    print(f"New comments: {n_comments} in {seconds:.1f} secs ({fetcher.limiter.used - units_start} units of quota)")
+
+    return {
+        "skipped": len(videos_id) - len(changed),
+        "retrieved": len(changed),
+        "comments": n_comments,
+        "units": fetcher.limiter.used - units_start,
+        "seconds": seconds
+    }
+
+def Clean(comments_df:pd.DataFrame) -> pd.DataFrame:
+
+    # Same as Clean of 01_ETLYoutubeComments.ipynb (html codes, emojis, html tags and
+    # non-printable characters), without the messages since it runs for each batch
+
+    comments_df[["comment", "name"]] = comments_df[["comment", "name"]].map(html.unescape)
+    comments_df["comment"] = [NON_PRINTABLE_PATTERN.sub(" ", BeautifulSoup(EMOJI_PATTERN.sub("", text), "lxml").text)
+                              for text in comments_df["comment"]]
+
+    return comments_df
+
+def LoadBatch(connection, comments_by_video:dict, language_detector:LanguageDetector = None) -> None:
+
+    # This function transforms new comments as Transform, Clean and Complement of
+    # 01_ETLYoutubeComments.ipynb and loads them with LoadComments. The same
+    # language_detector should be given to every batch to keep its cache, a new
+    # LanguageDetector is used otherwise
+
+    comments_df = pd.DataFrame([dict(comment, id_video = video_id) for video_id, comments in comments_by_video.items()
+                                for comment in comments])
+
+    comments_df["published_date"] = pd.to_datetime(comments_df["published_date"], format = "%Y-%m-%dT%H:%M:%SZ")
+    comments_df = Clean(comments_df)
+
+    language_detector = language_detector if language_detector is not None else LanguageDetector()
+    comments_df["code"] = language_detector.Detect(comments_df["comment"])
+
+    LoadComments(connection, comments_df, refresh_aggregates = False)
+
+if __name__ == "__main__":
+
+    from utils.youtube_stub import StubYoutube, MakeComments
+
+    arguments = CreateArguments()
+
+    comments_by_video = MakeComments(arguments.videos, arguments.comments)
+    videos_id = list(comments_by_video)
+    stub = StubYoutube(comments_by_video)
+
+    connection = sqlite3.connect(":memory:")
+    CreateSchemaSqlite(connection)
+    UpsertTitles(connection, connection.cursor(), pd.DataFrame({"id_video": videos_id, "title": videos_id}))
+    connection.commit()
+
+    language_detector = LanguageDetector()
+
+    def Run(description:str) -> None:
+
+        print(f"\n{description}")
+        fetcher = CommentFetcher(client_factory = lambda: stub, n_threads = arguments.threads, limiter = QuotaLimiter(None))
+        result = IncrementalExtract(fetcher, connection, videos_id, lambda batch: LoadBatch(connection, batch, language_detector))
+
+        total = connection.execute("SELECT COUNT(*) FROM comments").fetchone()[0]
+        print(f"Comments in the database: {total} of {sum(map(len, stub.comments_by_video.values()))}")
+
+    Run("First run (all the comments)")
+    Run("Second run (no new comments)")
+
+    # New comments published after the newest one of MakeComments (2023-06-01)
+    for seed, video_id in enumerate(videos_id[:arguments.active_videos], start = 1):
+        new_comments = MakeComments(1, arguments.new_comments, seed = seed)["video0000000"]
+        for i, comment in enumerate(new_comments):
+            comment["published_date"] = (datetime(2023, 6, 2) - timedelta(minutes = i)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        stub.AddComments(video_id, new_comments)
+
+    Run(f"Third run ({arguments.new_comments} new comments in {arguments.active_videos} videos)")
@@ -0,0 +1,351 @@
+import re
+import argparse as arg
+from time import perf_counter
+from collections import Counter
+from multiprocessing import Pool
+
+import pandas as pd
+
+# Most common english function words (the ones that are also frequent words of other
+# languages written with latin characters, e.g "a", "no", "me", "do", "was", are left
+# out). A comment written with ascii characters where they are a large part of the words
+# is english without running the full detector
+ENGLISH_STOPWORDS = frozenset("""
+    about after all any are because been but by can could did does don't for from had
+    has have him his how i'm if into is it it's its just like more my not now of one
+    only our out some than that the their them then there they this too up very we were
+    what when where which who why with would you your
+""".split())
+
+# Scripts used by a single language of langdetect. Texts written mostly with them don't
+# need the detector (han characters alone are left to it, they can be chinese or japanese)
+SCRIPT_LANGUAGES = [
+    (re.compile(r"[\uac00-\ud7af\u1100-\u11ff]"), "ko"),
+    (re.compile(r"[\u3040-\u30ff]"), "ja"),
+    (re.compile(r"[\u0e00-\u0e7f]"), "th"),
+    (re.compile(r"[\u0370-\u03ff]"), "el"),
+    (re.compile(r"[\u0590-\u05ff]"), "he")
+]
+
+WORDS_PATTERN = re.compile(r"\s+")
+ASCII_WORDS_PATTERN = re.compile(r"[a-z']+")
+LETTERS_PATTERN = re.compile(r"[^\W\d_]")
+NORMALIZE_PATTERN = re.compile(r"[\W\d_]+")
+
+def CreateArguments() -> arg.ArgumentParser.parse_args:
+
+    '''
+    This function creates the arguments of the command line
+
+    Returns
+    -------
+
+    argparse: argparse object created by ArgumentParser.parse_args
+
+    '''
+
+    args = arg.ArgumentParser(description="Throughput and agreement of LanguageDetector against langdetect.detect by comment")
+    args.add_argument("data", type=str,
+                    help="Comments (.csv or .feather)")
+    args.add_argument("--column", dest="column", type=str, default="comment",
+                    help="Column of the comments. Default is 'comment'")
+    args.add_argument("--sample", dest="sample", type=int, default=None,
+                    help="Number of comments used. Default uses all of them")
+    args.add_argument("--n-jobs", dest="n_jobs", type=int, default=0,
+                    help="Processes used by the detector. 0 uses all the cpus. Default is 0")
+
+    return args.parse_args()
+
+def InitDetector(seed:int = 0) -> None:
+
+    # Same seed in all the processes, so langdetect always returns the same language
+    # for the same text
+
+    from langdetect import DetectorFactory
+    DetectorFactory.seed = seed
+
+def GetLanguage(text:str) -> str:
+
+    # This function detect the language of a text. If there is no enough evidence
+    # to define the language returns "undefined"
+
+    from langdetect import detect
+
+    try:
+        return detect(text)
+    except Exception:
+        return "undefined"
+
+def DetectMany(detector, texts:list) -> list:
+
+    # This function runs the detector over several texts (defined at module level to be
+    # sent to other processes)
+    return [detector(text) for text in texts]
+
+def NormalizeText(text:str) -> str:
+
+    # Key of the cache: lower case letters of the text separated by one space
+    return NORMALIZE_PATTERN.sub(" ", text.lower()).strip()
+
+class LanguageDetector:
+
+    '''
+    This class detects the language of the comments as Complement of
+    01_ETLYoutubeComments.ipynb ("undefined" for texts with min_words or less, the
+    detector for the rest), resolving first the cheap cases:
+
+        1. Texts written mostly with a script of a single language (korean, japanese
+           kana, thai, greek, hebrew)
+        2. Texts with only ascii characters where english stopwords are at least
+           stopword_ratio of the words
+        3. Texts already seen, by their normalized text (lower case letters only)
+
+    The remaining texts (each different normalized text once) go to the detector in a
+    pool of processes
+
+    Parameters
+    ----------
+
+        detector: callable; default=GetLanguage
+            Function that returns the language of a text (langdetect.detect). It must be
+            defined at module level if n_jobs is not 1
+
+        min_words: int; default=4
+            Texts with this number of words or less are "undefined" (langdetect doesn't
+            work very well in short sentences)
+
+        stopword_ratio: float; default=0.3
+            Minimum fraction of english stopwords of an ascii text to be english. None
+            disables the heuristics (1 and 2)
+
+        min_stopwords: int; default=2
+            Minimum number of english stopwords of an ascii text to be english
+
+        cache_size: int; default=100000
+            Normalized texts kept in the cache, the oldest ones are removed first
+
+        n_jobs: int; default=1
+            Number of processes. None uses all the cpus and 1 doesn't create any process
+
+        chunksize: int; default=200
+            Texts sent to each process at once
+
+        seed: int; default=0
+            Seed of langdetect in each process (DetectorFactory.seed)
+
+    Examples
+    --------
+
+    >>> language_detector = LanguageDetector(n_jobs = None)
+    >>> comments_df["code"] = language_detector.Detect(comments_df["comment"])
+    >>> language_detector.stats
+    Counter({'heuristic': ..., 'detector': ..., 'short': ..., 'cache': ...})
+
+    '''
+
+    def __init__(self, detector = None, min_words:int = 4, stopword_ratio:float = 0.3,
+                 min_stopwords:int = 2, cache_size:int = 100000, n_jobs:int = 1,
+                 chunksize:int = 200, seed:int = 0):
+
+        self.detector = detector if detector is not None else GetLanguage
+        self.min_words = min_words
+        self.stopword_ratio = stopword_ratio
+        self.min_stopwords = min_stopwords
+        self.cache_size = cache_size
+        self.n_jobs = n_jobs
+        self.chunksize = chunksize
+        self.seed = seed
+
+        self.cache = {}
+        self.stats = Counter()
+
+    def Heuristic(self, text:str) -> str:
+
+        # This function returns the language of the text if a cheap rule is enough,
+        # None otherwise
+
+        if self.stopword_ratio is None:
+            return None
+
+        if text.isascii():
+
+            words = ASCII_WORDS_PATTERN.findall(text.lower())
+            n_stopwords = sum(word in ENGLISH_STOPWORDS for word in words)
+
+            if n_stopwords >= self.min_stopwords and n_stopwords >= self.stopword_ratio * len(words):
+                return "en"
+            return None
+
+        n_letters = len(LETTERS_PATTERN.findall(text))
+        for pattern, language in SCRIPT_LANGUAGES:
+            if len(pattern.findall(text)) > n_letters / 2:
+                return language
+
+        return None
+
+    def RunDetector(self, texts:list) -> list:
+
+        # This function runs the detector over texts, in a pool of processes if n_jobs
+        # is not 1
+
+        if self.n_jobs == 1 or len(texts) <= self.chunksize:
+
+            if self.detector is GetLanguage:
+                InitDetector(self.seed)
+            return DetectMany(self.detector, texts)
+
+        chunks = [texts[start:start + self.chunksize] for start in range(0, len(texts), self.chunksize)]
+        initializer = InitDetector if self.detector is GetLanguage else None
+
+        with Pool(self.n_jobs, initializer = initializer, initargs = (self.seed,)) as pool:
+            languages = pool.starmap(DetectMany, [(self.detector, chunk) for chunk in chunks])
+
+        return [language for chunk in languages for language in chunk]
+
+    def Detect(self, texts) -> list:
+
+        '''
+        This function returns the language of each text
+
+        Parameters
+        ----------
+
+        texts: iterable
+            Texts (str)
+
+        Returns
+        -------
+
+        list: Language code of each text (same order), "undefined" if it can't be defined
+
+        '''
+
+        languages = []
+        pending = {}
+
+        for i, text in enumerate(texts):
+
+            if len(WORDS_PATTERN.split(text)) <= self.min_words:
+                languages.append("undefined")
+                self.stats["short"] += 1
+                continue
+
+            language = self.Heuristic(text)
+            if language is not None:
+                languages.append(language)
+                self.stats["heuristic"] += 1
+                continue
+
+            key = NormalizeText(text)
+            if key in self.cache:
+                languages.append(self.cache[key])
+                self.stats["cache"] += 1
+                continue
+
+            # Repeated texts of the batch are detected once
+            languages.append(None)
+            if key in pending:
+                pending[key][1].append(i)
+                self.stats["cache"] += 1
+            else:
+                pending[key] = (text, [i])
+                self.stats["detector"] += 1
+
+        detected = self.RunDetector([text for text, _ in pending.values()])
+
+        for (key, (_, indexes)), language in zip(pending.items(), detected):
+
+            for i in indexes:
+                languages[i] = language
+
+            self.cache[key] = language
+            if len(self.cache) > self.cache_size:
+                del self.cache[next(iter(self.cache))]
+
+        return languages
+
+def Complement(comments_df:pd.DataFrame, language_detector:LanguageDetector = None) -> pd.DataFrame:
+
+    # Same as Complement of 01_ETLYoutubeComments.ipynb with the comments detected in
+    # batch by LanguageDetector
+
+    print("Detecting language")
+    start = perf_counter()
+
+    language_detector = language_detector if language_detector is not None else LanguageDetector(n_jobs = None)
+    comments_df["code"] = language_detector.Detect(comments_df["comment"])
+
+    print(f"Detecting language took {(perf_counter() - start) / 60} min {dict(language_detector.stats)}")
+
+    return comments_df
+
+def CompareDetectors(texts:list, n_jobs:int = None, seed:int = 0) -> dict:
+
+    '''
+    This function measures LanguageDetector against the loop of the notebook
+    (GetLanguage for each comment with more than 4 words)
+
+    Parameters
+    ----------
+
+    texts: list
+        Comments
+
+    n_jobs: int; default=None
+        Processes used by LanguageDetector. None uses all the cpus
+
+    seed: int; default=0
+        Seed of langdetect
+
+    Returns
+    -------
+
+    dict: Comments per second of both, fraction of comments with the same language and
+        the comments resolved by each step of LanguageDetector
+
+    '''
+
+    InitDetector(seed)
+    start = perf_counter()
+    expected = [GetLanguage(text) if len(WORDS_PATTERN.split(text)) > 4 else "undefined" for text in texts]
+    seconds_per_row = perf_counter() - start
+
+    language_detector = LanguageDetector(n_jobs = n_jobs, seed = seed)
+    start = perf_counter()
+    languages = language_detector.Detect(texts)
+    seconds_batch = perf_counter() - start
+
+    agreement = sum(a == b for a, b in zip(expected, languages)) / max(len(texts), 1)
+
+    # Agreement of the heuristic alone (where the notebook uses the detector)
+    heuristic = [(language_detector.Heuristic(text), language) for text, language in zip(texts, expected)
+                 if len(WORDS_PATTERN.split(text)) > 4]
+    heuristic = [(guess, language) for guess, language in heuristic if guess is not None]
+
+    return {
+        "comments": len(texts),
+        "per_row_comments_sec": len(texts) / seconds_per_row,
+        "batch_comments_sec": len(texts) / seconds_batch,
+        "speedup": seconds_per_row / seconds_batch,
+        "agreement": agreement,
+        "heuristic_agreement": sum(a == b for a, b in heuristic) / max(len(heuristic), 1),
+        "steps": dict(language_detector.stats)
+    }
+
+if __name__ == "__main__":
+
+    arguments = CreateArguments()
+
+    comments_df = pd.read_feather(arguments.data) if arguments.data.endswith(".feather") else pd.read_csv(arguments.data)
+    comments = comments_df[arguments.column].dropna().astype(str)
+
+    if arguments.sample is not None:
+        comments = comments.sample(min(arguments.sample, len(comments)), random_state = 0)
+
+    result = CompareDetectors(comments.tolist(), arguments.n_jobs or None)
+
+    print(f"{result['comments']} comments")
+    print(f"langdetect by comment: {result['per_row_comments_sec']:.0f} comments/sec")
+    print(f"LanguageDetector: {result['batch_comments_sec']:.0f} comments/sec ({result['speedup']:.1f}x)")
+    print(f"Same language: {100 * result['agreement']:.2f}% (heuristics alone: {100 * result['heuristic_agreement']:.2f}%)")
+    print(f"Comments by step: {result['steps']}")
@@ -0,0 +1,346 @@
+import io
+import random
+import sqlite3
+import argparse as arg
+from time import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+# Columns of the comments after Complement in 01_ETLYoutubeComments.ipynb, in the order
+# of the staging table
+STAGING_COLUMNS = ["comment", "published_date", "likes", "name", "id_video", "code"]
+
+# Same tables as 00_PostgresDataBaseCreate.sh, used when the database is SQLite
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS languages (
+        id_language INTEGER PRIMARY KEY AUTOINCREMENT,
+        code VARCHAR(9) UNIQUE NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS titles (
+        id_video VARCHAR(12) UNIQUE NOT NULL PRIMARY KEY,
+        title VARCHAR NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS users (
+        id_user INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS comments (
+        id_comment INTEGER PRIMARY KEY AUTOINCREMENT,
+        comment TEXT NOT NULL,
+        published_date DATE,
+        likes INTEGER,
+        id_user INTEGER NOT NULL REFERENCES users (id_user),
+        id_video VARCHAR(12) NOT NULL REFERENCES titles (id_video),
+        id_language SMALLINT NOT NULL REFERENCES languages (id_language)
+    );
+
+    -- Without it SQLite scans users for each staged row to find the names missing
+    -- (postgres uses a hash anti join)
+    CREATE INDEX IF NOT EXISTS idx_users_name ON users (name);
+"""
+
+CREATE_STAGING = """
+    CREATE TEMP TABLE staging_comments (
+        comment TEXT,
+        published_date DATE,
+        likes INTEGER,
+        name VARCHAR,
+        id_video VARCHAR(12),
+        code VARCHAR(9)
+    )
+"""
+
+# Foreign keys resolved for the whole batch at once. users.name is not unique in the
+# schema, new names are added only if they don't exist and the lowest id is used
+UPSERT_LANGUAGES = """
+    INSERT INTO languages (code)
+    SELECT DISTINCT s.code FROM staging_comments s
+    WHERE s.code IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM languages l WHERE l.code = s.code)
+"""
+
+UPSERT_USERS = """
+    INSERT INTO users (name)
+    SELECT DISTINCT s.name FROM staging_comments s
+    WHERE s.name IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM users u WHERE u.name = s.name)
+"""
+
+# Rows that violate the constraints of comments (as Validate of the notebook) are left out
+INSERT_COMMENTS = """
+    INSERT INTO comments (comment, published_date, likes, id_user, id_video, id_language)
+    SELECT s.comment, s.published_date, s.likes, u.id_user, s.id_video, l.id_language
+    FROM staging_comments s
+    JOIN (SELECT name, MIN(id_user) AS id_user FROM users GROUP BY name) u ON u.name = s.name
+    JOIN languages l ON l.code = s.code
+    JOIN titles t ON t.id_video = s.id_video
+    WHERE s.comment IS NOT NULL
+"""
+
+# Aggregate by video and language of 00_PostgresMigration.sql for SQLite (no materialized
+# views, the table is created again by RefreshAggregates)
+SQLITE_AGGREGATE = """
+    CREATE TABLE comments_by_video_language AS
+        SELECT id_video,
+               id_language,
+               COUNT(*) AS n_comments,
+               COUNT(DISTINCT id_user) AS n_users,
+               SUM(likes) AS likes,
+               AVG(LENGTH(comment)) AS mean_length,
+               MIN(published_date) AS first_date,
+               MAX(published_date) AS last_date
+        FROM comments
+        GROUP BY id_video, id_language;
+
+    CREATE UNIQUE INDEX idx_comments_by_video_language
+        ON comments_by_video_language (id_video, id_language);
+"""
+
+def CreateArguments() -> arg.ArgumentParser.parse_args:
+
+    '''
+    This function creates the arguments of the command line
+
+    Returns
+    -------
+
+    argparse: argparse object created by ArgumentParser.parse_args
+
+    '''
+
+    args = arg.ArgumentParser(description="Load synthetic comments with the bulk loader to measure it")
+    args.add_argument("--dsn", dest="dsn", type=str, default=None,
+                    help="Connection string of the postgres database (e.g 'host=localhost dbname=youtube user=me'). Needs psycopg2")
+    args.add_argument("--sqlite", dest="sqlite", type=str, default=":memory:",
+                    help="SQLite database used if --dsn is not given. Default is ':memory:'")
+    args.add_argument("--rows", dest="rows", type=int, default=1000000,
+                    help="Number of comments loaded. Default is 1000000")
+    args.add_argument("--batch-size", dest="batch_size", type=int, default=200000,
+                    help="Comments by batch. Default is 200000")
+
+    return args.parse_args()
+
+def IsSqlite(connection) -> bool:
+
+    # This function checks if a DB-API connection is from sqlite3 (otherwise postgres)
+    return isinstance(connection, sqlite3.Connection)
+
+def CreateSchemaSqlite(connection:sqlite3.Connection) -> None:
+
+    # This function creates the tables of 00_PostgresDataBaseCreate.sh in a SQLite database
+
+    connection.executescript(SQLITE_SCHEMA)
+    connection.commit()
+
+def PrepareBatch(comments_df:pd.DataFrame) -> pd.DataFrame:
+
+    # This function orders the columns as the staging table and truncates the dates to
+    # days (published_date is DATE in the schema)
+
+    batch = comments_df[STAGING_COLUMNS].copy()
+    batch["published_date"] = pd.to_datetime(batch["published_date"]).dt.strftime("%Y-%m-%d")
+    batch["likes"] = batch["likes"].astype("Int64")
+
+    return batch
+
+def StageBatch(connection, cursor, batch:pd.DataFrame) -> None:
+
+    '''
+    This function copies a batch into a new temporary table staging_comments. Postgres
+    uses COPY FROM STDIN (psycopg2 or psycopg 3) and SQLite a single executemany
+
+    Parameters
+    ----------
+
+    connection: DB-API connection
+        Connection to the database (postgres or sqlite3)
+
+    cursor: DB-API cursor
+        Cursor of the connection
+
+    batch: pd.DataFrame
+        Comments returned by PrepareBatch
+
+    '''
+
+    cursor.execute("DROP TABLE IF EXISTS staging_comments")
+    cursor.execute(CREATE_STAGING)
+
+    if IsSqlite(connection):
+        rows = batch.astype(object).where(batch.notna(), None).itertuples(index = False, name = None)
+        cursor.executemany(f"INSERT INTO staging_comments VALUES ({', '.join('?' * len(STAGING_COLUMNS))})", rows)
+        return
+
+    # \N as NULL so empty comments stay as empty strings
+    buffer = io.StringIO()
+    batch.to_csv(buffer, index = False, header = False, na_rep = "\\N")
+    buffer.seek(0)
+
+    copy_sql = f"COPY staging_comments ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    if hasattr(cursor, "copy_expert"):
+        cursor.copy_expert(copy_sql, buffer)
+    else:
+        with cursor.copy(copy_sql) as copy:
+            copy.write(buffer.getvalue())
+
+def UpsertTitles(connection, cursor, titles_df:pd.DataFrame) -> None:
+
+    # This function adds the videos (id_video, title) not found in titles
+
+    placeholder = "?" if IsSqlite(connection) else "%s"
+    cursor.executemany(f"""
+        INSERT INTO titles (id_video, title)
+        SELECT {placeholder}, {placeholder}
+        WHERE NOT EXISTS (SELECT 1 FROM titles WHERE id_video = {placeholder})
+    """, [(ID, title, ID) for ID, title in titles_df[["id_video", "title"]].itertuples(index = False)])
+
+def RefreshAggregates(connection) -> None:
+
+    # This function updates comments_by_video_language after loading comments, if the
+    # migration created it. On postgres the partitions of the years missing are created
+    # first (create_comments_partitions of 00_PostgresMigration.sql)
+
+    if IsSqlite(connection):
+        exists = connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'comments_by_video_language'").fetchone()
+        if exists:
+            connection.executescript("DROP TABLE IF EXISTS comments_by_video_language;" + SQLITE_AGGREGATE)
+            connection.commit()
+        return
+
+    with connection.cursor() as cursor:
+
+        cursor.execute("SELECT to_regproc('create_comments_partitions') IS NOT NULL, "
+                       "to_regclass('comments_by_video_language') IS NOT NULL")
+        has_partitions, has_aggregate = cursor.fetchone()
+
+        if has_partitions:
+            cursor.execute("SELECT create_comments_partitions()")
+        if has_aggregate:
+            cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY comments_by_video_language")
+
+    connection.commit()
+
+def LoadComments(connection, comments_df:pd.DataFrame, titles_df:pd.DataFrame = None,
+                 batch_size:int = 200000, refresh_aggregates:bool = True) -> dict:
+
+    '''
+    This function loads the comments with set-based statements instead of one ORM object
+    by row: each batch is copied into a temporary table, the missing languages and users
+    are inserted with one statement each and the comments with their foreign keys with
+    another one. Each batch is a transaction. At the end comments_by_video_language is
+    refreshed (RefreshAggregates) if it exists
+
+    Parameters
+    ----------
+
+    connection: DB-API connection
+        Connection to the database created by 00_PostgresDataBaseCreate.sh (psycopg2,
+        psycopg 3) or a sqlite3 connection with the tables of CreateSchemaSqlite
+
+    comments_df: pd.DataFrame
+        Comments with the columns comment, published_date, likes, name, id_video and code
+        (the DataFrame returned by Complement in 01_ETLYoutubeComments.ipynb)
+
+    titles_df: pd.DataFrame; default=None
+        Videos with the columns id_video and title, added to titles if they don't exist
+
+    batch_size: int; default=200000
+        Comments by batch
+
+    refresh_aggregates: bool; default=True
+        Refresh comments_by_video_language after the load. False when several loads are
+        refreshed once at the end (e.g. the batches of IncrementalExtract)
+
+    Returns
+    -------
+
+    dict: The number of comments staged and inserted (rows violating the constraints of
+        comments are skipped) and the seconds taken
+
+    '''
+
+    start = time()
+    staged, inserted = 0, 0
+
+    cursor = connection.cursor()
+
+    try:
+
+        if titles_df is not None:
+            UpsertTitles(connection, cursor, titles_df)
+            connection.commit()
+
+        for batch_start in range(0, len(comments_df), batch_size):
+
+            batch = PrepareBatch(comments_df.iloc[batch_start:batch_start + batch_size])
+
+            StageBatch(connection, cursor, batch)
+            cursor.execute(UPSERT_LANGUAGES)
+            cursor.execute(UPSERT_USERS)
+            cursor.execute(INSERT_COMMENTS)
+            inserted += cursor.rowcount
+            cursor.execute("DROP TABLE staging_comments")
+
+            connection.commit()
+            staged += len(batch)
+
+            print(f"\tComments loaded: {inserted}/{len(comments_df)}", end = "\r")
+
+        if refresh_aggregates:
+            RefreshAggregates(connection)
+
+    except Exception:
+        connection.rollback()
+        raise
+
+    finally:
+        cursor.close()
+
+    print(f"\nLoading took {time() - start} secs")
+
+    return {"staged": staged, "inserted": inserted, "skipped": staged - inserted, "seconds": time() - start}
+
+def MakeComments(n_rows:int, n_videos:int = 7, n_users:int = 100000, seed:int = 0) -> "(pd.DataFrame, pd.DataFrame)":
+
+    # This function creates synthetic comments and titles with the columns expected by LoadComments
+
+    rng = random.Random(seed)
+    words = ["great", "video", "love", "science", "boring", "thanks", "awful", "nuclear", "whales", "history"]
+    codes = ["en", "es", "de", "fr", "pt", "undefined"]
+    videos_id = [f"video{video:07d}" for video in range(n_videos)]
+    newest = datetime(2023, 6, 1)
+
+    comments_df = pd.DataFrame({
+        "comment": [" ".join(rng.choices(words, k = rng.randint(3, 15))) for _ in range(n_rows)],
+        "published_date": [newest - timedelta(minutes = rng.randint(0, 10**6)) for _ in range(n_rows)],
+        "likes": [rng.randint(0, 100) for _ in range(n_rows)],
+        "name": [f"user_{rng.randint(0, n_users)}" for _ in range(n_rows)],
+        "id_video": [rng.choice(videos_id) for _ in range(n_rows)],
+        "code": [rng.choice(codes) for _ in range(n_rows)]
+    })
+
+    titles_df = pd.DataFrame({"id_video": videos_id, "title": [f"Title {ID}" for ID in videos_id]})
+
+    return comments_df, titles_df
+
+if __name__ == "__main__":
+
+    arguments = CreateArguments()
+
+    if arguments.dsn is not None:
+        import psycopg2
+        connection = psycopg2.connect(arguments.dsn)
+    else:
+        connection = sqlite3.connect(arguments.sqlite)
+        CreateSchemaSqlite(connection)
+
+    comments_df, titles_df = MakeComments(arguments.rows)
+    result = LoadComments(connection, comments_df, titles_df, arguments.batch_size)
+    connection.close()
+
+    print(f"{result['inserted']} comments inserted ({result['skipped']} skipped) in {result['seconds']:.1f} secs "
+          f"({result['inserted'] / result['seconds']:.0f} comments/sec)")
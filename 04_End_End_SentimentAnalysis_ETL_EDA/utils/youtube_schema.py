@@ -0,0 +1,247 @@
+import os
+import json
+import sqlite3
+import argparse as arg
+from time import perf_counter
+from datetime import datetime, timedelta
+
+from utils.youtube_load import IsSqlite, CreateSchemaSqlite, LoadComments, MakeComments, SQLITE_AGGREGATE
+
+MIGRATION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "00_PostgresMigration.sql")
+
+# Same indexes and aggregate as 00_PostgresMigration.sql for the SQLite stand-in (SQLite
+# has no partitions nor materialized views, the aggregate is a table created again)
+SQLITE_MIGRATION = """
+    CREATE INDEX IF NOT EXISTS idx_comments_id_user ON comments (id_user);
+    CREATE INDEX IF NOT EXISTS idx_comments_id_video_date ON comments (id_video, published_date);
+    CREATE INDEX IF NOT EXISTS idx_comments_id_language ON comments (id_language);
+    CREATE INDEX IF NOT EXISTS idx_comments_published_date ON comments (published_date);
+    CREATE INDEX IF NOT EXISTS idx_users_name ON users (name);
+    DROP TABLE IF EXISTS comments_by_video_language;
+""" + SQLITE_AGGREGATE + """
+    ANALYZE;
+"""
+
+def CreateArguments() -> arg.ArgumentParser.parse_args:
+
+    '''
+    This function creates the arguments of the command line
+
+    Returns
+    -------
+
+    argparse: argparse object created by ArgumentParser.parse_args
+
+    '''
+
+    args = arg.ArgumentParser(description="Plans and times of the EDA queries before and after the migration of the schema")
+    args.add_argument("--dsn", dest="dsn", type=str, default=None,
+                    help="Connection string of the postgres database created by 00_PostgresDataBaseCreate.sh. Needs psycopg2")
+    args.add_argument("--sqlite", dest="sqlite", type=str, default=":memory:",
+                    help="SQLite database used if --dsn is not given. Default is ':memory:'")
+    args.add_argument("--rows", dest="rows", type=int, default=1000000,
+                    help="Synthetic comments loaded if the table comments is empty. Default is 1000000")
+    args.add_argument("--output", dest="output", type=str, default=None,
+                    help="JSON file where the plans and times are saved")
+
+    return args.parse_args()
+
+def Migrate(connection) -> None:
+
+    '''
+    This function applies 00_PostgresMigration.sql (indexes of the foreign keys and the
+    dates, comments partitioned by year and the aggregate comments_by_video_language). On
+    SQLite only the indexes and the aggregate are created
+
+    Parameters
+    ----------
+
+    connection: DB-API connection
+        Connection to the database (psycopg2 or sqlite3)
+
+    '''
+
+    if IsSqlite(connection):
+        connection.executescript(SQLITE_MIGRATION)
+        connection.commit()
+        return
+
+    with open(MIGRATION_PATH, "r", encoding = "utf-8") as iFile:
+        migration = iFile.read()
+
+    with connection.cursor() as cursor:
+        cursor.execute(migration)
+    connection.commit()
+
+def BenchmarkQueries(connection) -> dict:
+
+    # This function returns the EDA queries measured, by name. The video, user and dates
+    # are taken from the data (the most commented video and user, the last 30 days)
+
+    cursor = connection.cursor()
+
+    cursor.execute("SELECT id_video FROM comments GROUP BY id_video ORDER BY COUNT(*) DESC LIMIT 1")
+    video = cursor.fetchone()[0]
+    cursor.execute("SELECT id_user FROM comments GROUP BY id_user ORDER BY COUNT(*) DESC LIMIT 1")
+    user = cursor.fetchone()[0]
+    cursor.execute("SELECT MAX(published_date) FROM comments")
+    last_date = str(cursor.fetchone()[0])
+    cursor.close()
+
+    last_date = last_date[:10]
+    first_date = (datetime.strptime(last_date, "%Y-%m-%d") - timedelta(days = 30)).strftime("%Y-%m-%d")
+
+    return {
+        "comments_of_video": f"SELECT COUNT(*), AVG(likes) FROM comments WHERE id_video = '{video}'",
+        "comments_of_month": f"SELECT COUNT(*), SUM(likes) FROM comments "
+                             f"WHERE published_date BETWEEN '{first_date}' AND '{last_date}'",
+        "video_by_day": f"SELECT published_date, COUNT(*) FROM comments "
+                        f"WHERE id_video = '{video}' AND published_date >= '{first_date}' GROUP BY published_date",
+        "comments_of_user": f"SELECT comment, likes FROM comments WHERE id_user = {user}",
+        "video_language": "SELECT id_video, id_language, COUNT(*), SUM(likes) FROM comments GROUP BY id_video, id_language"
+    }
+
+def PlanNodes(plan:dict) -> list:
+
+    # This function returns the nodes of a postgres plan (FORMAT JSON) as text, e.g
+    # "Index Scan on comments_y2023 using comments_y2023_id_video_published_date_idx"
+
+    node = plan["Node Type"]
+    if "Relation Name" in plan:
+        node += f" on {plan['Relation Name']}"
+    if "Index Name" in plan:
+        node += f" using {plan['Index Name']}"
+
+    nodes = [node]
+    for child in plan.get("Plans", []):
+        nodes.extend(PlanNodes(child))
+
+    return nodes
+
+def ExplainQuery(connection, query:str, repeat:int = 3) -> dict:
+
+    '''
+    This function returns the plan and the time of a query. Postgres uses EXPLAIN ANALYZE
+    and SQLite EXPLAIN QUERY PLAN and the best time of several runs
+
+    Parameters
+    ----------
+
+    connection: DB-API connection
+        Connection to the database (psycopg2 or sqlite3)
+
+    query: str
+        Query measured
+
+    repeat: int; default=3
+        Runs of the query (the best one is kept)
+
+    Returns
+    -------
+
+    dict: The nodes of the plan, the time in milliseconds and the cost estimated by
+        postgres (None on SQLite)
+
+    '''
+
+    cursor = connection.cursor()
+
+    if IsSqlite(connection):
+
+        cursor.execute("EXPLAIN QUERY PLAN " + query)
+        nodes = [row[-1] for row in cursor.fetchall()]
+
+        times = []
+        for _ in range(repeat):
+            start = perf_counter()
+            cursor.execute(query).fetchall()
+            times.append(1000 * (perf_counter() - start))
+
+        cursor.close()
+        return {"plan": nodes, "ms": min(times), "cost": None}
+
+    times = []
+    for _ in range(repeat):
+        cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query)
+        plan = cursor.fetchone()[0][0]
+        times.append(plan["Planning Time"] + plan["Execution Time"])
+
+    cursor.close()
+    connection.rollback()
+
+    return {"plan": PlanNodes(plan["Plan"]), "ms": min(times), "cost": plan["Plan"]["Total Cost"]}
+
+def CompareMigration(connection) -> dict:
+
+    '''
+    This function measures the EDA queries, applies the migration and measures them
+    again. The aggregate by video and language is also measured against
+    comments_by_video_language. Not every query improves: the GROUP BY of the whole
+    table (video_language) can be slower after it if the planner reads the table
+    through idx_comments_id_video_date
+
+    Parameters
+    ----------
+
+    connection: DB-API connection
+        Connection to a database with comments (psycopg2 or sqlite3)
+
+    Returns
+    -------
+
+    dict: Plans and times of each query before and after the migration
+
+    '''
+
+    queries = BenchmarkQueries(connection)
+    results = {name: {"before": ExplainQuery(connection, query)} for name, query in queries.items()}
+
+    start = perf_counter()
+    Migrate(connection)
+    print(f"Migration took {perf_counter() - start:.1f} secs")
+
+    for name, query in queries.items():
+        results[name]["after"] = ExplainQuery(connection, query)
+
+    results["video_language"]["aggregate"] = ExplainQuery(connection,
+        "SELECT id_video, id_language, n_comments, likes FROM comments_by_video_language")
+
+    return results
+
+if __name__ == "__main__":
+
+    arguments = CreateArguments()
+
+    if arguments.dsn is not None:
+        import psycopg2
+        connection = psycopg2.connect(arguments.dsn)
+    else:
+        connection = sqlite3.connect(arguments.sqlite)
+        CreateSchemaSqlite(connection)
+
+    cursor = connection.cursor()
+    cursor.execute("SELECT COUNT(*) FROM comments")
+    if cursor.fetchone()[0] == 0:
+        LoadComments(connection, *MakeComments(arguments.rows))
+    cursor.close()
+
+    results = CompareMigration(connection)
+    connection.close()
+
+    for name, result in results.items():
+        print(f"\n{name}")
+        for stage, measure in result.items():
+            print(f"\t{stage}: {measure['ms']:.2f} ms | " + " -> ".join(measure["plan"]))
+
+    # Queries over the whole table can get slower with the new indexes (e.g. the planner
+    # reads comments through idx_comments_id_video_date for video_language), they are
+    # reported apart from the ones that improved
+    slower = {name: result["after"]["ms"] / result["before"]["ms"] for name, result in results.items()
+              if result["after"]["ms"] > result["before"]["ms"]}
+
+    print("\nSlower after the migration: " + (", ".join(f"{name} ({ratio:.2f}x the time)" for name, ratio in slower.items())
+                                              if slower else "none"))
+
+    if arguments.output is not None:
+        with open(arguments.output, "w", encoding = "utf-8") as oFile:
+            json.dump(results, oFile, indent = 2)
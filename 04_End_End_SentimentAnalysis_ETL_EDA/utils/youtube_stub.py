@@ -0,0 +1,199 @@
+import json
+import random
+import threading
+import argparse as arg
+from time import perf_counter, sleep
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+
+from utils.youtube_extract import CommentFetcher, QuotaLimiter, QuotaExceeded
+
+def CreateArguments() -> arg.ArgumentParser.parse_args:
+
+    '''
+    This function creates the arguments of the command line
+
+    Returns
+    -------
+
+    argparse: argparse object created by ArgumentParser.parse_args
+
+    '''
+
+    args = arg.ArgumentParser(description="Extract comments from a local stub of the YouTube API to measure CommentFetcher")
+    args.add_argument("--videos", dest="videos", type=int, default=200,
+                    help="Number of videos. Default is 200")
+    args.add_argument("--comments", dest="comments", type=int, default=500,
+                    help="Comments by video. Default is 500")
+    args.add_argument("--latency", dest="latency", type=float, default=0.05,
+                    help="Seconds taken by each request. Default is 0.05")
+    args.add_argument("--failure-rate", dest="failure_rate", type=float, default=0.02,
+                    help="Fraction of requests that fail with a transient error. Default is 0.02")
+    args.add_argument("--quota", dest="quota", type=int, default=10000,
+                    help="Units of quota of the API key. Default is 10000")
+    args.add_argument("--threads", dest="threads", type=int, nargs="+", default=[1, 8, 32],
+                    help="Number of threads compared. Default is 1 8 32")
+
+    return args.parse_args()
+
+class StubHttpError(Exception):
+
+    # Same attributes used from googleapiclient.errors.HttpError
+
+    def __init__(self, status:int, reason:str):
+
+        self.resp = SimpleNamespace(status = status)
+        self.content = json.dumps({"error": {"code": status, "errors": [{"reason": reason}]}}).encode("utf-8")
+        super().__init__(f"<HttpError {status}: {reason}>")
+
+class StubYoutube:
+
+    '''
+    This class answers commentThreads().list(...).execute() and videos().list(...).execute()
+    (statistics) as the client returned by googleapiclient.discovery.build("youtube", "v3"),
+    with comments kept in memory, a latency by request, random transient errors and a quota
+
+    Parameters
+    ----------
+
+        comments_by_video: dict
+            List of comments (dicts with comment, published_date, name and likes) by video
+            id, the newest first as the API returns them
+
+        latency: float; default=0.0
+            Seconds taken by each request
+
+        failure_rate: float; default=0.0
+            Fraction of requests that fail with an error 503 (backendError)
+
+        quota: int; default=None
+            Requests accepted before answering 403 (quotaExceeded). None means no limit
+
+        seed: int; default=0
+            Seed of the failures
+
+    '''
+
+    def __init__(self, comments_by_video:dict, latency:float = 0.0, failure_rate:float = 0.0,
+                 quota:int = None, seed:int = 0):
+
+        self.comments_by_video = comments_by_video
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.quota = quota
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def commentThreads(self) -> SimpleNamespace:
+        return SimpleNamespace(list = lambda part, videoId, pageToken = None, maxResults = 20, **kwargs:
+                               SimpleNamespace(execute = lambda: self.Execute(videoId, pageToken, maxResults)))
+
+    def videos(self) -> SimpleNamespace:
+        return SimpleNamespace(list = lambda part, id, **kwargs:
+                               SimpleNamespace(execute = lambda: self.Statistics(id.split(","))))
+
+    def AddComments(self, video_id:str, comments:list) -> None:
+
+        # New comments (the newest first) published on a video
+        self.comments_by_video[video_id] = comments + self.comments_by_video.get(video_id, [])
+
+    def Call(self) -> None:
+
+        # Latency, quota and failures of each request
+
+        with self.lock:
+            self.requests += 1
+            requests = self.requests
+            fails = self.random.random() < self.failure_rate
+
+        sleep(self.latency)
+
+        if self.quota is not None and requests > self.quota:
+            raise StubHttpError(403, "quotaExceeded")
+        if fails:
+            raise StubHttpError(503, "backendError")
+
+    def Statistics(self, videos_id:list) -> dict:
+
+        self.Call()
+
+        return {"items": [{"id": video_id, "statistics": {"commentCount": str(len(self.comments_by_video[video_id]))}}
+                          for video_id in videos_id if video_id in self.comments_by_video]}
+
+    def Execute(self, video_id:str, page_token:str, max_results:int) -> dict:
+
+        self.Call()
+
+        if video_id not in self.comments_by_video:
+            raise StubHttpError(404, "videoNotFound")
+
+        # The token is the number of comments left (counted from the oldest one), so it
+        # still points to the same comment after AddComments as a cursor of the API
+        comments = self.comments_by_video[video_id]
+        start = len(comments) - int(page_token) if page_token else 0
+        end = start + min(max_results, 100)
+
+        response = {"items": [{"snippet": {"topLevelComment": {"snippet": {
+            "textDisplay": comment["comment"],
+            "publishedAt": comment["published_date"],
+            "authorDisplayName": comment["name"],
+            "likeCount": comment["likes"]
+        }}}} for comment in comments[start:end]]}
+
+        if end < len(comments):
+            response["nextPageToken"] = str(len(comments) - end)
+
+        return response
+
+def MakeComments(n_videos:int, comments_per_video:int, seed:int = 0) -> dict:
+
+    # This function creates synthetic comments by video id, the newest first
+
+    rng = random.Random(seed)
+    words = ["great", "video", "love", "science", "boring", "thanks", "awful", "nuclear", "whales", "history"]
+    newest = datetime(2023, 6, 1)
+
+    comments_by_video = {}
+    for video in range(n_videos):
+
+        comments = []
+        for i in range(comments_per_video):
+            published = newest - timedelta(minutes = 7 * i + rng.randint(0, 6))
+            comments.append({
+                "comment": " ".join(rng.choices(words, k = rng.randint(3, 15))),
+                "published_date": published.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "name": f"user_{rng.randint(0, 5000)}",
+                "likes": rng.randint(0, 100)
+            })
+
+        comments_by_video[f"video{video:07d}"] = comments
+
+    return comments_by_video
+
+if __name__ == "__main__":
+
+    arguments = CreateArguments()
+
+    comments_by_video = MakeComments(arguments.videos, arguments.comments)
+    expected = sum(map(len, comments_by_video.values()))
+
+    for n_threads in arguments.threads:
+
+        stub = StubYoutube(comments_by_video, arguments.latency, arguments.failure_rate)
+        fetcher = CommentFetcher(client_factory = lambda: stub, n_threads = n_threads,
+                                 limiter = QuotaLimiter(arguments.quota), base_delay = 0.01)
+
+        start = perf_counter()
+        n_comments, n_pages = 0, 0
+        try:
+            for page in fetcher.FetchPages(list(comments_by_video)):
+                n_comments += len(page.comments)
+                n_pages += 1
+        except QuotaExceeded as error:
+            print(f"\t{error}")
+
+        seconds = perf_counter() - start
+        print(f"{n_threads} threads: {n_comments}/{expected} comments, {n_pages} pages, "
+              f"{stub.requests} requests ({fetcher.limiter.used} units) in {seconds:.2f} secs "
+              f"({n_pages / seconds:.1f} pages/sec)")